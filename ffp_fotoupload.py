@@ -8,209 +8,540 @@ process them (image rotation, rescaling) and upload them to various ftps servers
 # Author: Marius Pfeffer (neo0x3d)
 # License: MIT
 
+# Only lightweight modules are imported here, the http server (flask, flask_socketio,
+# mutagen) is imported in daemon mode only, so the single upload mode starts fast.
 import argparse
-import json
+import atexit
 import logging
-import multiprocessing
 import os
-import threading
+import signal
+import sys
 import time
 from datetime import datetime
 
-from flask import Flask, render_template, request, send_from_directory
-from flask_socketio import SocketIO
-from mutagen.mp3 import MP3
+from libmultiupload import (analyze_source, emailmod, job_history, job_scheduler, job_spool, logqueue,
+                            settings, supervisor, upload_routine)
+
+# exit codes of the single upload mode
+EXIT_OK = 0
+EXIT_INVALID_MODE = 1
+EXIT_SOURCE_ERROR = 2
+EXIT_NO_FILES = 3
+EXIT_JOB_FAILED = 4
+EXIT_CONFIG_ERROR = 5
+
+################################################################################
+# set possible cli arguments
+################################################################################
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter,
+                                     epilog="exit codes (single upload, replay and loadtest mode): 0 ok, "
+                                            "1 invalid startup mode, 2 source error, 3 no matching files, "
+                                            "4 job failed, 5 invalid config file")
+    parser.add_argument("--source", help="Source path for upload, process it once and exit")  # directory
+    parser.add_argument("--daemon", action='store_true', help="Run as a daemon with http server")
+    parser.add_argument("--spool-worker", action='store_true',
+                        help="Run uploaders only, claiming jobs from the shared spool (see config spool)")
+    parser.add_argument("--replay", help="Re-run an archived job folder against local stand-in FTPS/SMTP servers")
+    parser.add_argument("--loadtest", action='store_true',
+                        help="Run the daemon against stand-in servers with synthetic cards (see config loadtest)")
+    parser.add_argument("--profile", action='store_true', help="Write cProfile data of every stage (see config profile.path)")
+    parser.add_argument("--config", default="ffp_fotoupload_config.json", help="Path to the json config file")
+    args = parser.parse_args()
 
-from libmultiupload import analyze_source, upload_routine
 
 ################################################################################
 # global config
 ################################################################################
 
 if __name__ == "__main__":
-    # set json config file (use full path !)
-    with open("ffp_fotoupload_config.json") as config_fh:
-        config = json.load(config_fh)
+    # set json config file (use full path !), validated before anything is started
+    try:
+        config = settings.load(args.config, {("profile", "enable"): True} if args.profile else None)
+    except settings.ConfigError as exceptmsg:
+        print(exceptmsg, file=sys.stderr)
+        sys.exit(EXIT_CONFIG_ERROR)
 
     # set timestamp format
     timestamp = datetime.now().strftime(config["timestamp"])
 
-    # set logging
-    logfile = config["log"]["path"] + timestamp + ".log"
-    loggerinstance = logging.getLogger(__name__)
-    logging.basicConfig(level=logging.DEBUG,
-                        filename=logfile,
-                        format='%(asctime)s %(levelname)s: %(message)s')  # include timestamp
-    # https://docs.python.org/2/library/logging.html?highlight=logging#integration-with-the-warnings-module
-    logging.captureWarnings(True)
-    # needs warning module?
-
-    loggerinstance = logging.getLogger(__name__)
-    loggerinstance.info("Start of logfile: " + timestamp)
+    # set logging, all processes log via a queue into one size rotated logfile
+    logfile = os.path.join(config["log"]["path"], timestamp + ".log")
+    log_queue, log_listener = logqueue.start_listener(config, logfile)
+    atexit.register(log_listener.stop)
+    logging.info("Start of logfile: %s", timestamp)
 
 
 ################################################################################
-# set possible cli arguments
+# single upload mode
 ################################################################################
 
-if __name__ == "__main__":
-    parser = argparse.ArgumentParser(description=__doc__)
-    parser.add_argument("--source", help="Source path for upload")  # directory
-    parser.add_argument("--daemon", action='store_true', help="Run as a daemon with http server")
-    args = args = parser.parse_args()
+class StatusLog:
+    """
+    Replacement for the webui status queue in single upload mode, statuses are only logged
+    """
+
+    def put(self, status):
+        logging.debug("status: %s", status)
+
+
+def single_upload(source):
+    """
+    Analyze one source and process all resulting jobs in this process
+
+    Args:
+        source: source folder or partition
+
+    Returns:
+        exit code (see EXIT_*)
+    """
+    joblist = analyze_source.analyze_move_userfeedback(source, StatusLog(), config)
+    if joblist == -1:
+        logging.error("analyzing source failed: %s", source)
+        return EXIT_SOURCE_ERROR
+    if not joblist:
+        logging.warning("no jobs created from source: %s", source)
+        return EXIT_NO_FILES
+
+    exit_code = EXIT_OK
+    for job in joblist:
+        if upload_routine.upload_routine(job, config) == 0:
+            logging.info("processing job: %s was successfull", job)
+        else:
+            logging.warning("processing job: %s returned != 0", job)
+            exit_code = EXIT_JOB_FAILED
+    return exit_code
 
 
 ################################################################################
 # daemon processes
 ################################################################################
 
-def analyzer_proc(analyze_q, job_q, status_q):
+def analyzer_proc(analyze_q, ready_q, status_q, log_q, job_slots, control_q, name):
     """
     Analyzer routine (analyze source, copy to local machine)
 
     Args:
-        analyze_q: queue for elements to be analyzed
-        job_q: queue for elements to be treated by the uploader process pool
+        analyze_q: queue of (source, enqueued) to be analyzed
+        ready_q: queue of (source, job, enqueued) for the job dispatcher (see job_scheduler)
         status_q: status queue for the webui
+        log_q: queue of the central logging listener
+        job_slots: job_scheduler.JobSlots limiting the jobs in temp_path
+        control_q: report queue of the supervisor
+        name: worker name (supervisor)
     """
-    logging.debug("process working: " + str(os.getpid()))
+    global config
+    settings.install_sighup()
+    logqueue.setup_worker(log_q, logqueue.get_level(config))
+    supervisor.setup_worker(control_q, name)
+    logging.debug("process working: %s", os.getpid())
     while True:
-        to_analyze = analyze_q.get(True)
-        #print (os.getpid(), "analyzer: ", str(to_analyze))
-        logging.debug(str(os.getpid()) + " got from analyze_queue: " + str(to_analyze))
-        joblist = analyze_source.analyze_move_userfeedback(to_analyze, status_q, config)
-        for job in joblist:
-            job_q.put(job)
-            logging.debug("analyzed, put into job queue: " + str(job))
-
-
-def upload_proc(job_q):
+        item = analyze_q.get(True)
+        supervisor.report_item(item)
+        # changed config file or SIGHUP: the next source is analyzed with the new config
+        config = settings.refresh(config)
+        to_analyze, enqueued = item
+        logging.debug("%s got from analyze_queue: %s (waited %.1fs)", os.getpid(), to_analyze,
+                      time.time() - enqueued)
+
+        def job_ready(job):
+            if config["spool"]["enable"]:
+                # claimed by any uploader (also on other hosts), temp_path is free again
+                try:
+                    job_spool.publish(config, job)
+                except OSError as exceptmsg:
+                    # the job stays in temp_path (or incoming/ of the spool), the slot is freed anyway
+                    logging.exception("publishing job %s to the spool failed", job)
+                    job_history.record_job(config, os.path.basename(os.path.normpath(job)), status="failed",
+                                           finished=time.time())
+                    emailmod.send_err("error in job_spool.publish()",
+                                      "job {} not published: {}".format(job, exceptmsg), config)
+                finally:
+                    job_slots.release_own()
+                return
+            # every job is queued as soon as it is copied, it frees its slot after the upload
+            job_slots.hand_over()
+            ready_q.put((to_analyze, job, time.time()))
+            logging.debug("analyzed, put into job queue: %s", job)
+
+        joblist = analyze_source.analyze_move_userfeedback(to_analyze, status_q, config, job_slots, job_ready)
+        if joblist == -1:
+            logging.error("analyzing source failed: %s", to_analyze)
+        supervisor.report_item(None)
+
+
+def upload_proc(job_q, status_q, log_q, job_slots, control_q, name):
     """
     Uploader routine (take data from lokal folder, process it and upload it)
 
     Args:
-        job_q: queue for the jobs to work on
+        job_q: queue of (source, job, enqueued) to work on
+        status_q: status queue for the webui (progress events)
+        log_q: queue of the central logging listener
+        job_slots: job_scheduler.JobSlots limiting the jobs in temp_path, released after every job
+        control_q: report queue of the supervisor
+        name: worker name (supervisor)
     """
-    logging.debug("process working: " + str(os.getpid()))
+    global config
+    settings.install_sighup()
+    logqueue.setup_worker(log_q, logqueue.get_level(config))
+    supervisor.setup_worker(control_q, name)
+    logging.debug("process working: %s", os.getpid())
     while True:
-        job = job_q.get(True)  # wait until an element is present
-        #print (os.getpid(), " uploader: ", str(job))
-        logging.debug(str(os.getpid()) + " received job: " + str(job))
-        ret = upload_routine.upload_routine(job, config)
+        item = job_q.get(True)  # wait until an element is present
+        supervisor.report_item(item)
+        # changed config file or SIGHUP: the next job runs with the new config
+        config = settings.refresh(config)
+        source, job, enqueued = item
+        queue_wait = time.time() - enqueued
+        logging.info("%s received job: %s from %s, waited %.1fs in queue", os.getpid(), job, source, queue_wait)
+        job_history.record_job(config, os.path.basename(os.path.normpath(job)), queue_wait=queue_wait)
+        ret = upload_routine.upload_routine(job, config, status_q)
+        # not released if the worker crashes or is killed: the job is requeued with its slot
+        job_slots.release_job()
+        supervisor.report_item(None)
         if ret == 0:
-            logging.info("processing job: " + str(job) + "was successfull")
+            logging.info("processing job: %s was successfull", job)
         else:
-            logging.warning("processing job: " + str(job) + "returned != 0")
+            logging.warning("processing job: %s returned != 0", job)
 
 
-# start job queue and pool of workers
-if __name__ == '__main__':
-    analyze_queue = multiprocessing.Queue()  # analyzing queue for incomming jobs
-    job_queue = multiprocessing.Queue()  # job queue for working and uploading
-    status_queue = multiprocessing.Queue()  # statur for the webui
-    proc_pool = multiprocessing.Pool(1, analyzer_proc, (analyze_queue, job_queue, status_queue,))
-    upload_pool = multiprocessing.Pool(1, upload_proc, (job_queue,))
+def spool_upload_proc(status_q, log_q, control_q, name):
+    """
+    Uploader routine of the shared spool: claim a job, process it while renewing its lease
 
+    Args:
+        status_q: status queue for the webui (None without webui)
+        log_q: queue of the central logging listener
+        control_q: report queue of the supervisor
+        name: worker name (supervisor)
+    """
+    global config
+    settings.install_sighup()
+    logqueue.setup_worker(log_q, logqueue.get_level(config))
+    supervisor.setup_worker(control_q, name)
+    owner = job_spool.make_owner(name)
+    logging.debug("process working: %s, spool owner %s", os.getpid(), owner)
+    while True:
+        config = settings.refresh(config)
+        claimed = job_spool.claim_next(config, owner)
+        if claimed is None:
+            time.sleep(config["spool"]["poll_s"])
+            continue
+        job, lease = claimed
+        supervisor.report_item(job)
+        heartbeat = job_spool.Heartbeat(config, lease)
+        heartbeat.start()
+        ret = upload_routine.upload_routine(job, config, status_q)
+        heartbeat.stop()
+        job_spool.finish(config, job, lease)
+        supervisor.report_item(None)
+        if ret == 0:
+            logging.info("processing spool job: %s was successfull", job)
+        else:
+            logging.warning("processing spool job: %s returned != 0", job)
 
-################################################################################
-# process cli arguments
-################################################################################
 
-if __name__ == "__main__":
-    if args.source and not args.daemon:
-        logging.info("sarting in single upload mode")
-        analyze_queue.put(args.source)
+def add_spool_workers(workers, status_q):
+    """
+    Add the spool uploaders of this host (config spool.workers) to a supervisor
+    """
+    def requeue_spool_job(name):
+        def requeue(item, stages):
+            # free the lease of the dead process, the job is claimed again at once
+            lease = job_spool.worker_lease(config, item, name)
+            if lease is not None:
+                lease.release()
+        return requeue
+
+    def abandon_spool_job(name):
+        def abandon(item, stages):
+            lease = job_spool.worker_lease(config, item, name)
+            if lease is not None:
+                job_spool.finish(config, item, lease)
+            job_history.record_job(config, os.path.basename(os.path.normpath(item)), status="failed",
+                                   finished=time.time())
+        return abandon
+
+    for number in range(config["spool"]["workers"]):
+        name = "spool_uploader_{}".format(number)
+        workers.add(supervisor.Worker(name, spool_upload_proc, (status_q, log_queue, workers.control_q),
+                                      requeue_spool_job(name), abandon_spool_job(name)))
+
+
+def reload_handler(workers):
+    """
+    Return the SIGHUP handler of the main process: reload the config for the main process
+    (webui, supervisor) now, forward the signal to the workers (reload before their next job)
+    """
+    def reload_config(signum, frame):
+        global config
+        settings.request_reload()
+        config = settings.refresh(config)
+        workers.config = config
+        for worker in workers.workers.values():
+            if worker.process.is_alive():
+                os.kill(worker.process.pid, signal.SIGHUP)
+    return reload_config
+
+
+def stop_handler(workers):
+    """
+    Return the SIGTERM handler of the main process: stop the workers (with the programs
+    they started) so none is left orphaned, then exit
+    """
+    def stop(signum, frame):
+        logging.info("SIGTERM received, stopping")
+        workers.stop()
+        sys.exit(EXIT_OK)
+    return stop
 
-    elif args.daemon and not args.source:
-        logging.info("starting in daemon mode")
-    else:
-        logging.error("Invalid startup mode defined")
-        exit(1)
+
+def run_spool_worker():
+    """
+    Run supervised spool uploaders without analyzer and http server (blocks)
+    """
+    import multiprocessing
+
+    workers = supervisor.Supervisor(config, multiprocessing.Queue())
+    settings.install_sighup(reload_handler(workers))
+    signal.signal(signal.SIGTERM, stop_handler(workers))
+    add_spool_workers(workers, None)
+    workers.run()
 
 
 ################################################################################
 # http server for daemon
 ################################################################################
 
-async_mode = 'threading'
-app = Flask(__name__)
-app.config['SECRET_KEY'] = 'secret!'
-socketio = SocketIO(app, async_mode=async_mode)
-
-
-@app.route('/', methods=['GET', 'POST'])
-def index():
+def run_daemon():
     """
-    main GET/POST handler to deliver html page and receive upload commands
+    Start the supervised analyzer and uploader processes, the webui update thread
+    and the flask socketio server (blocks until the server is stopped)
     """
-    if request.method == "GET":
-        return render_template('webui.html', async_mode=socketio.async_mode)
-    elif request.method == "POST":
-        # POST request, used to queue an upload
-        # print(str(request.form["upload"]))
-        analyze_queue.put(request.form["upload"])
-        return '', 204
+    import multiprocessing
+    import queue
+    import threading
+
+    from flask import Flask, jsonify, render_template, request, send_from_directory
+    from flask_socketio import SocketIO
+    from mutagen.mp3 import MP3
+
+    # start job queues and pool of workers
+    # analyzer -> ready_queue -> dispatcher (round-robin per source) -> job_queue -> uploader,
+    # job_slots limits the jobs in temp_path (backpressure on the analyzer)
+    analyze_queue = multiprocessing.Queue(config["queue"]["analyze_max"])  # (source, enqueued) to analyze
+    ready_queue = multiprocessing.Queue()  # analyzed jobs, bounded by job_slots
+    job_queue = multiprocessing.Queue(1)  # next job for the uploader
+    status_queue = multiprocessing.Queue()  # statur for the webui
+    job_slots = job_scheduler.JobSlots(config["queue"]["jobs_in_temp_max"])
+    control_queue = multiprocessing.Queue()  # worker reports to the supervisor
+
+    def release_analyzer_slots():
+        # slots of the killed analyzer whose jobs were not handed to the uploader yet
+        # (the restarted analyzer is running already)
+        released = job_slots.release_orphaned(workers.workers["analyzer"].process.pid)
+        if released:
+            logging.warning("released %d job slot(s) of the killed analyzer", released)
+
+    def requeue_source(item, stages):
+        release_analyzer_slots()
+        analyze_queue.put(item)
+
+    def abandon_source(item, stages):
+        release_analyzer_slots()
+
+    def requeue_job(item, stages):
+        # the job keeps its slot, upload_routine() continues after the last finished stage
+        ready_queue.put(item)
+
+    def abandon_job(item, stages):
+        job_slots.release_job()
+        job_history.record_job(config, os.path.basename(os.path.normpath(item[1])), status="failed",
+                               finished=time.time())
+
+    # supervised analyzer and uploader processes, restarted if they crash or hang
+    workers = supervisor.Supervisor(config, control_queue)
+    settings.install_sighup(reload_handler(workers))
+    signal.signal(signal.SIGTERM, stop_handler(workers))
+    workers.add(supervisor.Worker("analyzer", analyzer_proc, (analyze_queue, ready_queue, status_queue,
+                                                              log_queue, job_slots, control_queue),
+                                  requeue_source, abandon_source))
+    if config["spool"]["enable"]:
+        # jobs go to the shared spool, uploaders of this and other hosts claim them
+        add_spool_workers(workers, status_queue)
     else:
-        logging.warning("Bad Request: " + str(request.form))
-        return '', 400
+        workers.add(supervisor.Worker("uploader", upload_proc, (job_queue, status_queue, log_queue, job_slots,
+                                                                control_queue),
+                                      requeue_job, abandon_job))
+        dispatch_thread = threading.Thread(target=job_scheduler.dispatch_jobs, args=(ready_queue, job_queue),
+                                           daemon=True)
+        dispatch_thread.start()
+    supervisor_thread = threading.Thread(target=workers.run, daemon=True)
+    supervisor_thread.start()
+
+    def submit_source(source):
+        """
+        Queue a source for the analyzer, False if the queue stays full (ingest held back)
+        """
+        try:
+            analyze_queue.put((source, time.time()), True, config["queue"]["submit_timeout_s"])
+        except queue.Full:
+            logging.warning("analyze queue full, source rejected: %s", source)
+            status_queue.put({"type": "backpressure", "held": True, "source": source, "rejected": True})
+            return False
+        return True
+
+    async_mode = 'threading'
+    app = Flask(__name__)
+    app.config['SECRET_KEY'] = 'secret!'
+    socketio = SocketIO(app, async_mode=async_mode)
+
+    @app.route('/', methods=['GET', 'POST'])
+    def index():
+        """
+        main GET/POST handler to deliver html page and receive upload commands
+        """
+        if request.method == "GET":
+            return render_template('webui.html', async_mode=socketio.async_mode)
+        elif request.method == "POST":
+            # POST request, used to queue an upload (503: queue full, retry later)
+            if not submit_source(request.form["upload"]):
+                return 'analyze queue full', 503
+            return '', 204
+        else:
+            logging.warning("Bad Request: %s", request.form)
+            return '', 400
+
+    @app.route('/audio/<path:filename>')
+    def upload_file(filename):
+        """
+        deliver audio files from folder
+        """
+        return send_from_directory(config["audio"]["path"],
+                                   filename, as_attachment=True)
+
+    @app.route('/api/jobs')
+    def api_jobs():
+        """
+        job history, newest first (?page=1&per_page=50&status=failed)
+        """
+        if not config["history"]["enable"]:
+            return jsonify({"error": "job history disabled"}), 404
+        return jsonify(job_history.list_jobs(config, request.args.get("page", 1, type=int),
+                                             request.args.get("per_page", 50, type=int),
+                                             request.args.get("status")))
+
+    @app.route('/api/jobs/<job>')
+    def api_job(job):
+        """
+        one job of the history with stage timings, upload targets and errors
+        """
+        if not config["history"]["enable"]:
+            return jsonify({"error": "job history disabled"}), 404
+        result = job_history.get_job(config, job)
+        if result is None:
+            return jsonify({"error": "unknown job"}), 404
+        return jsonify(result)
+
+    @socketio.on('uploadcmd')
+    def proc_upload_cmd(message):
+        """
+        receive upload command from html site, add it to the analyzer queue,
+        """
+        logging.debug("uploadcmd received: %s", message['upload'])
+        submit_source(message['upload'])
+
+    def update_webui():
+        """
+        Get updates for the user from a queue and send them to the webui.
+        Wait until the audio file has played before playing the next.
+        Progress and backpressure events (dict, already throttled by the sender) are forwarded without delay.
+        """
+        while True:
+            status = status_queue.get(True)
+
+            if isinstance(status, dict):
+                # "progress" and "backpressure" (ingest held back) events
+                socketio.emit(status["type"], status, broadcast=True)
+                continue
+
+            logging.debug("status: %s", status)
+
+            if status.startswith("start"):
+                socketio.emit('status_text', {'data': 'gestartet', 'color': 'orange'}, broadcast=True)
+                socketio.emit('play_audio', {'audiofile': 'audio/' + config['audio']['started']}, broadcast=True)
+                socketio.emit('server_log', {'data': 'Job(s) angenommen: ' +
+                                             status.split('#')[1]}, broadcast=True)
+                audio_mp3 = MP3(os.path.join(config['audio']['path'], config['audio']['started']))
+                time.sleep(audio_mp3.info.length + 1)
+
+            elif status.startswith("end"):
+                socketio.emit('status_text', {'data': 'Fertig', 'color': 'limegreen'}, broadcast=True)
+                socketio.emit('play_audio', {'audiofile': 'audio/' +
+                                             config['audio']['finished']}, broadcast=True)
+                socketio.emit('server_log', {'data': 'Letzten Job bendet: ' +
+                                             status.split('#')[1]}, broadcast=True)
+                audio_mp3 = MP3(os.path.join(config['audio']['path'], config['audio']['finished']))
+                time.sleep(audio_mp3.info.length + 1)
+
+            elif status == "error_source":
+                socketio.emit('play_audio', {'audiofile': 'audio/' + config['audio']['error']}, broadcast=True)
+                socketio.emit('server_log', {'data': 'Fehler bei: ' + status}, broadcast=True)
+                audio_mp3 = MP3(os.path.join(config['audio']['path'], config['audio']['error']))
+                time.sleep(audio_mp3.info.length + 1)
+            else:
+                logging.error("internal status code not known")
+
+    # start webui update thread and flask socketio server
+    logging.debug("starting http daemon")
+    update_webui_thread = threading.Thread(target=update_webui, daemon=True)
+    update_webui_thread.start()
 
+    # watch the drop folder and queue completed batches (optional)
+    if config["watch"]["enable"]:
+        from libmultiupload import watch_folder
+        watch_thread = threading.Thread(target=watch_folder.watch, args=(submit_source, config), daemon=True)
+        watch_thread.start()
+
+    # queue inserted cards (optional)
+    if config["devices"]["enable"]:
+        from libmultiupload import device_manager
+        devices_thread = threading.Thread(target=device_manager.watch, args=(submit_source, config), daemon=True)
+        devices_thread.start()
+    socketio.run(app, host=config["http_server"]["host"], port=config["http_server"]["port"])
 
-@app.route('/audio/<path:filename>')
-def upload_file(filename):
-    """
-    deliver audio files from folder
-    """
-    return send_from_directory(config["audio"]["path"],
-                               filename, as_attachment=True)
 
+################################################################################
+# process cli arguments
+################################################################################
 
-@socketio.on('uploadcmd')
-def proc_upload_cmd(message):
-    """
-    receive upload command from html site, add it to the analyzer queue,
-    """
-    analyze_queue.put(message['upload'])
-    logging.debug("uploadcmd received: " + message['upload'])
+if __name__ == "__main__":
+    if [bool(args.source), args.daemon, args.spool_worker, bool(args.replay), args.loadtest].count(True) != 1:
+        logging.error("Invalid startup mode defined")
+        sys.exit(EXIT_INVALID_MODE)
 
+    if args.source:
+        logging.info("starting in single upload mode")
+        sys.exit(single_upload(args.source))
 
-def update_webui():
-    """
-    Get updates for the user from a queue and send them to the webui.
-    Wait until the audio file has played before playing the next.
-    """
-    while True:
-        status = status_queue.get(True)
-        logging.debug("status: " + str(status))
-
-        if status.startswith("start"):
-            socketio.emit('status_text', {'data': 'gestartet', 'color': 'orange'}, broadcast=True)
-            socketio.emit('play_audio', {'audiofile': 'audio/' + config['audio']['started']}, broadcast=True)
-            socketio.emit('server_log', {'data': 'Job(s) angenommen: ' +
-                                         status.split('#')[1]}, broadcast=True)
-            audio_mp3 = MP3(os.path.join(config['audio']['path'], config['audio']['started']))
-            time.sleep(audio_mp3.info.length + 1)
-
-        elif status.startswith("end"):
-            socketio.emit('status_text', {'data': 'Fertig', 'color': 'limegreen'}, broadcast=True)
-            socketio.emit('play_audio', {'audiofile': 'audio/' +
-                                         config['audio']['finished']}, broadcast=True)
-            socketio.emit('server_log', {'data': 'Letzten Job bendet: ' +
-                                         status.split('#')[1]}, broadcast=True)
-            audio_mp3 = MP3(os.path.join(config['audio']['path'], config['audio']['finished']))
-            time.sleep(audio_mp3.info.length + 1)
-
-        elif status == "error_source":
-            socketio.emit('play_audio', {'audiofile': 'audio/' + config['audio']['error']}, broadcast=True)
-            socketio.emit('server_log', {'data': 'Fehler bei: ' + status}, broadcast=True)
-            audio_mp3 = MP3(os.path.join(config['audio']['path'], config['audio']['error']))
-            time.sleep(audio_mp3.info.length + 1)
-        else:
-            logging.error("internal status code not known")
+    elif args.replay:
+        from libmultiupload import replay
+        logging.info("starting in replay mode")
+        sys.exit(EXIT_OK if replay.replay_job(args.replay, config) == 0 else EXIT_JOB_FAILED)
 
+    elif args.loadtest:
+        from libmultiupload import loadtest
+        logging.info("starting in loadtest mode")
+        report = loadtest.run_loadtest(config, args.config)
+        sys.exit(EXIT_OK if report and report["cards_done"] == report["cards"] else EXIT_JOB_FAILED)
 
-# start webui update thread and flask socketio server
-if __name__ == "__main__" and args.daemon:
-    logging.debug("starting http daemon")
-    update_webui_thread = threading.Thread(target=update_webui)
-    update_webui_thread.start()
-    socketio.run(app, host=config["http_server"]["host"], port=config["http_server"]["port"])
+    elif args.spool_worker:
+        logging.info("starting as spool worker: %s", config["spool"]["path"])
+        run_spool_worker()
+
+    elif args.daemon:
+        logging.info("starting in daemon mode")
+        run_daemon()
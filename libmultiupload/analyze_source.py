@@ -3,18 +3,48 @@
 Analyze a given source and copy specific files to the local machine. Inform the user over a queue.
     1. analyze source (mount if blkdev partition)
     2. copy files of matching type to local timestamped folder
-    3. delete copied files (if specified)
+       (config stream: a job is handed to the uploader with its first copied file,
+       it is closed as soon as its folders are copied, see job_state),
+       one job per folder or (config ingest.merge_folders) one job with the folder structure
+    3. delete copied files (if specified, always for batches of the drop folder watch)
 """
 
 import logging
 import os
 import stat
+import time
 from datetime import datetime
 
-from libmultiupload import emailmod, move_files, udiskie_mounthelper
+from libmultiupload import (emailmod, fileops, job_history, job_scheduler, job_state, move_files, profiling,
+                            progress, udiskie_mounthelper)
 
 
-def analyze_move_userfeedback(media_source, userstatus_queue, config):
+def new_job_dir(config):
+    """
+    Reserve a job folder in temp_path named after the current time (config timestamp)
+    A name is never reused: it is unique against temp_path, archive_path and the job history,
+    "_<n>" is appended otherwise. The folder is created at once (several analyzers).
+
+    Returns:
+        name of the job folder (created, empty)
+    """
+    os.makedirs(config["temp_path"], exist_ok=True)
+    base = datetime.now().strftime(config["timestamp"])
+    job_dir = base
+    counter = 0
+    while True:
+        if not os.path.exists(os.path.join(config["archive_path"], job_dir)) and \
+                not job_history.job_exists(config, job_dir):
+            try:
+                os.mkdir(os.path.join(config["temp_path"], job_dir))
+                return job_dir
+            except FileExistsError:
+                pass
+        counter += 1
+        job_dir = "{}_{}".format(base, counter)
+
+
+def analyze_move_userfeedback(media_source, userstatus_queue, config, job_slots=None, job_ready=None):
     """
     Determine the source type (folder, block device partition)
     Copy the files to a local timestamped folder
@@ -24,6 +54,9 @@ def analyze_move_userfeedback(media_source, userstatus_queue, config):
         media_source: source object to be analyzed
         userstatus_queue: user information
         config: parsed json config file
+        job_slots: job_scheduler.JobSlots limiting the jobs in temp_path (daemon mode)
+        job_ready: called with the path of every job as soon as it is copied (daemon mode,
+                   the uploader starts before all folders of the source are copied)
     Returns:
         joblist: list of paths to jobs, which are ready for processing
     """
@@ -33,7 +66,7 @@ def analyze_move_userfeedback(media_source, userstatus_queue, config):
 
     joblist = []
 
-    # set timestamp format
+    # name of the source in the log and the mount stages (jobs are named when their slot is free)
     timestamp = datetime.now().strftime(config["timestamp"])
 
     ############################################################################
@@ -46,7 +79,16 @@ def analyze_move_userfeedback(media_source, userstatus_queue, config):
         logging.info("source is directory")
         source = media_source
     else:
-        if stat.S_ISBLK(os.stat(media_source).st_mode):
+        try:
+            source_mode = os.stat(media_source).st_mode
+        except OSError as exceptmsg:
+            userstatus_queue.put("error_source")
+            logging.error("Source can not be accessed: %s", exceptmsg)
+            emailmod.send_err("error in upload_routine.py",
+                              "Source can not be accessed: {}".format(exceptmsg), config)
+            logging.info("End of logfile: %s", timestamp)
+            return -1
+        if stat.S_ISBLK(source_mode):
 
             logging.info(
                 "Block device partition defined as source: " + media_source)
@@ -56,7 +98,8 @@ def analyze_move_userfeedback(media_source, userstatus_queue, config):
 
             # partition is not mounted -> mount it
             if is_mounted == 0:
-                ret = udiskie_mounthelper.mount_partition(media_source)
+                with profiling.stage(config, timestamp, "mount"):
+                    ret = udiskie_mounthelper.mount_partition(media_source)
                 needto_unmount = True
 
                 if ret == -1:
@@ -64,10 +107,10 @@ def analyze_move_userfeedback(media_source, userstatus_queue, config):
 
                     emailmod.send_err("error in multiupload.py",
                                       "mount_part() returned -1", config)
-                    logging.info("End of job: " + str(media_source))
-                    exit()
+                    logging.info("End of job: %s", media_source)
+                    return -1
                 else:
-                    logging.info("Sucessfully mounted, mountpoint: " + ret)
+                    logging.info("Sucessfully mounted, mountpoint: %s", ret)
                     source = ret
 
             # error while checking if mounted
@@ -75,13 +118,13 @@ def analyze_move_userfeedback(media_source, userstatus_queue, config):
                 logging.error("check_if_mounted() returned with -1")
                 emailmod.send_err("error in multiupload.py",
                                   "check_if_mounted() returned -1", config)
-                logging.info("End of logfile: " + timestamp)
-                exit()
+                logging.info("End of logfile: %s", timestamp)
+                return -1
 
             # partition is mounted -> get mountpoint
             else:
                 # make sure return value ends with "/", required later on
-                logging.debug("mountpoint: " + is_mounted)
+                logging.debug("mountpoint: %s", is_mounted)
                 source = is_mounted
 
         # source folder and device given
@@ -90,7 +133,7 @@ def analyze_move_userfeedback(media_source, userstatus_queue, config):
             logging.error("Source is neither blkdev nor dir")
             emailmod.send_err("error in upload_routine.py",
                               "Source is neither blkdev nor dir", config)
-            logging.info("End of logfile: " + timestamp)
+            logging.info("End of logfile: %s", timestamp)
             return -1
 
     ############################################################################
@@ -99,6 +142,14 @@ def analyze_move_userfeedback(media_source, userstatus_queue, config):
 
     sourcelist = [source]
 
+    # a batch of the drop folder watch (watch_folder) holds files already moved out of the
+    # drop folder: they are moved on into the job (also without delete_source) and the batch removed
+    staging_path = os.path.abspath(config["watch"]["staging_path"])
+    staged = config["watch"]["enable"] and \
+        os.path.dirname(os.path.abspath(os.path.normpath(source))) == staging_path
+    delete_source = config["delete_source"] or staged
+    source_copy_failed = False
+
     def scantree(root_path):
         """
         (recoursive) scan for folders
@@ -110,6 +161,23 @@ def analyze_move_userfeedback(media_source, userstatus_queue, config):
 
     scantree(source)
 
+    # endings of the files copied into a job
+    media_types = ()
+    if config["image"]["enable"]:
+        media_types += tuple(config["image"]["type"])
+    if config["video"]["enable"]:
+        media_types += tuple(config["video"]["type"])
+
+    def has_media(folder):
+        """
+        True if the folder itself holds files copied into a job (see move_files)
+        """
+        try:
+            return any(entry.is_file() and entry.name.lower().endswith(media_types) for entry in os.scandir(folder))
+        except OSError:
+            # reported by move_files
+            return True
+
     #############################################################################
     # local copy & delete source
     #############################################################################
@@ -119,42 +187,115 @@ def analyze_move_userfeedback(media_source, userstatus_queue, config):
 
     # def check_free_space():
 
-    for folder in sourcelist:
-
-        # main job folder name (time when analyze_move_userfeedback() has been called)
-        job_dir = timestamp
-
-        # make sure folder does not exist
-        if os.path.exists(os.path.join(config["temp_path"], job_dir)):
-            folder_counter = 1
-            while os.path.exists(os.path.join(config["temp_path"], job_dir) + "_" + str(folder_counter)):
-                folder_counter += 1
-            job_dir += "_" + str(folder_counter)
-        logging.debug("current job_dir is: " + job_dir)
+    # hand jobs over while copying (not into the spool, it only takes complete jobs)
+    stream = config["stream"]["enable"] and job_ready is not None and not config["spool"]["enable"]
+    streamed_jobs = []
 
-        image_path = os.path.join(config["temp_path"], job_dir, "image")
-        video_path = os.path.join(config["temp_path"], job_dir, "video")
-
-        # copy image files
-        if config["image"]["enable"]:
-            logging.debug("start copying images")
-            image_count = move_files.move_files(folder, image_path,
-                                                config["image"]["type"], config["delete_source"])
-
-        # copy video files
-        if config["video"]["enable"]:
-            logging.debug("start copying videos")
-            video_count = move_files.move_files(folder, video_path,
-                                                config["video"]["type"], config["delete_source"])
+    # one job per folder, or one job for the whole source with its folder structure kept
+    # inside (config ingest.merge_folders: one archive, one email, one upload per target)
+    # folders without images or videos get no job (no slot, no job folder, no progress)
+    media_folders = [folder for folder in sourcelist if has_media(folder)]
+    if config["ingest"]["merge_folders"]:
+        job_groups = [(source, media_folders)] if media_folders else []
+    else:
+        job_groups = [(folder, [folder]) for folder in media_folders]
+    if not job_groups:
+        logging.warning("No image or video files found in %s", source)
+
+    # reported as the last job (the source if it has no job)
+    job_dir = timestamp
+
+    for job_source, folders in job_groups:
+
+        # wait until the uploader has finished a job if temp_path is full
+        if job_slots is not None:
+            job_scheduler.acquire_slot(job_slots, userstatus_queue, job_source)
+
+        # main job folder name (time when the job starts, after waiting for the slot)
+        job_dir = new_job_dir(config)
+        logging.debug("current job_dir is: %s", job_dir)
+
+        job_path = os.path.join(config["temp_path"], job_dir)
+
+        on_file = None
+        if stream:
+            def on_file(path):
+                # first verified file: the uploader starts while the rest is copied
+                if job_path not in streamed_jobs:
+                    job_state.mark_copying(job_path)
+                    job_history.record_job(config, job_dir, source=job_source, status="queued",
+                                           created=time.time())
+                    streamed_jobs.append(job_path)
+                    job_ready(job_path)
+
+        image_count = 0
+        video_count = 0
+        copy_failed = False
+        with profiling.stage(config, job_dir, "copy"):
+            copy_progress = progress.from_config(userstatus_queue, job_dir, "copy", config)
+
+            for folder in folders:
+                # subfolder of the merged source, e.g. image/DCIM/100CANON
+                subfolder = os.path.relpath(folder, job_source)
+                image_path = os.path.normpath(os.path.join(job_path, "image", subfolder))
+                video_path = os.path.normpath(os.path.join(job_path, "video", subfolder))
+
+                # copy image files
+                if config["image"]["enable"]:
+                    logging.debug("start copying images")
+                    count = move_files.move_files(folder, image_path,
+                                                  config["image"]["type"], delete_source,
+                                                  copy_progress, on_file)
+                    copy_failed = copy_failed or count == -1
+                    image_count += max(count, 0)
+
+                # copy video files
+                if config["video"]["enable"]:
+                    logging.debug("start copying videos")
+                    count = move_files.move_files(folder, video_path,
+                                                  config["video"]["type"], delete_source,
+                                                  copy_progress, on_file)
+                    copy_failed = copy_failed or count == -1
+                    video_count += max(count, 0)
+
+            copy_progress.finish()
+        source_copy_failed = source_copy_failed or copy_failed
+
+        if job_path in streamed_jobs:
+            # already with the uploader, it processes the files which were copied;
+            # closed at once: the uploader holds the job slot until the job is finished
+            job_history.record_job(config, job_dir, image_files=image_count,
+                                   video_files=video_count, bytes=copy_progress.bytes_total)
+            job_state.copy_finished(job_path)
+            joblist.append(job_path)
+            if copy_failed:
+                emailmod.send_err("error in analyze_source.py",
+                                  "copying {} failed, job {} is incomplete".format(job_source, job_dir), config)
 
         # quit if no files were copied
-        if image_count <= 0 and video_count <= 0:
+        elif image_count <= 0 and video_count <= 0:
             logging.warning("No image or video files found")
-            logging.info("End of job: " + str(media_source))
+            logging.info("End of job: %s", media_source)
+            try:
+                os.rmdir(job_path)
+            except OSError:
+                logging.warning("could not remove empty job folder %s", job_path)
+            if job_slots is not None:
+                job_slots.release_own()
         else:
+            if copy_failed:
+                emailmod.send_err("error in analyze_source.py",
+                                  "copying {} failed, job {} is incomplete".format(job_source, job_dir), config)
+            job_history.record_job(config, job_dir, source=job_source, status="queued",
+                                   image_files=image_count, video_files=video_count,
+                                   bytes=copy_progress.bytes_total, created=time.time())
             joblist.append(os.path.join(config["temp_path"], job_dir))
-            logging.debug("appended to job list: " +
-                          str(os.path.join(config["temp_path"])) + job_dir)
+            if job_ready is not None:
+                job_ready(os.path.join(config["temp_path"], job_dir))
+            logging.debug("appended to job list: %s", os.path.join(config["temp_path"], job_dir))
+
+    if staged and not source_copy_failed and not fileops.remove_empty_dirs(source):
+        logging.info("staged batch %s removed except for files of other types", source)
 
     ############################################################################
     # unmount via udiskie_mounthelper
@@ -163,11 +304,12 @@ def analyze_move_userfeedback(media_source, userstatus_queue, config):
     # try to unmount if mounted (same condition as for mounting)
     # so that sd card can be physically removed
     if needto_unmount:
-        ret = udiskie_mounthelper.umount(source)
+        with profiling.stage(config, timestamp, "umount"):
+            ret = udiskie_mounthelper.umount(source)
         if ret == 0:
             logging.debug("umount returned successfully")
         else:
-            logging.warning("umount() returned non zero: " + ret)
+            logging.warning("umount() returned non zero: %s", ret)
             emailmod.send_err("error in multiupload.py",
                               "umount() returned non zero: " + ret, config)
 
@@ -179,5 +321,5 @@ def analyze_move_userfeedback(media_source, userstatus_queue, config):
     ############################################################################
 
     userstatus_queue.put("end#" + str(job_dir))
-    logging.debug("analyze source returns with jobs: " + str(joblist))
+    logging.debug("analyze source returns with jobs: %s", joblist)
     return joblist
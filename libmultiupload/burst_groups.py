@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+"""
+Group bursts and near-duplicate images of a job by perceptual hash:
+    1. dHash (64 bit) of every thumbnail (small images, cheap to decode)
+    2. candidates from a multi-index: the hash is split into max_distance + 1 chunks,
+       two hashes within max_distance bits share at least one identical chunk
+       (no pairwise comparison of all images)
+    3. candidates within max_distance bits are joined into groups (union-find)
+    4. the first image (by name) represents its group, the others are moved from
+       image_thumb to image_thumb_similar (not in the email, not uploaded to remote_ftp)
+The originals (and the zip archive) are not touched.
+"""
+import collections
+import json
+import logging
+import os
+
+from libmultiupload import fileops
+
+HASH_BITS = 64
+
+
+def dhash(path):
+    """
+    Difference hash of an image: 9x8 grayscale, one bit per horizontal neighbour pair
+    """
+    from PIL import Image
+
+    with Image.open(path) as img:
+        small = img.convert("L").resize((9, 8), Image.BILINEAR)
+    pixels = list(small.getdata())
+    value = 0
+    for row in range(8):
+        for col in range(8):
+            value = value << 1 | (pixels[row * 9 + col] > pixels[row * 9 + col + 1])
+    return value
+
+
+def chunk_masks(max_distance):
+    """
+    Return (shift, mask) of max_distance + 1 chunks covering the hash bits
+    """
+    chunks = max_distance + 1
+    bounds = [HASH_BITS * index // chunks for index in range(chunks + 1)]
+    return [(start, (1 << (end - start)) - 1) for start, end in zip(bounds, bounds[1:])]
+
+
+def group_hashes(hashes, max_distance):
+    """
+    Group names whose hashes differ in at most max_distance bits (transitively)
+
+    Args:
+        hashes: dict name -> hash
+        max_distance: maximum hamming distance of near-duplicates (0..63)
+
+    Returns:
+        list of groups (sorted lists of names, first is the representative), sorted by representative
+    """
+    names = sorted(hashes)
+    parent = list(range(len(names)))
+
+    def find(index):
+        while parent[index] != index:
+            parent[index] = parent[parent[index]]
+            index = parent[index]
+        return index
+
+    masks = chunk_masks(max_distance)
+    index = [collections.defaultdict(list) for _ in masks]
+    for number, name in enumerate(names):
+        value = hashes[name]
+        checked = set()
+        for chunk, (shift, mask) in enumerate(masks):
+            bucket = index[chunk][(value >> shift) & mask]
+            for other in bucket:
+                if other in checked:
+                    continue
+                checked.add(other)
+                if bin(value ^ hashes[names[other]]).count("1") <= max_distance:
+                    root, other_root = find(number), find(other)
+                    if root != other_root:
+                        # the smaller index (first name) stays root
+                        parent[max(root, other_root)] = min(root, other_root)
+            bucket.append(number)
+
+    groups = collections.defaultdict(list)
+    for number, name in enumerate(names):
+        groups[find(number)].append(name)
+    return [groups[root] for root in sorted(groups)]
+
+
+def collapse_thumbnails(thumb_path, similar_path, filetype, max_distance):
+    """
+    Keep one thumbnail per group of near-duplicates in thumb_path, move the others
+    to similar_path, write the groups to <similar_path>/groups.json
+
+    Returns:
+        dict representative -> number of similar images (only groups with more than one image),
+        -1 in the event of an error
+    """
+    try:
+        # names are paths relative to thumb_path (subfolders of a merged job)
+        hashes = {}
+        for name in fileops.list_files(thumb_path, filetype):
+            hashes[name] = dhash(os.path.join(thumb_path, name))
+        groups = [group for group in group_hashes(hashes, max_distance) if len(group) > 1]
+
+        if groups and not os.path.exists(similar_path):
+            os.makedirs(similar_path)
+        for group in groups:
+            for name in group[1:]:
+                os.makedirs(os.path.dirname(os.path.join(similar_path, name)), exist_ok=True)
+                os.replace(os.path.join(thumb_path, name), os.path.join(similar_path, name))
+        if groups:
+            with open(os.path.join(similar_path, "groups.json"), "w") as fh:
+                json.dump({group[0]: group[1:] for group in groups}, fh, indent=1)
+
+        logging.info("burst groups: %d images, %d groups of near-duplicates, %d thumbnails collapsed",
+                     len(hashes), len(groups), sum(len(group) - 1 for group in groups))
+        return {group[0]: len(group) - 1 for group in groups}
+
+    except Exception:
+        logging.exception("Fatal error in collapse_thumbnails()")
+        return -1
+
+
+def load_groups(similar_path):
+    """
+    Return dict representative -> number of similar images of a collapsed job ({} if none)
+    """
+    try:
+        with open(os.path.join(similar_path, "groups.json")) as fh:
+            return {name: len(members) for name, members in json.load(fh).items()}
+    except FileNotFoundError:
+        return {}
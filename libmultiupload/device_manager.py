@@ -0,0 +1,251 @@
+#!/usr/bin/env python3
+"""
+Detect inserted cards and queue them for analysis (config "devices"):
+    1. listen for block device events of the kernel (netlink uevents, no udev rule needed)
+    2. a new partition matching devices.match (and on a removable disk) is queued as soon
+       as its device node exists, the analyzer mounts it (udiskie_mounthelper). A disk
+       without partitions is queued like a partition (a card with a filesystem on the whole
+       disk), also when a card reader reports the card as change of its disk
+    3. removed devices are forgotten, a device removed while still mounted is logged
+The mount state comes from the cached MountTable of udiskie_mounthelper, updated only when
+the kernel reports a change. Linux only (AF_NETLINK socket, no additional dependency).
+StandinUeventSource replaces the kernel events in tests.
+"""
+import fnmatch
+import logging
+import os
+import queue
+import select
+import socket
+import time
+
+from libmultiupload import udiskie_mounthelper
+
+NETLINK_KOBJECT_UEVENT = 15
+UEVENT_KERNEL_GROUP = 1
+
+
+def parse_uevent(data):
+    """
+    Parse a kernel uevent ("add@/devices/...\\0ACTION=add\\0DEVNAME=sdb1\\0...")
+
+    Returns:
+        dict of the KEY=VALUE fields, None for other messages (e.g. of udev)
+    """
+    fields = data.split(b"\0")
+    if b"@" not in fields[0]:
+        return None
+    event = {}
+    for field in fields[1:]:
+        key, sep, value = field.partition(b"=")
+        if sep:
+            event[key.decode(errors="replace")] = value.decode(errors="replace")
+    return event
+
+
+class UeventSource:
+    """
+    Kernel uevents from a netlink socket
+    """
+
+    def __init__(self):
+        self.sock = socket.socket(socket.AF_NETLINK, socket.SOCK_DGRAM, NETLINK_KOBJECT_UEVENT)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 1024 * 1024)
+        self.sock.bind((0, UEVENT_KERNEL_GROUP))
+        self.sock.setblocking(False)
+
+    def read_events(self, timeout):
+        """
+        Wait up to timeout seconds for events
+
+        Returns:
+            list of event dicts
+        """
+        ready, _, _ = select.select([self.sock], [], [], timeout)
+        events = []
+        while ready:
+            try:
+                data = self.sock.recv(64 * 1024)
+            except BlockingIOError:
+                break
+            event = parse_uevent(data)
+            if event is not None:
+                events.append(event)
+        return events
+
+    def close(self):
+        self.sock.close()
+
+
+class StandinUeventSource:
+    """
+    Event source for tests: events are injected with inject()
+    """
+
+    def __init__(self):
+        self.events = queue.Queue()
+
+    def inject(self, action, devname, devtype="partition", subsystem="block", **fields):
+        self.events.put(dict(fields, ACTION=action, DEVNAME=devname, DEVTYPE=devtype, SUBSYSTEM=subsystem))
+
+    def read_events(self, timeout):
+        events = []
+        try:
+            events.append(self.events.get(True, timeout))
+            while True:
+                events.append(self.events.get_nowait())
+        except queue.Empty:
+            pass
+        return events
+
+    def close(self):
+        pass
+
+
+def is_removable(name, sys_block="/sys/class/block"):
+    """
+    Check if a partition or disk is a removable disk (card reader, usb stick, sd slot)
+    """
+    disk_path = os.path.realpath(os.path.join(sys_block, name))
+    if os.path.exists(os.path.join(disk_path, "partition")):
+        disk_path = os.path.dirname(disk_path)
+    try:
+        with open(os.path.join(disk_path, "removable")) as fh:
+            removable = fh.read().strip() == "1"
+    except OSError:
+        return False
+    # sd card slots report their card as not removable
+    return removable or os.path.basename(disk_path).startswith("mmcblk")
+
+
+def is_whole_disk_filesystem(name, event, sys_block="/sys/class/block"):
+    """
+    Check if a disk may hold a filesystem without a partition table: it has a medium and no
+    partitions (/sys/class/block/<disk>/<disk>*), and no empty filesystem type (ID_FS_TYPE
+    is set by udev only, not in kernel events: the mount fails without a filesystem)
+    """
+    if "ID_FS_TYPE" in event and not event["ID_FS_TYPE"]:
+        return False
+    disk_path = os.path.realpath(os.path.join(sys_block, name))
+    try:
+        with open(os.path.join(disk_path, "size")) as fh:
+            # card reader without card
+            if int(fh.read()) == 0:
+                return False
+        return not any(entry.startswith(name) for entry in os.listdir(disk_path))
+    except (OSError, ValueError):
+        return False
+
+
+class DeviceManager:
+    """
+    Present block devices, updated from events
+
+    Args:
+        submit: function queueing a source (device node), returns False if the queue is full (retried)
+        device_config: config["devices"]
+        source: event source (UeventSource, StandinUeventSource)
+        table: udiskie_mounthelper.MountTable
+        dev_path: folder of the device nodes
+        sys_block: sysfs folder of the block devices (removable check)
+    """
+
+    def __init__(self, submit, device_config, source, table, dev_path="/dev", sys_block="/sys/class/block"):
+        self.submit = submit
+        self.device_config = device_config
+        self.source = source
+        self.table = table
+        self.dev_path = dev_path
+        self.sys_block = sys_block
+        self.present = {}   # device name -> time of its add event
+        self.pending = []   # device names not queued yet
+
+    def handle_event(self, event):
+        if event.get("SUBSYSTEM") != "block" or not event.get("DEVNAME"):
+            return
+        name = event["DEVNAME"]
+        action = event.get("ACTION")
+        if event.get("DEVTYPE") == "disk" and action in ("add", "change"):
+            if is_whole_disk_filesystem(name, event, self.sys_block):
+                # a card reader reports an inserted card as change
+                action = "add"
+            elif action == "change" and name in self.present:
+                # card taken out of the reader
+                action = "remove"
+            else:
+                return
+        elif event.get("DEVTYPE") not in ("disk", "partition"):
+            return
+        if action == "add":
+            if name in self.present:
+                return
+            if not any(fnmatch.fnmatchcase(name, pattern) for pattern in self.device_config["match"]):
+                logging.debug("devices: %s ignored (devices.match)", name)
+                return
+            if self.device_config["removable_only"] and not is_removable(name, self.sys_block):
+                logging.info("devices: %s ignored, not removable", name)
+                return
+            logging.info("devices: %s added", name)
+            self.present[name] = time.monotonic()
+            self.pending.append(name)
+        elif action == "remove" and name in self.present:
+            del self.present[name]
+            if name in self.pending:
+                self.pending.remove(name)
+            mountpoint = self.table.mounts.get(os.path.join(self.dev_path, name))
+            if mountpoint is not None:
+                logging.warning("devices: %s removed while mounted on %s", name, mountpoint)
+            else:
+                logging.info("devices: %s removed", name)
+
+    def submit_pending(self):
+        """
+        Queue the added devices whose node exists, in order of insertion
+        """
+        for name in list(self.pending):
+            node = os.path.join(self.dev_path, name)
+            if not os.path.exists(node):
+                if time.monotonic() - self.present[name] > self.device_config["node_wait_s"]:
+                    logging.warning("devices: no device node %s, not queued", node)
+                    self.pending.remove(name)
+                continue
+            if not self.submit(node):
+                # queue full: keep the order, retried with the next poll
+                break
+            logging.info("devices: %s queued", node)
+            self.pending.remove(name)
+
+    def poll(self, timeout):
+        """
+        Process events for up to timeout seconds, update the mount table, queue new devices
+        """
+        for event in self.source.read_events(timeout):
+            self.handle_event(event)
+        mounted, unmounted = self.table.update()
+        for device, mountpoint in mounted.items():
+            logging.debug("devices: %s mounted on %s", device, mountpoint)
+        for device, mountpoint in unmounted.items():
+            logging.debug("devices: %s unmounted from %s", device, mountpoint)
+        self.submit_pending()
+
+
+def watch(submit, config, stop_event=None, source=None):
+    """
+    Queue inserted cards (blocks, run in a thread, returns when stop_event is set)
+
+    Args:
+        submit: function queueing a source, returns False if the queue is full (retried)
+        config: parsed json config file
+        stop_event: threading.Event to stop watching (optional)
+        source: event source (default: kernel uevents)
+    """
+    if source is None:
+        source = UeventSource()
+    manager = DeviceManager(submit, config["devices"], source, udiskie_mounthelper.MountTable())
+    logging.info("watching for block devices: %s", ", ".join(config["devices"]["match"]))
+    try:
+        while stop_event is None or not stop_event.is_set():
+            manager.poll(0.5)
+    finally:
+        source.close()
+        manager.table.close()
@@ -9,7 +9,8 @@ from email.mime.multipart import MIMEMultipart
 from email.mime.text import MIMEText
 
 
-def send(sender, recipient, recipient_cc, recipient_bcc, subject, text, text_html):
+def send(sender, recipient, recipient_cc, recipient_bcc, subject, text, text_html,
+         smtp_host='localhost', smtp_port=25, smtp_timeout=60):
     """
     Send email
 
@@ -20,6 +21,9 @@ def send(sender, recipient, recipient_cc, recipient_bcc, subject, text, text_htm
         recipient_bcc:
         email_subject: subject for the email
         email_text: text for the email to send
+        smtp_host: host of the mail transfer agent
+        smtp_port: port of the mail transfer agent
+        smtp_timeout: connect/read timeout in seconds
 
     Depends:
         local mail transfer agent (e.g. postfix) is required
@@ -43,13 +47,14 @@ def send(sender, recipient, recipient_cc, recipient_bcc, subject, text, text_htm
     msg_full = message.as_string()
 
     try:
-        smtpObj = smtplib.SMTP('localhost')
+        smtpObj = smtplib.SMTP(smtp_host, smtp_port, timeout=smtp_timeout)
         smtpObj.sendmail(sender, recipient + recipient_cc + recipient_bcc, msg_full)
-        logging.info("Sent email to: " + str(recipient) + "subject: " + subject)
+        smtpObj.quit()
+        logging.info("Sent email to: %s subject: %s", recipient, subject)
         return 0
 
     except Exception as exceptmsg:
-        logging.exception("Error sending mail :(, " + str(exceptmsg))
+        logging.exception("Error sending mail :(, %s", exceptmsg)
         return -1
 
 
@@ -58,7 +63,8 @@ def send_err(subject, text, config):
     Send error email
     """
     if config["err_email"]["enable"]:
-        logging.info("Sending error email with subject: " + subject)
-        send(config["err_email"]["sender"], config["err_email"]["recipient"], [], [], subject, text, "")
+        logging.info("Sending error email with subject: %s", subject)
+        send(config["err_email"]["sender"], config["err_email"]["recipient"], [], [], subject, text, "",
+             config["smtp"]["host"], config["smtp"]["port"], config["smtp"]["timeout_s"])
     else:
         logging.info("Sending error email is disabled in config file")
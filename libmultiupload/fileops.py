@@ -0,0 +1,218 @@
+#!/usr/bin/env python3
+"""
+Local file operations that avoid copying data where the filesystem allows it.
+Strategies are tried from cheapest to most expensive:
+    1. rename (move on the same filesystem)
+    2. reflink (FICLONE, copy-on-write clone on btrfs/xfs)
+    3. hardlink (same filesystem, only where the caller allows shared inodes)
+    4. full copy (fallback, e.g. SD card -> local disk)
+"""
+import errno
+import fcntl
+import logging
+import os
+import shutil
+import time
+
+# ioctl request number of FICLONE (linux/fs.h: _IOW(0x94, 9, int))
+FICLONE = 0x40049409
+
+# errors which mean "reflink not supported here", fall back to a copy
+REFLINK_UNSUPPORTED = (errno.EXDEV, errno.EOPNOTSUPP, errno.ENOTTY, errno.EINVAL,
+                       errno.ENOSYS, errno.EPERM, errno.EBADF, errno.EISDIR)
+
+
+def _existing_parent(path):
+    """
+    Return the path itself or the nearest existing parent directory
+    """
+    path = os.path.abspath(path)
+    while not os.path.exists(path):
+        parent = os.path.dirname(path)
+        if parent == path:
+            break
+        path = parent
+    return path
+
+
+def same_filesystem(src, dest):
+    """
+    Check if src and dest (or its nearest existing parent) reside on the same filesystem
+
+    Args:
+        src: existing path
+        dest: path which may not yet exist
+
+    Returns:
+        True if both are on the same device, False otherwise
+    """
+    try:
+        return os.stat(src).st_dev == os.stat(_existing_parent(dest)).st_dev
+    except OSError:
+        return False
+
+
+def reflink(src, dest):
+    """
+    Clone src to dest via FICLONE (copy on write, no data is copied)
+
+    Args:
+        src: source file
+        dest: destination file (will be created/truncated)
+
+    Returns:
+        True if the clone was created, False if not supported
+    """
+    try:
+        with open(src, "rb") as src_fh, open(dest, "wb") as dest_fh:
+            fcntl.ioctl(dest_fh.fileno(), FICLONE, src_fh.fileno())
+    except OSError as exceptmsg:
+        if exceptmsg.errno in REFLINK_UNSUPPORTED:
+            try:
+                os.remove(dest)
+            except OSError:
+                pass
+            return False
+        raise
+    shutil.copystat(src, dest)
+    return True
+
+
+def copy_file(src, dest, allow_hardlink=False):
+    """
+    Copy a file with the cheapest available strategy (reflink, hardlink, copy)
+
+    Args:
+        src: source file
+        dest: destination file path (not a directory)
+        allow_hardlink: allow src and dest to share the inode (only if neither is modified later)
+
+    Returns:
+        name of the used strategy ("reflink", "hardlink" or "copy")
+    """
+    start = time.monotonic()
+    strategy = "copy"
+
+    if same_filesystem(src, dest):
+        if reflink(src, dest):
+            strategy = "reflink"
+        elif allow_hardlink:
+            try:
+                os.link(src, dest)
+                strategy = "hardlink"
+            except OSError:
+                pass
+
+    if strategy == "copy":
+        shutil.copy2(src, dest)
+
+    logging.debug("copy_file %s: %s -> %s (%.3fs)", strategy, src, dest, time.monotonic() - start)
+    return strategy
+
+
+def move_file(src, dest):
+    """
+    Move a file, rename if possible, otherwise copy and delete
+
+    Args:
+        src: source file
+        dest: destination file path (not a directory)
+
+    Returns:
+        name of the used strategy ("rename" or "copy")
+    """
+    start = time.monotonic()
+    try:
+        os.rename(src, dest)
+        strategy = "rename"
+    except OSError as exceptmsg:
+        if exceptmsg.errno != errno.EXDEV:
+            raise
+        shutil.copy2(src, dest)
+        os.remove(src)
+        strategy = "copy"
+
+    logging.debug("move_file %s: %s -> %s (%.3fs)", strategy, src, dest, time.monotonic() - start)
+    return strategy
+
+
+def move_tree(src, dest):
+    """
+    Move a directory tree, rename if possible (same filesystem).
+    Otherwise copy it and delete the source (also for bind mounts and overlays,
+    which share st_dev but refuse the rename with EXDEV).
+
+    Args:
+        src: source directory
+        dest: destination directory (must not exist)
+
+    Returns:
+        name of the used strategy ("rename" or "copy")
+    """
+    start = time.monotonic()
+    parent = os.path.dirname(os.path.abspath(dest))
+    if not os.path.exists(parent):
+        os.makedirs(parent)
+
+    try:
+        os.rename(src, dest)
+        strategy = "rename"
+    except OSError as exceptmsg:
+        if exceptmsg.errno != errno.EXDEV:
+            raise
+        logging.warning("move_tree: %s and %s are on different filesystems, copying", src, dest)
+        shutil.copytree(src, dest)
+        shutil.rmtree(src)
+        strategy = "copy"
+
+    logging.info("move_tree %s: %s -> %s (%.3fs)", strategy, src, dest, time.monotonic() - start)
+    return strategy
+
+
+def remove_empty_dirs(path):
+    """
+    Remove path and all folders below it which are (then) empty, files are kept
+
+    Returns:
+        True if path was removed completely
+    """
+    for dirpath, _, _ in os.walk(path, topdown=False):
+        try:
+            os.rmdir(dirpath)
+        except OSError:
+            # not empty
+            pass
+    return not os.path.exists(path)
+
+
+def list_files(path, filetype=None):
+    """
+    Return the files (of matching type, filetype empty: all) below a folder as sorted paths
+    relative to it (subfolders of a merged job, see analyze_source), [] if it does not exist
+    """
+    files = []
+    for dirpath, _, filenames in os.walk(path):
+        for filename in filenames:
+            if not filetype or filename.lower().endswith(filetype):
+                files.append(os.path.relpath(os.path.join(dirpath, filename), path))
+    return sorted(files)
+
+
+def tree_size(path, filetype, enable_recursive):
+    """
+    Count files (of matching type, filetype empty: all) and bytes in a folder
+
+    Returns:
+        (number of files, number of bytes)
+    """
+    files, nbytes = 0, 0
+    for entry in os.scandir(path):
+        if entry.is_file():
+            if not filetype or entry.name.lower().endswith(filetype):
+                files += 1
+                nbytes += entry.stat().st_size
+        elif entry.is_dir() and enable_recursive:
+            sub_files, sub_bytes = tree_size(entry.path, filetype, enable_recursive)
+            files += sub_files
+            nbytes += sub_bytes
+    return files, nbytes
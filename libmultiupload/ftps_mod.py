@@ -4,28 +4,255 @@ FTPS upload module for uploading specific files (recoursively) via FTP SSL/TLS
 Uploads the files (of matching type if enabled) of a folder to a remte server. Recourive upload possible.
 """
 import ftplib
+import hashlib
 import logging
 import os
+import posixpath
+import queue
+import socket
+import threading
+import zlib
+
+from libmultiupload import fileops
 
 
 # TODO
 # redo eror mail
 
 
-def ftpsupload(config, localpath, filetype, remote_basedir, remotefoldername, enable_recursive, ftps_usr, ftps_passwd, ftps_ip):
+class SessionReuseFTP_TLS(ftplib.FTP_TLS):
+    """
+    FTP_TLS which resumes the TLS session of the control connection on every data
+    connection (saves a full handshake per file, required by vsftpd require_ssl_reuse)
+    and uses a configurable block size and socket send buffer for transfers.
+
+    Args:
+        blocksize: default block size for storbinary() (ftplib default: 8192)
+        sndbuf: SO_SNDBUF of data connections in bytes (0: OS default)
+    """
+
+    def __init__(self, blocksize=65536, sndbuf=0, **kwargs):
+        ftplib.FTP_TLS.__init__(self, **kwargs)
+        self.blocksize = blocksize
+        self.sndbuf = sndbuf
+        self.data_connections = 0
+        self.sessions_reused = 0
+
+    def connect(self, *args, **kwargs):
+        welcome = ftplib.FTP_TLS.connect(self, *args, **kwargs)
+        # many small commands per file, do not wait for delayed ACKs
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        return welcome
+
+    def ntransfercmd(self, cmd, rest=None):
+        conn, size = ftplib.FTP.ntransfercmd(self, cmd, rest)
+        # the short resumed handshake and the last block would otherwise wait for delayed ACKs
+        conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        if self.sndbuf:
+            conn.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, self.sndbuf)
+        if self._prot_p:
+            conn = self.context.wrap_socket(conn, server_hostname=self.host,
+                                            session=self.sock.session)
+            self.data_connections += 1
+            if conn.session_reused:
+                self.sessions_reused += 1
+        return conn, size
+
+    def storbinary(self, cmd, fp, blocksize=None, callback=None, rest=None):
+        return ftplib.FTP_TLS.storbinary(self, cmd, fp, blocksize or self.blocksize, callback, rest)
+
+
+def ftps_connect(ftps_ip, ftps_port, ftps_usr, ftps_passwd, blocksize=65536, sndbuf=0, timeout=None):
+    """
+    Connect and login to a ftps server, switch to secure data connection
+    (timeout in seconds: connect and every read/write of control and data connections)
+
+    Returns:
+        logged in SessionReuseFTP_TLS object
+    """
+    ftps = SessionReuseFTP_TLS(blocksize, sndbuf, timeout=timeout)
+    ftps.connect(ftps_ip, ftps_port)
+    ftps.login(ftps_usr, ftps_passwd)
+    ftps.prot_p()          # switch to secure data connection
+    return ftps
+
+
+################################################################################
+# upload verification
+################################################################################
+
+def remote_hash_feature(ftps):
+    """
+    Determine which hash extension the server supports (FEAT)
+
+    Returns:
+        ("HASH", "SHA-256"/"SHA-1"/"MD5"), ("XMD5", "MD5"), ("XCRC", "CRC32") or None
+    """
+    try:
+        feat = ftps.sendcmd("FEAT").upper()
+    except ftplib.all_errors:
+        return None
+    for line in feat.splitlines():
+        words = line.strip().split()
+        if words and words[0] == "HASH" and len(words) > 1:
+            algos = [algo.rstrip("*") for algo in words[1].split(";")]
+            for algo in ("SHA-256", "SHA-1", "MD5"):
+                if algo in algos:
+                    try:
+                        ftps.sendcmd("OPTS HASH " + algo)
+                        return "HASH", algo
+                    except ftplib.all_errors:
+                        pass
+    for cmd, algo in (("XMD5", "MD5"), ("XCRC", "CRC32")):
+        if any(line.strip() == cmd for line in feat.splitlines()):
+            return cmd, algo
+    return None
+
+
+def local_hash(path, algo):
+    """
+    Hash of a local file as lowercase hex string (algo: SHA-256, SHA-1, MD5, CRC32)
+    """
+    if algo == "CRC32":
+        crc = 0
+        with open(path, "rb") as fh:
+            for block in iter(lambda: fh.read(1 << 20), b""):
+                crc = zlib.crc32(block, crc)
+        return "{:08x}".format(crc)
+    digest = hashlib.new(algo.replace("-", "").lower())
+    with open(path, "rb") as fh:
+        for block in iter(lambda: fh.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def verify_file(ftps, local_path, remote_path, hash_feature):
+    """
+    Compare remote SIZE (and hash if supported) with the local file
+
+    Args:
+        ftps: logged in ftps connection (not in a transfer)
+        local_path: local file
+        remote_path: path of the file on the server
+        hash_feature: return value of remote_hash_feature()
+
+    Returns:
+        True if the remote file matches
+    """
+    try:
+        remote_size = ftps.size(remote_path)
+    except ftplib.all_errors as exceptmsg:
+        logging.warning("verify: SIZE %s failed: %s", remote_path, exceptmsg)
+        return False
+    if remote_size != os.path.getsize(local_path):
+        logging.warning("verify: size mismatch %s: local %s, remote %s",
+                        remote_path, os.path.getsize(local_path), remote_size)
+        return False
+
+    if hash_feature is not None:
+        cmd, algo = hash_feature
+        try:
+            # HASH: "213 SHA-256 0-49 <hex> <name>", XMD5/XCRC: "250 <hex>"
+            resp = ftps.sendcmd(cmd + " " + remote_path).split()
+            remote_digest = resp[3] if cmd == "HASH" else resp[1]
+        except (ftplib.all_errors, IndexError) as exceptmsg:
+            logging.warning("verify: %s %s failed: %s", cmd, remote_path, exceptmsg)
+            return False
+        if remote_digest.lower().lstrip("0") != local_hash(local_path, algo).lstrip("0"):
+            logging.warning("verify: %s mismatch %s", algo, remote_path)
+            return False
+
+    logging.debug("verify: ok %s", remote_path)
+    return True
+
+
+class Verifier(threading.Thread):
+    """
+    Verify uploaded files over a second control connection while the upload continues.
+    Files which can not be verified are collected in failed, verify() puts a file into the queue.
+
+    Args:
+        connect: function returning a logged in ftps connection
+        mode: "size" or "hash" (size and hash, if the server supports a hash extension)
+    """
+
+    def __init__(self, connect, mode):
+        threading.Thread.__init__(self, daemon=True)
+        self.connect = connect
+        self.mode = mode
+        self.queue = queue.Queue()
+        self.failed = []
+        self.unverified = []
+        self.verified = 0
+
+    def verify(self, local_path, remote_path):
+        self.queue.put((local_path, remote_path))
+
+    def close(self):
+        """
+        Wait until all queued files are verified
+
+        Returns:
+            list of (local_path, remote_path) which failed the verification
+        """
+        self.queue.put(None)
+        self.join()
+        return self.failed
+
+    def run(self):
+        try:
+            ftps = self.connect()
+            ftps.voidcmd("TYPE I")  # SIZE is only valid in binary mode
+            hash_feature = remote_hash_feature(ftps) if self.mode == "hash" else None
+            logging.debug("verify: hash feature %s", hash_feature)
+        except ftplib.all_errors:
+            logging.exception("verify: second connection failed, verifying after upload")
+            ftps = None
+
+        while True:
+            item = self.queue.get()
+            if item is None:
+                break
+            if ftps is None:
+                self.unverified.append(item)
+            elif verify_file(ftps, item[0], item[1], hash_feature):
+                self.verified += 1
+            else:
+                self.failed.append(item)
+
+        if ftps is not None:
+            try:
+                ftps.quit()
+            except ftplib.all_errors:
+                ftps.close()
+
+
+################################################################################
+# upload
+################################################################################
+
+def ftpsupload(config, localpath, filetype, remote_basedir, remotefoldername, enable_recursive, ftps_usr, ftps_passwd, ftps_ip, prog=None, ftps_port=21, verify="none", retries=2,
+               blocksize=65536, sndbuf=0, timeout=None):
     """
     Upload recursive/non-recursive files matching type from a folder to a target
     directory on a FTP server
 
     Args:
         localpath: path which holds elements to upload
-        filetype: type of files to upload (leave empty to disable)
+        filetype: tuple of lowercase file endings to upload (leave empty to disable)
         remote_basedir: remote folder on FTP server
         remotefoldername: job folder name
         enable_recursive: enable or disable resoursive upload
         FTPusername: FTP username
         FTPpasswd: FTP password
         FTPIP: IP adress of the ftps server
+        prog: progress.Progress object of this upload (optional)
+        ftps_port: port of the ftps server
+        verify: "none", "size" or "hash", verify uploaded files concurrently, re-upload failed files
+        retries: how often a file which failed the verification is uploaded again
+        blocksize: block size of data transfers
+        sndbuf: socket send buffer of data connections (0: OS default)
+        timeout: connect/read/write timeout in seconds, a stalled transfer fails after it
 
     Returns:
         0: everything ok
@@ -34,36 +261,37 @@ def ftpsupload(config, localpath, filetype, remote_basedir, remotefoldername, en
 
     logging.debug("Entered ftpsupload_recoursive()")
     try:
-        ftps = ftplib.FTP_TLS(ftps_ip)
-        ftps.login(ftps_usr, ftps_passwd)
-        ftps.prot_p()          # switch to secure data connection
+        def connect():
+            return ftps_connect(ftps_ip, ftps_port, ftps_usr, ftps_passwd, blocksize, sndbuf, timeout)
+
+        ftps = connect()
         logging.info("Logged into FTPS Server: %s, username: %s", ftps_ip, ftps_usr)
 
         # remote_basedir on server must already exist!
         # for security reasons the ftps account should only have writing
         # permissions to the remote folder name, no other directory, no other permissions,
         # create job specific folder in remote_basedir if not already exists
-        logging.info("cwd: " + remote_basedir)
+        logging.info("cwd: %s", remote_basedir)
         ftps.cwd(remote_basedir)
 
         # if ftps server supports mlsd, use it, nlst is maked as deprecated in Python3/ftplib
         # check if remotefoldername exists
         use_mlsd = False
-        logging.debug("use mlsd instead nlst: " + str(use_mlsd))
+        logging.debug("use mlsd instead nlst: %s", use_mlsd)
 
         if use_mlsd:
             remotefoldername_exists = False
             for name, facts in ftps.mlsd(".", ["type"]):
                 if facts["type"] == "dir" and name == remotefoldername:
-                    logging.debug("isdir: " + name)
+                    logging.debug("isdir: %s", name)
                     remotefoldername_exists = True
                     break
-            logging.debug("remote state" + str(remotefoldername_exists))
+            logging.debug("remote state %s", remotefoldername_exists)
             if remotefoldername_exists:
-                logging.debug("folder did exist: " + remotefoldername)
+                logging.debug("folder did exist: %s", remotefoldername)
             else:
                 ftps.mkd(remotefoldername)
-                logging.debug("folder does not exitst, ftps.mkd: " + remotefoldername)
+                logging.debug("folder does not exitst, ftps.mkd: %s", remotefoldername)
         else:
             # nlst legacy support for ftps servers that do not support mlsd
             # e.g. vsftp
@@ -74,57 +302,84 @@ def ftpsupload(config, localpath, filetype, remote_basedir, remotefoldername, en
 
             if not remotefoldername in dirlist:
                 ftps.mkd(remotefoldername)
-                logging.debug("folder does not exitst, ftps.mkd: " + remotefoldername)
+                logging.debug("folder does not exitst, ftps.mkd: %s", remotefoldername)
             else:
-                logging.debug("folder did exist: " + remotefoldername)
+                logging.debug("folder did exist: %s", remotefoldername)
 
         # cwd into job dir
-        logging.info("cwd: " + remotefoldername)
+        logging.info("cwd: %s", remotefoldername)
         ftps.cwd(remotefoldername)
+        # absolute: verified and uploaded again on this connection (in another directory by then)
+        job_remote_path = ftps.pwd()
+
+        if prog is not None:
+            prog.add_total(*fileops.tree_size(localpath, filetype, enable_recursive))
+            callback = lambda block: prog.update(0, len(block))
+        else:
+            callback = None
 
-        def STOR_dir(ftps, path):
+        verifier = None
+        if verify != "none":
+            verifier = Verifier(connect, verify)
+            verifier.start()
+
+        def STOR_file(ftps, f_path, f_name, remote_path):
+            """
+            Upload a file into the current remote directory, queue it for verification
+            """
+            with open(f_path, 'rb') as fh:
+                ftps.storbinary('STOR ' + f_name, fh, callback=callback)
+            logging.info("STOR: %s", f_name)
+            if prog is not None:
+                prog.update(1)
+            if verifier is not None:
+                verifier.verify(f_path, posixpath.join(remote_path, f_name))
+
+        def STOR_dir(ftps, path, remote_path):
             """
             Upload a directory
             """
-            logging.debug("Entered STOR_dir: " + path)
+            logging.debug("Entered STOR_dir: %s", path)
 
             filelist = os.listdir(path)
-            logging.debug("filelist in path: " + str(filelist))
+            logging.debug("filelist in path: %s", filelist)
 
             for f_name in filelist:
                 f_path = os.path.join(path, f_name)
 
                 # check if f_path is file or dir
-                logging.debug("analyzing: " + f_path)
+                logging.debug("analyzing: %s", f_path)
 
                 if os.path.isfile(f_path):
-                    logging.debug("is a file: " + f_path)
+                    logging.debug("is a file: %s", f_path)
                     # check if f_path is accepted filetype
                     if not filetype:
                         logging.debug("filetype list empty, disabled type checking")
-                        ftps.storbinary('STOR ' + f_name, open(f_path, 'rb'))
-                        logging.info("STOR: " + f_name)
-                    elif f_path.lower().endswith(tuple(filetype)):
-                        logging.debug("file has correct extension: " + f_path)
-                        ftps.storbinary('STOR ' + f_name, open(f_path, 'rb'))
-                        logging.info("STOR: " + f_name)
+                        STOR_file(ftps, f_path, f_name, remote_path)
+                    elif f_path.lower().endswith(filetype):
+                        logging.debug("file has correct extension: %s", f_path)
+                        STOR_file(ftps, f_path, f_name, remote_path)
                     else:
-                        logging.debug("Not correct file extension: " + f_path)
+                        logging.debug("Not correct file extension: %s", f_path)
 
                 # check if f_path is dir
                 elif os.path.isdir(f_path):
-                    logging.debug("is a path: " + f_path)
+                    logging.debug("is a path: %s", f_path)
                     # check if recursive upload is desired
                     if enable_recursive:
                         logging.debug("recursive upload enabled")
-                        logging.debug("mkd " + f_name)
-                        ftps.mkd(f_name)
+                        logging.debug("mkd %s", f_name)
+                        try:
+                            ftps.mkd(f_name)
+                        except ftplib.error_perm:
+                            # created by an earlier (partial) upload of the job
+                            logging.debug("mkd failed, folder exists: %s", f_name)
 
-                        logging.debug("cwd" + f_name)
+                        logging.debug("cwd %s", f_name)
                         ftps.cwd(f_name)
 
-                        logging.info("starting recursive call on: " + f_path)
-                        STOR_dir(ftps, f_path)
+                        logging.info("starting recursive call on: %s", f_path)
+                        STOR_dir(ftps, f_path, posixpath.join(remote_path, f_name))
 
                         logging.debug("cwd ..")
                         ftps.cwd("..")
@@ -134,9 +389,46 @@ def ftpsupload(config, localpath, filetype, remote_basedir, remotefoldername, en
                     logging.debug(
                         "recursive upload, element is neither file nor folder")
 
-        logging.info("Starting upload of dir: " + localpath)
-        STOR_dir(ftps, localpath)
+        logging.info("Starting upload of dir: %s", localpath)
+        try:
+            STOR_dir(ftps, localpath, job_remote_path)
+        finally:
+            if verifier is not None:
+                failed = verifier.close()
+
+        if verifier is not None:
+            hash_feature = None
+            if verify == "hash" and (failed or verifier.unverified):
+                hash_feature = remote_hash_feature(ftps)
+            # second connection not possible, verify on this connection
+            for local_path, remote_path in verifier.unverified:
+                if not verify_file(ftps, local_path, remote_path, hash_feature):
+                    failed.append((local_path, remote_path))
+            logging.info("verify: %d files ok, %d failed", verifier.verified, len(failed))
+
+            # upload only the failed files again
+            for retry in range(retries):
+                if not failed:
+                    break
+                still_failed = []
+                for local_path, remote_path in failed:
+                    logging.warning("verify: uploading again (%d): %s", retry + 1, remote_path)
+                    with open(local_path, 'rb') as fh:
+                        ftps.storbinary('STOR ' + remote_path, fh, blocksize, callback=callback)
+                    if not verify_file(ftps, local_path, remote_path, hash_feature):
+                        still_failed.append((local_path, remote_path))
+                failed = still_failed
+
+            if failed:
+                ftps.quit()
+                return -1, "error in ftpsupload_recoursive():\nverification failed: " + \
+                    ", ".join(remote_path for _, remote_path in failed)
+
+        logging.info("TLS session reused on %d of %d data connections",
+                     ftps.sessions_reused, ftps.data_connections)
         ftps.quit()
+        if prog is not None:
+            prog.finish()
         logging.info("FTP logout")
         return 0, "success"
 
@@ -148,3 +440,83 @@ def ftpsupload(config, localpath, filetype, remote_basedir, remotefoldername, en
 
     except Exception as exceptmsg:
         return -1, "error in ftpsupload_recoursive():\n" + str(exceptmsg)
+
+
+def upload(target_config, localpath, filetype, remotefoldername, enable_recursive, prog=None):
+    """
+    Transfer backend "ftps" (see transfer.py), settings from the target section of the config
+    """
+    return ftpsupload(None, localpath, filetype, target_config["target_dir"], remotefoldername,
+                      enable_recursive, target_config["username"], target_config["password"],
+                      target_config["ftp"], prog, target_config["port"],
+                      verify=target_config["verify"], blocksize=target_config["blocksize"],
+                      sndbuf=target_config["sndbuf"], timeout=target_config["timeout_s"])
+
+
+################################################################################
+# session (several uploads of one job over one connection)
+################################################################################
+
+class Session:
+    """
+    Transfer backend "ftps" session (see transfer.Session): one logged in connection for
+    several uploads of single files into the job folder, every file is verified on this
+    connection right after its upload (target verify) and uploaded again if it failed
+
+    Args:
+        target_config: target section of the config
+        remotefoldername: job folder name
+        retries: how often a file which failed the verification is uploaded again
+    """
+
+    def __init__(self, target_config, remotefoldername, retries=2):
+        self.verify = target_config["verify"]
+        self.retries = retries
+        self.ftps = ftps_connect(target_config["ftp"], target_config["port"], target_config["username"],
+                                 target_config["password"], target_config["blocksize"], target_config["sndbuf"],
+                                 target_config["timeout_s"])
+        logging.info("Logged into FTPS Server: %s, username: %s (session)", target_config["ftp"],
+                     target_config["username"])
+        self.ftps.voidcmd("TYPE I")  # SIZE is only valid in binary mode
+        self.hash_feature = remote_hash_feature(self.ftps) if self.verify == "hash" else None
+        self.remote_path = posixpath.join(target_config["target_dir"], remotefoldername)
+        self.folders = set()
+        self.mkd(self.remote_path)
+
+    def mkd(self, remote_path):
+        if remote_path in self.folders:
+            return
+        try:
+            self.ftps.mkd(remote_path)
+        except ftplib.error_perm:
+            # created by an earlier upload of the job
+            logging.debug("mkd failed, folder exists: %s", remote_path)
+        self.folders.add(remote_path)
+
+    def put(self, local_path, rel_path, prog=None):
+        """
+        Upload one file to <job folder>/<rel_path> (folders are created)
+
+        Raises:
+            OSError if the file fails the verification after the retries
+        """
+        parts = rel_path.split(os.sep)
+        for depth in range(1, len(parts)):
+            self.mkd(posixpath.join(self.remote_path, *parts[:depth]))
+        remote_path = posixpath.join(self.remote_path, *parts)
+        callback = None if prog is None else lambda block: prog.update(0, len(block))
+        for attempt in range(self.retries + 1):
+            if attempt:
+                logging.warning("verify: uploading again (%d): %s", attempt, remote_path)
+            with open(local_path, "rb") as fh:
+                self.ftps.storbinary("STOR " + remote_path, fh, callback=callback)
+            logging.info("STOR: %s", remote_path)
+            if self.verify == "none" or verify_file(self.ftps, local_path, remote_path, self.hash_feature):
+                return
+        raise OSError("verification failed: " + remote_path)
+
+    def close(self):
+        try:
+            self.ftps.quit()
+        except ftplib.all_errors:
+            self.ftps.close()
@@ -3,9 +3,12 @@
 Module to generate a html table of images fro a list of filenames.
 Media source and colums can be adjusted.
 """
+import itertools
 import logging
 import os
 
+from libmultiupload import fileops
+
 
 # slice list in multiple lists with sublen as lengh
 def row_major(slist, sublen):
@@ -16,41 +19,74 @@ def row_major(slist, sublen):
 
 
 # create a simple html table with links to the content
-def html_table(lists, img_weblink, job_dir):
+def html_table(lists, img_weblink, job_dir, similar_counts=None):
     """
     Generate a html table with embedded images from an image list
+    (similar_counts: representative -> number of collapsed near-duplicates)
     """
     table_text = "<table width=\"400px\"><tbody>\n"
     for sublist in lists:
         table_text += "<tr>\n"
         for img in sublist:
-            logging.debug("adding to html table: " + img)
+            logging.debug("adding to html table: %s", img)
 
             # images are accessible via a weblink after remote_ftp upload
             #filelink = config["email"]["weblink"] + job_dir + "/" + nr
             filelink = img_weblink + job_dir + "/" + img
+            caption = os.path.basename(img)
+            if similar_counts and img in similar_counts:
+                caption += " (+{} similar)".format(similar_counts[img])
             table_text += "<td><a href=\"{}\">{}<br/><img style=\"max-width:40%;\" src=\"{}\" /></a></td>\n".format(
-                filelink, img, filelink)
+                filelink, caption, filelink)
         table_text += "</tr>\n"
     table_text += "</tbody></table>\n"
     return table_text
 
 
-def email_text_html(config, htmltext_header, htmltext_footer, img_weblink, img_path, job_dir):
+def html_links(names, img_weblink, job_dir):
+    """
+    Generate a html list with links to uploaded files (video proxies, archive volumes)
+    """
+    links_text = "<ul>\n"
+    for name in names:
+        filelink = img_weblink + job_dir + "/" + name
+        links_text += "<li><a href=\"{}\">{}</a></li>\n".format(filelink, name)
+    links_text += "</ul>\n"
+    return links_text
+
+
+def email_text_html(config, htmltext_header, htmltext_footer, img_weblink, img_path, job_dir,
+                    video_path=None, archive_names=None, similar_counts=None):
     """
     Generate a full html file to be sent as email
+    (video_path: folder of the video proxies, linked if present,
+    archive_names: file names of the zip volumes, default <job_dir>.zip,
+    similar_counts: representative -> number of near-duplicates not shown)
     """
     # htmltext = config["email"]["header_html"]
     htmltext = htmltext_header
-    htmltext += "Die Originalaufnahmen sind in wenigen Minuten <a href=\"{}/{}.zip\">hier</a> abrufbar.".format(
-        img_weblink + job_dir, job_dir)
+    if not archive_names or archive_names == [job_dir + ".zip"]:
+        htmltext += "Die Originalaufnahmen sind in wenigen Minuten <a href=\"{}/{}.zip\">hier</a> abrufbar.".format(
+            img_weblink + job_dir, job_dir)
+    else:
+        htmltext += "Die Originalaufnahmen sind in wenigen Minuten in {} Teilen abrufbar:\n".format(len(archive_names))
+        htmltext += html_links(archive_names, img_weblink, job_dir)
     # thumbnail images
     if config["image_thumbnail"]["enable"]:
         if os.path.exists(img_path):
-            images = os.listdir(img_path)
+            images = fileops.list_files(img_path)
             #htmltext.append("Image ZIP: %s")
-            htmlret = html_table(row_major(images, 3), img_weblink, job_dir)
-            htmltext += htmlret
+            # one table per subfolder of a merged job (relative paths, links keep the folders)
+            for subfolder, sub_images in itertools.groupby(images, key=os.path.dirname):
+                if subfolder:
+                    htmltext += "<h3>{}</h3>\n".format(subfolder)
+                htmlret = html_table(row_major(list(sub_images), 3), img_weblink, job_dir, similar_counts)
+                htmltext += htmlret
+    # video proxies
+    if video_path is not None and os.path.exists(video_path):
+        videos = fileops.list_files(video_path)
+        if videos:
+            htmltext += "Videos:\n" + html_links(videos, img_weblink, job_dir)
     #htmltext += config["email"]["footer_html"]
     htmltext += htmltext_footer
     return htmltext
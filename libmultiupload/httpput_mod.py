@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+"""
+HTTP(S) PUT upload backend
+Every file is sent with PUT to <url>/<job>/<relative path>, one keep-alive connection per job.
+Folders are created with MKCOL if the target is a WebDAV server ("mkcol": true).
+"""
+import base64
+import http.client
+import logging
+import os
+import posixpath
+import urllib.parse
+
+from libmultiupload import fileops, transfer
+
+
+class _ProgressReader:
+    """
+    File object wrapper which reports read bytes to a Progress object
+    """
+
+    def __init__(self, fh, prog):
+        self.fh = fh
+        self.prog = prog
+
+    def read(self, size=-1):
+        block = self.fh.read(size)
+        self.prog.update(0, len(block))
+        return block
+
+
+class _Client:
+    """
+    Keep-alive connection to the target url with the credentials of the target
+    """
+
+    def __init__(self, target_config):
+        self.target_config = target_config
+        url = urllib.parse.urlsplit(target_config["url"])
+        self.base_path = url.path or "/"
+        if url.scheme == "https":
+            self.conn = http.client.HTTPSConnection(url.netloc, timeout=target_config["timeout_s"],
+                                                    blocksize=target_config["blocksize"])
+        else:
+            self.conn = http.client.HTTPConnection(url.netloc, timeout=target_config["timeout_s"],
+                                                   blocksize=target_config["blocksize"])
+        self.headers = {}
+        if target_config["username"]:
+            credentials = "{}:{}".format(target_config["username"], target_config["password"])
+            self.headers["Authorization"] = "Basic " + base64.b64encode(credentials.encode()).decode()
+
+    def request(self, method, remote_path, body=None, length=0):
+        request_headers = dict(self.headers)
+        request_headers["Content-Length"] = str(length)
+        self.conn.request(method, urllib.parse.quote(remote_path), body, request_headers)
+        response = self.conn.getresponse()
+        response.read()  # keep the connection reusable
+        return response.status
+
+    def mkcol(self, remote_path):
+        if self.target_config["mkcol"]:
+            # 405: collection already exists
+            status = self.request("MKCOL", remote_path + "/")
+            if status not in (201, 405):
+                raise IOError("MKCOL {} returned {}".format(remote_path, status))
+
+    def put(self, local_path, remote_path, prog=None):
+        with open(local_path, "rb") as fh:
+            body = fh if prog is None else _ProgressReader(fh, prog)
+            status = self.request("PUT", remote_path, body, os.path.getsize(local_path))
+        if status not in (200, 201, 204):
+            raise IOError("PUT {} returned {}".format(remote_path, status))
+        logging.info("PUT: %s", remote_path)
+
+    def close(self):
+        self.conn.close()
+
+
+def upload(target_config, localpath, filetype, remotefoldername, enable_recursive, prog=None):
+    """
+    Transfer backend "http" (see transfer.py)
+
+    Args:
+        target_config: target section of the config (url, username, password, mkcol, blocksize, timeout_s)
+        localpath: path which holds elements to upload
+        filetype: tuple of lowercase file endings to upload (leave empty to disable)
+        remotefoldername: job folder name
+        enable_recursive: enable or disable recursive upload
+        prog: progress.Progress object of this upload (optional)
+
+    Returns:
+        (0, "success") or (-1, error message)
+    """
+    logging.debug("Entered http upload(): %s", localpath)
+    try:
+        client = _Client(target_config)
+
+        def put_dir(path, remote_path):
+            client.mkcol(remote_path)
+            for entry in os.scandir(path):
+                if entry.is_file():
+                    if transfer.matches(entry.name, filetype):
+                        client.put(entry.path, posixpath.join(remote_path, entry.name), prog)
+                        if prog is not None:
+                            prog.update(1)
+                elif entry.is_dir() and enable_recursive:
+                    put_dir(entry.path, posixpath.join(remote_path, entry.name))
+
+        try:
+            if prog is not None:
+                prog.add_total(*fileops.tree_size(localpath, filetype, enable_recursive))
+            put_dir(localpath, posixpath.join(client.base_path, remotefoldername))
+            if prog is not None:
+                prog.finish()
+        finally:
+            client.close()
+        return 0, "success"
+
+    except Exception as exceptmsg:
+        return -1, "error in http upload():\n" + str(exceptmsg)
+
+
+class Session:
+    """
+    Transfer backend "http" session (see transfer.Session): one keep-alive connection for
+    several uploads of single files into the job folder
+    """
+
+    def __init__(self, target_config, remotefoldername):
+        self.client = _Client(target_config)
+        self.remote_path = posixpath.join(self.client.base_path, remotefoldername)
+        self.folders = set()
+        self.mkcol(self.remote_path)
+
+    def mkcol(self, remote_path):
+        if remote_path not in self.folders:
+            self.client.mkcol(remote_path)
+            self.folders.add(remote_path)
+
+    def put(self, local_path, rel_path, prog=None):
+        """
+        Upload one file to <job folder>/<rel_path> (folders are created)
+        """
+        parts = rel_path.split(os.sep)
+        for depth in range(1, len(parts)):
+            self.mkcol(posixpath.join(self.remote_path, *parts[:depth]))
+        self.client.put(local_path, posixpath.join(self.remote_path, *parts), prog)
+
+    def close(self):
+        self.client.close()
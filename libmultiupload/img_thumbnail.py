@@ -1,15 +1,90 @@
 #!/usr/bin/env python3
 """
 Create thumbnails from images with autotation and EXIF stripping
+Output profiles (config image_thumbnail.profiles) select format, quality, progressive/optimize
+and an optional byte budget per thumbnail, met by a bounded search over the quality.
 """
+import io
 import logging
 import os
-import shutil
 
 from PIL import ExifTags, Image
 
+from libmultiupload import fileops
 
-def make_thumbnail(src, dest, filetype, size_px):
+# file extension of the thumbnail per output format
+FORMAT_EXTENSIONS = {"JPEG": ".jpg", "WEBP": ".webp", "PNG": ".png"}
+# extensions of images already in an output format (their thumbnail keeps the name)
+SOURCE_EXTENSIONS = {"JPEG": (".jpg", ".jpeg"), "WEBP": (".webp",), "PNG": (".png",)}
+
+
+def thumbnail_name(name, profile):
+    """
+    Return the file name of the thumbnail of an image: the name itself if it is in the
+    profile format, otherwise the extension of the format is appended
+    (IMG_1.png -> IMG_1.png.jpg: IMG_1.jpg and IMG_1.png never share a thumbnail)
+    """
+    if profile is None or not profile["format"] or \
+            os.path.splitext(name)[1].lower() in SOURCE_EXTENSIONS[profile["format"]]:
+        return name
+    return name + FORMAT_EXTENSIONS[profile["format"]]
+
+
+def encode(img, profile, quality):
+    """
+    Encode an image with the settings of a profile
+
+    Returns:
+        encoded bytes
+    """
+    options = {}
+    if profile["format"] in ("JPEG", "WEBP"):
+        options["quality"] = quality
+    if profile["format"] == "JPEG":
+        options["progressive"] = profile["progressive"]
+        options["optimize"] = profile["optimize"]
+    elif profile["format"] == "WEBP":
+        options["method"] = profile["method"]
+    elif profile["format"] == "PNG":
+        options["optimize"] = profile["optimize"]
+    buf = io.BytesIO()
+    img.save(buf, profile["format"], **options)
+    return buf.getvalue()
+
+
+def encode_within_budget(img, profile):
+    """
+    Encode with the profile quality, if the result exceeds max_bytes search the highest
+    quality >= min_quality within the budget (binary search, at most search_steps encodings)
+
+    Returns:
+        (encoded bytes, quality)
+    """
+    data = encode(img, profile, profile["quality"])
+    if not profile["max_bytes"] or len(data) <= profile["max_bytes"] or profile["format"] == "PNG":
+        return data, profile["quality"]
+
+    low, high = profile["min_quality"], profile["quality"] - 1
+    best = None
+    for _ in range(profile["search_steps"]):
+        if low > high:
+            break
+        quality = (low + high) // 2
+        candidate = encode(img, profile, quality)
+        if len(candidate) <= profile["max_bytes"]:
+            best = (candidate, quality)
+            low = quality + 1
+        else:
+            high = quality - 1
+    if best is None:
+        # budget not reachable, smallest allowed quality
+        best = (encode(img, profile, profile["min_quality"]), profile["min_quality"])
+        logging.warning("thumbnail exceeds byte budget at min_quality: %d > %d bytes",
+                        len(best[0]), profile["max_bytes"])
+    return best
+
+
+def make_thumbnail(src, dest, filetype, size_px, profile=None):
     """
     Create thumbnails from image with rotating.
     Strip EXIF date.
@@ -17,8 +92,10 @@ def make_thumbnail(src, dest, filetype, size_px):
     Args:
         src: strig, path to the original file
         dest: path to the not yet existent thumbnail file
-        filetype: accepted type (file ending)
+        filetype: accepted types (tuple of lowercase file endings)
         size_px: size of the thumbnail (aspec ration is kept, image is fitted inside this area)
+        profile: output profile (format, quality, ...), None: source format with PIL defaults,
+                 the thumbnail is written to thumbnail_name(dest, profile)
 
     Returns:
         0 if completed successfull
@@ -26,32 +103,32 @@ def make_thumbnail(src, dest, filetype, size_px):
     """
 
     logging.debug("Entered make_thumbnail()")
-    logging.debug("process " + str(os.getpid()) + " arguments: " + str(src) +
-                  " " + str(dest) + " " + str(filetype) + " " + str(size_px))
+    logging.debug("process %s arguments: %s %s %s %s", os.getpid(), src, dest, filetype, size_px)
 
     try:
-        logging.debug("checking if path exists: " + os.path.dirname(dest))
+        logging.debug("checking if path exists: %s", os.path.dirname(dest))
 
         if not os.path.exists(os.path.dirname(dest)):
-            logging.debug("dest folder does not exist, creating: " + os.path.dirname(dest))
+            logging.debug("dest folder does not exist, creating: %s", os.path.dirname(dest))
             os.makedirs(os.path.dirname(dest))
         else:
-            logging.debug("dest path exists " + os.path.dirname(dest))
-
-        shutil.copy2(src, dest)
+            logging.debug("dest path exists %s", os.path.dirname(dest))
 
         # also check against lowercase
-        if os.path.isfile(dest) and dest.lower().endswith(tuple(filetype)):
-
+        # files which can not be thumbnailed are cloned/copied as they are,
+        # images are written directly as thumbnail (no intermediate full copy)
+        if not dest.lower().endswith(filetype):
+            fileops.copy_file(src, dest)
+        else:
             # PIL/pillow will not save EXIF data after modifying image
             # (desired since those images might be shared with press or third party
             # and EXIF data might contain sensitive information (GPS location))
             with Image.open(src) as img:
 
-                logging.debug("opening for thumb creation: " + dest)
+                logging.debug("opening for thumb creation: %s", dest)
 
                 # try:
-                logging.debug("process " + str(os.getpid()) + "trying EXIF rotation")
+                logging.debug("process %s trying EXIF rotation", os.getpid())
 
 
 #
@@ -67,7 +144,7 @@ def make_thumbnail(src, dest, filetype, size_px):
                     e = img._getexif()       # returns None if no EXIF data
                     if e is not None:
                         exif = dict(e.items())
-                        orientation = exif[orientation]
+                        orientation = exif.get(orientation)  # None if the tag is missing
 
                         if orientation == 3:
                             img = img.transpose(Image.ROTATE_180)
@@ -76,19 +153,28 @@ def make_thumbnail(src, dest, filetype, size_px):
                         elif orientation == 8:
                             img = img.transpose(Image.ROTATE_90)
 
-                img.thumbnail(size_px, Image.ANTIALIAS)
-                img.save(dest)
+                img.thumbnail(size_px, Image.LANCZOS)  # ANTIALIAS: removed alias of LANCZOS
+                if profile is None or not profile["format"]:
+                    img.save(dest)
+                else:
+                    if profile["format"] != "PNG" and img.mode not in ("RGB", "L"):
+                        # no alpha channel/palette in JPEG (WEBP: smaller without)
+                        img = img.convert("RGB")
+                    data, quality = encode_within_budget(img, profile)
+                    with open(thumbnail_name(dest, profile), "wb") as fh:
+                        fh.write(data)
+                    logging.debug("thumbnail %s: %d bytes, quality %s", dest, len(data), quality)
 
                 # except AttributeError:
                 #    logging.info("image without EXIF data or non jpeg image")
                 # except Exception as e:
                 #     logging.warning(
                 #         "some other error while trying to rotate thumbnail ???" + str(e))
-        logging.info("Created thumbnail: " + dest)
+        logging.info("Created thumbnail: %s", dest)
         return 0
 
     except Exception as exceptmsg:
-        logging.exception("Fatal Error in image_thumbnails(): " + str(exceptmsg))
+        logging.exception("Fatal Error in image_thumbnails(): %s", exceptmsg)
         return -1
 
         # for orientation in ExifTags.TAGS.keys():
@@ -0,0 +1,215 @@
+#!/usr/bin/env python3
+"""
+Job history store (sqlite, config["history"]["path"]):
+    jobs:    one row per job (source, file counts, bytes, thumbnail bytes, status, start/end time, queue wait)
+    stages:  duration of every stage of a job (written by profiling.stage)
+    targets: result of every upload of a job (target, backend, stage)
+    errors:  error messages of a job
+Written by the analyzer and uploader processes (one short connection per call, WAL mode),
+read by the webui (/api/jobs) without touching archive_path or temp_path.
+The history belongs to one host: on a network filesystem WAL is disabled (rollback journal).
+"""
+import logging
+import os
+import sqlite3
+import time
+
+from libmultiupload import udiskie_mounthelper
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    job TEXT PRIMARY KEY,
+    source TEXT,
+    status TEXT,
+    image_files INTEGER DEFAULT 0,
+    video_files INTEGER DEFAULT 0,
+    bytes INTEGER DEFAULT 0,
+    created REAL,
+    started REAL,
+    finished REAL,
+    queue_wait REAL,
+    thumb_bytes INTEGER
+);
+CREATE INDEX IF NOT EXISTS jobs_created ON jobs (created);
+CREATE INDEX IF NOT EXISTS jobs_status_created ON jobs (status, created);
+CREATE TABLE IF NOT EXISTS stages (
+    job TEXT,
+    stage TEXT,
+    duration REAL,
+    finished REAL
+);
+CREATE INDEX IF NOT EXISTS stages_job ON stages (job);
+CREATE TABLE IF NOT EXISTS targets (
+    job TEXT,
+    target TEXT,
+    backend TEXT,
+    stage TEXT,
+    ok INTEGER,
+    message TEXT,
+    finished REAL
+);
+CREATE INDEX IF NOT EXISTS targets_job ON targets (job);
+CREATE TABLE IF NOT EXISTS errors (
+    job TEXT,
+    message TEXT,
+    time REAL
+);
+CREATE INDEX IF NOT EXISTS errors_job ON errors (job);
+"""
+
+JOB_FIELDS = ("source", "status", "image_files", "video_files", "bytes", "created", "started", "finished",
+              "queue_wait", "thumb_bytes")
+
+# columns added later: (table, column, type), added to existing databases
+MIGRATIONS = (("jobs", "queue_wait", "REAL"),
+              ("jobs", "thumb_bytes", "INTEGER"))
+
+_initialized = set()  # databases with schema of this process
+
+
+def _connect(config):
+    path = config["history"]["path"]
+    if path not in _initialized and os.path.dirname(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+    conn = sqlite3.connect(path, timeout=30)
+    conn.row_factory = sqlite3.Row
+    if path not in _initialized:
+        fstype = udiskie_mounthelper.filesystem_type(path)
+        if fstype in udiskie_mounthelper.NETWORK_FILESYSTEMS:
+            # WAL needs shared memory of all processes on one host, a rollback journal is
+            # safer on a network share (the history is per host, see README)
+            logging.warning("job history %s is on a network filesystem (%s), WAL disabled", path, fstype)
+            conn.execute("PRAGMA journal_mode=DELETE")
+        else:
+            conn.execute("PRAGMA journal_mode=WAL")
+        conn.executescript(SCHEMA)
+        for table, column, column_type in MIGRATIONS:
+            if column not in [row["name"] for row in conn.execute("PRAGMA table_info({})".format(table))]:
+                conn.execute("ALTER TABLE {} ADD COLUMN {} {}".format(table, column, column_type))
+        _initialized.add(path)
+    return conn
+
+
+def _write(config, sql, params):
+    """
+    Execute one write statement, errors are logged (the history never stops a job)
+    """
+    if not config["history"]["enable"]:
+        return
+    try:
+        conn = _connect(config)
+        try:
+            with conn:
+                conn.execute(sql, params)
+        finally:
+            conn.close()
+    except sqlite3.Error:
+        logging.exception("Error writing job history")
+
+
+def record_job(config, job, **fields):
+    """
+    Insert or update a job (fields: see JOB_FIELDS)
+    """
+    unknown = set(fields) - set(JOB_FIELDS)
+    if unknown:
+        raise ValueError("unknown job fields: {}".format(unknown))
+    columns = ["job"] + list(fields)
+    # created is only set once (the analyzer creates the job, single/replay mode the uploader)
+    updates = ", ".join("created=COALESCE(jobs.created, excluded.created)" if column == "created"
+                        else "{0}=excluded.{0}".format(column) for column in fields) or "job=job"
+    _write(config, "INSERT INTO jobs ({}) VALUES ({}) ON CONFLICT(job) DO UPDATE SET {}".format(
+        ", ".join(columns), ", ".join("?" * len(columns)), updates), [job] + list(fields.values()))
+
+
+def record_stage(config, job, stage, duration):
+    _write(config, "INSERT INTO stages VALUES (?, ?, ?, ?)", (job, stage, duration, time.time()))
+
+
+def record_target(config, job, target, backend, stage, ret_code, ret_msg):
+    _write(config, "INSERT INTO targets VALUES (?, ?, ?, ?, ?, ?, ?)",
+           (job, target, backend, stage, int(ret_code == 0), ret_msg, time.time()))
+
+
+def record_error(config, job, message):
+    _write(config, "INSERT INTO errors VALUES (?, ?, ?)", (job, message, time.time()))
+
+
+def rename_job(config, job, new_name):
+    """
+    Move all rows of a job to a new job name (e.g. a job renamed in the spool)
+    """
+    if not config["history"]["enable"]:
+        return
+    try:
+        conn = _connect(config)
+        try:
+            with conn:
+                for table in ("jobs", "stages", "targets", "errors"):
+                    conn.execute("UPDATE {} SET job = ? WHERE job = ?".format(table), (new_name, job))
+        finally:
+            conn.close()
+    except sqlite3.Error:
+        logging.exception("Error writing job history")
+
+
+def job_exists(config, job):
+    """
+    True if the job name is in the history (False if the history is disabled or unreadable)
+    """
+    if not config["history"]["enable"]:
+        return False
+    try:
+        conn = _connect(config)
+        try:
+            return conn.execute("SELECT 1 FROM jobs WHERE job = ?", (job,)).fetchone() is not None
+        finally:
+            conn.close()
+    except sqlite3.Error:
+        logging.exception("Error reading job history")
+        return False
+
+
+def list_jobs(config, page=1, per_page=50, status=None):
+    """
+    Return one page of jobs, newest first
+
+    Returns:
+        {"page", "per_page", "total", "jobs": [job dicts]}
+    """
+    page = max(page, 1)
+    per_page = min(max(per_page, 1), 500)
+    where = ""
+    params = []
+    if status:
+        where = "WHERE status = ?"
+        params.append(status)
+    conn = _connect(config)
+    try:
+        total = conn.execute("SELECT COUNT(*) FROM jobs " + where, params).fetchone()[0]
+        rows = conn.execute("SELECT * FROM jobs {} ORDER BY created DESC LIMIT ? OFFSET ?".format(where),
+                            params + [per_page, (page - 1) * per_page]).fetchall()
+    finally:
+        conn.close()
+    return {"page": page, "per_page": per_page, "total": total, "jobs": [dict(row) for row in rows]}
+
+
+def get_job(config, job):
+    """
+    Return a job with its stages, targets and errors, None if unknown
+    """
+    conn = _connect(config)
+    try:
+        row = conn.execute("SELECT * FROM jobs WHERE job = ?", (job,)).fetchone()
+        if row is None:
+            return None
+        result = dict(row)
+        for table in ("stages", "targets", "errors"):
+            result[table] = [dict(entry) for entry in
+                             conn.execute("SELECT * FROM {} WHERE job = ? ORDER BY rowid".format(table), (job,))]
+    finally:
+        conn.close()
+    for entry in result["stages"] + result["targets"] + result["errors"]:
+        del entry["job"]
+    return result
+
@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+"""
+Backpressure and fair ordering between the analyzer and the uploader (daemon mode):
+    - job slots: a job occupies a slot from the start of its copy into temp_path until
+      upload_routine() has finished, the analyzer waits for a free slot before copying
+      (temp_path holds at most queue.jobs_in_temp_max jobs), the webui is informed
+      while ingest is held back. Every slot has one owner which releases it (JobSlots).
+    - FairScheduler: jobs waiting for the uploader are handed out round-robin per source,
+      one card with many folders does not delay every other card
+"""
+import collections
+import logging
+import multiprocessing
+import os
+import queue
+import time
+
+
+class JobSlots:
+    """
+    Job slots shared by the analyzer and the uploader processes
+    A slot is owned by the analyzer process which acquired it until the job is handed to the
+    uploader (hand_over()), from then on by the job: the uploader releases it after
+    upload_routine() (release_job(), also the main process for an abandoned job).
+    The slots of a dead analyzer are freed with release_orphaned(). A slot released twice
+    raises ValueError (BoundedSemaphore) instead of silently raising the limit.
+
+    Args:
+        count: number of slots (queue.jobs_in_temp_max)
+    """
+
+    def __init__(self, count):
+        self.semaphore = multiprocessing.BoundedSemaphore(count)
+        # pid of the analyzer owning a slot, 0: free or owned by a job
+        # (no lock: a process killed while holding it would block the main process,
+        # every entry is written by the analyzer owning it or after its death)
+        self.owners = multiprocessing.Array("i", count, lock=False)
+
+    def acquire(self, block=True):
+        if not self.semaphore.acquire(block):
+            return False
+        self.owners[self.owners[:].index(0)] = os.getpid()
+        return True
+
+    def hand_over(self):
+        """
+        The job of a slot of this analyzer is queued for the uploader
+        """
+        self.owners[self.owners[:].index(os.getpid())] = 0
+
+    def release_own(self):
+        """
+        Release a slot of this analyzer (no job, or the job left temp_path)
+        """
+        self.hand_over()
+        self.semaphore.release()
+
+    def release_job(self):
+        """
+        Release the slot of a handed over job (after its upload, or abandoned)
+        """
+        self.semaphore.release()
+
+    def release_orphaned(self, analyzer_pid):
+        """
+        Release the slots of analyzer processes other than analyzer_pid (the running one)
+
+        Returns:
+            number of released slots
+        """
+        released = 0
+        for index, pid in enumerate(self.owners[:]):
+            if pid not in (0, analyzer_pid):
+                self.owners[index] = 0
+                self.semaphore.release()
+                released += 1
+        return released
+
+
+def acquire_slot(job_slots, status_queue, source):
+    """
+    Take a job slot, wait (and inform the webui) if all slots are in use
+
+    Args:
+        job_slots: JobSlots shared by analyzer and uploader
+        status_queue: status queue for the webui
+        source: folder which will be copied next
+    """
+    if job_slots.acquire(False):
+        return
+    logging.info("ingest held back, all job slots in use: %s", source)
+    status_queue.put({"type": "backpressure", "held": True, "source": source})
+    wait_start = time.monotonic()
+    job_slots.acquire()
+    waited = time.monotonic() - wait_start
+    logging.info("ingest resumed after %.1fs: %s", waited, source)
+    status_queue.put({"type": "backpressure", "held": False, "source": source, "waited": waited})
+
+
+class FairScheduler:
+    """
+    Jobs ready for upload, one FIFO per source, popped round-robin over the sources
+    """
+
+    def __init__(self):
+        self.sources = collections.OrderedDict()  # source -> deque of (job, enqueued)
+
+    def __len__(self):
+        return sum(len(jobs) for jobs in self.sources.values())
+
+    def add(self, source, job, enqueued):
+        self.sources.setdefault(source, collections.deque()).append((job, enqueued))
+
+    def pop(self):
+        """
+        Return (source, job, enqueued) of the next source in turn
+        """
+        source, jobs = next(iter(self.sources.items()))
+        job, enqueued = jobs.popleft()
+        del self.sources[source]
+        if jobs:
+            # source goes to the end of the round
+            self.sources[source] = jobs
+        return source, job, enqueued
+
+
+def dispatch_jobs(ready_q, job_q, poll_s=0.1):
+    """
+    Move jobs from the analyzer (ready_q) to the uploader (job_q) in fair order
+    (blocks, run in a thread), job_q should be small so the order is decided late:
+    a job is only chosen when job_q has room, jobs arriving until then take part
+
+    Args:
+        ready_q: queue of (source, job, enqueued) from the analyzer
+        job_q: bounded queue of (source, job, enqueued) to the uploader (only filled here)
+        poll_s: interval checking job_q for room
+    """
+    scheduler = FairScheduler()
+    while True:
+        if not scheduler:
+            scheduler.add(*ready_q.get(True))
+        while not ready_q.empty():
+            scheduler.add(*ready_q.get(True))
+        if job_q.full():
+            # the uploader is busy, wait for room (or the next job of the analyzer)
+            try:
+                scheduler.add(*ready_q.get(True, poll_s))
+            except queue.Empty:
+                pass
+            continue
+        job_q.put(scheduler.pop())
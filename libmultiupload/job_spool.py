@@ -0,0 +1,237 @@
+#!/usr/bin/env python3
+"""
+Shared job spool for uploaders on several hosts (config "spool", e.g. an NFS export):
+    <spool>/incoming/  jobs being published (moved/copied from temp_path)
+    <spool>/jobs/      jobs ready for any uploader (atomic rename from incoming)
+    <spool>/leases/    <job>.lease: claim of a job by one uploader
+    <spool>/failed/    jobs whose upload_routine() failed (with their .state file)
+
+An uploader claims a job by creating its lease file exclusively (O_EXCL), a heartbeat
+thread touches the lease every heartbeat_s. A lease not touched for lease_s is expired and
+can be stolen by any uploader, so a job of a dead host is continued by another one:
+upload_routine() skips the stages recorded in <job>.state (job_state) and repeats an
+unfinished stage from its beginning. An uploader which lost its lease stops immediately.
+Lease expiry compares file times with the local clock, the hosts need synchronized clocks.
+"""
+import json
+import logging
+import os
+import shutil
+import signal
+import socket
+import threading
+import time
+import uuid
+
+from libmultiupload import fileops, job_history, job_state
+
+
+def spool_dirs(config):
+    """
+    Return the spool folders (incoming, jobs, leases, failed), created if missing
+    """
+    dirs = [os.path.join(config["spool"]["path"], name) for name in ("incoming", "jobs", "leases", "failed")]
+    for path in dirs:
+        os.makedirs(path, exist_ok=True)
+    return dirs
+
+
+def worker_prefix(name):
+    """
+    Return the owner prefix of all leases of a worker on this host (any process)
+    """
+    return "{}:{}:".format(socket.gethostname(), name)
+
+
+def make_owner(name):
+    """
+    Return a unique owner id of an uploader process (host, worker name, pid)
+    """
+    return "{}{}:{}".format(worker_prefix(name), os.getpid(), uuid.uuid4().hex[:8])
+
+
+def lease_path(config, job_path):
+    return os.path.join(config["spool"]["path"], "leases", os.path.basename(os.path.normpath(job_path)) + ".lease")
+
+
+def publish(config, job_path):
+    """
+    Move a copied job from temp_path into the spool (visible to the uploaders at once, complete)
+
+    Returns:
+        path of the job in the spool
+    """
+    incoming_path, jobs_path, _, _ = spool_dirs(config)
+    job_dir = os.path.basename(os.path.normpath(job_path))
+    # job names are only unique per temp_path, several analyzers may publish into one spool
+    name = job_dir
+    counter = 1
+    while os.path.exists(os.path.join(jobs_path, name)) or os.path.exists(os.path.join(incoming_path, name)):
+        name = "{}_{}".format(job_dir, counter)
+        counter += 1
+    fileops.move_tree(job_path, os.path.join(incoming_path, name))
+    if name != job_dir:
+        # before it is visible: the uploader records the job under its name in the spool
+        job_history.rename_job(config, job_dir, name)
+    os.rename(os.path.join(incoming_path, name), os.path.join(jobs_path, name))
+    logging.info("published job %s to spool as %s", job_path, name)
+    return os.path.join(jobs_path, name)
+
+
+class Lease:
+    """
+    Claim of one spool job by one uploader
+    """
+
+    def __init__(self, path, owner):
+        self.path = path
+        self.owner = owner
+
+    def holder(self):
+        """
+        Return the owner of the lease file, None if there is none
+        """
+        try:
+            with open(self.path) as fh:
+                return json.load(fh)["owner"]
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def renew(self):
+        """
+        Touch the lease, False if it is not ours anymore
+        """
+        if self.holder() != self.owner:
+            return False
+        os.utime(self.path)
+        return True
+
+    def release(self):
+        if self.holder() == self.owner:
+            os.remove(self.path)
+
+
+def _create_lease(path, owner):
+    try:
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o644)
+    except FileExistsError:
+        return None
+    with os.fdopen(fd, "w") as fh:
+        json.dump({"owner": owner, "claimed": time.time()}, fh)
+        fh.flush()
+        os.fsync(fh.fileno())
+    return Lease(path, owner)
+
+
+def _expired(path, lease_s):
+    try:
+        return time.time() - os.stat(path).st_mtime > lease_s
+    except FileNotFoundError:
+        return False
+
+
+def _steal(path, owner, lease_s):
+    """
+    Take over an expired lease, None if another uploader was faster or the lease was renewed
+    """
+    stolen = "{}.stolen.{}".format(path, uuid.uuid4().hex[:8])
+    try:
+        # only one uploader can rename the lease away
+        os.rename(path, stolen)
+    except FileNotFoundError:
+        return None
+    if not _expired(stolen, lease_s):
+        # renewed or replaced between the check and the rename: put it back if still free
+        try:
+            os.link(stolen, path)
+        except FileExistsError:
+            pass
+        os.remove(stolen)
+        return None
+    with open(stolen) as fh:
+        logging.warning("stealing expired lease of %s from %s", os.path.basename(path), fh.read())
+    os.remove(stolen)
+    return _create_lease(path, owner)
+
+
+def claim_next(config, owner):
+    """
+    Claim the oldest job without a valid lease
+
+    Returns:
+        (job path, Lease) or None if no job is available
+    """
+    _, jobs_path, _, _ = spool_dirs(config)
+    for entry in sorted(os.scandir(jobs_path), key=lambda entry: entry.name):
+        if not entry.is_dir():
+            continue
+        path = lease_path(config, entry.path)
+        lease = _create_lease(path, owner)
+        if lease is None and _expired(path, config["spool"]["lease_s"]):
+            lease = _steal(path, owner, config["spool"]["lease_s"])
+        # the job may have been finished by the previous holder in the meantime
+        if lease is not None and not os.path.isdir(entry.path):
+            lease.release()
+            lease = None
+        if lease is not None:
+            logging.info("claimed spool job %s (finished stages: %s)", entry.name,
+                         sorted(job_state.done_stages(entry.path)))
+            return entry.path, lease
+    return None
+
+
+def worker_lease(config, job_path, name):
+    """
+    Return the lease of a job held by a (crashed) worker of this host, None if it holds none
+    """
+    lease = Lease(lease_path(config, job_path), None)
+    holder = lease.holder()
+    if holder is None or not holder.startswith(worker_prefix(name)):
+        return None
+    lease.owner = holder
+    return lease
+
+
+def finish(config, job_path, lease):
+    """
+    Close a job after upload_routine(): a job left in the spool failed and is moved
+    to failed/, then the lease is released
+    """
+    _, _, _, failed_path = spool_dirs(config)
+    if os.path.isdir(job_path):
+        job_dir = os.path.basename(os.path.normpath(job_path))
+        logging.warning("spool job %s failed, moved to %s", job_dir, failed_path)
+        shutil.move(job_path, os.path.join(failed_path, job_dir))
+        if os.path.exists(job_state.state_file(job_path)):
+            shutil.move(job_state.state_file(job_path),
+                        job_state.state_file(os.path.join(failed_path, job_dir)))
+    lease.release()
+
+
+class Heartbeat(threading.Thread):
+    """
+    Renew a lease every heartbeat_s while the job runs, kill the own process if the lease
+    was lost (stolen after a stall): a job is never worked on by two uploaders at once
+    """
+
+    def __init__(self, config, lease):
+        super().__init__(daemon=True)
+        self.interval = config["spool"]["heartbeat_s"]
+        self.lease = lease
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            try:
+                renewed = self.lease.renew()
+            except OSError:
+                # spool temporarily unreachable, the lease expires if it stays unreachable
+                logging.exception("Error renewing lease %s", self.lease.path)
+                continue
+            if not renewed:
+                logging.error("lease %s lost, stopping this uploader", self.lease.path)
+                os.kill(os.getpid(), signal.SIGKILL)
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+"""
+Finished stages of a job, so a restarted job continues where it left off.
+One line per finished stage in <job_path>.state (next to the job folder, so it is
+neither uploaded nor archived), removed when the job is archived.
+
+A job handed to the uploader while its files are still copied (config stream) has a
+<job_path>.copying file with the pid of the analyzer, removed as soon as the folders of
+the job are copied.
+"""
+import logging
+import os
+
+
+def state_file(job_path):
+    return os.path.normpath(job_path) + ".state"
+
+
+def done_stages(job_path):
+    """
+    Return the set of finished stages of a job (empty for a new job)
+    """
+    try:
+        with open(state_file(job_path)) as fh:
+            return set(line.strip() for line in fh if line.strip())
+    except FileNotFoundError:
+        return set()
+
+
+def mark_done(job_path, stage):
+    """
+    Record a finished stage (appended and flushed immediately)
+    """
+    with open(state_file(job_path), "a") as fh:
+        fh.write(stage + "\n")
+        fh.flush()
+        os.fsync(fh.fileno())
+
+
+def copying_file(job_path):
+    return os.path.normpath(job_path) + ".copying"
+
+
+def mark_copying(job_path):
+    with open(copying_file(job_path), "w") as fh:
+        fh.write(str(os.getpid()))
+
+
+def copy_finished(job_path):
+    try:
+        os.remove(copying_file(job_path))
+    except FileNotFoundError:
+        pass
+
+
+def copy_state(job_path):
+    """
+    Return "done" (all files copied), "copying" or "aborted" (the analyzer died while copying)
+    """
+    try:
+        with open(copying_file(job_path)) as fh:
+            pid = int(fh.read().strip())
+    except FileNotFoundError:
+        return "done"
+    except ValueError:
+        # written in this moment
+        return "copying"
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return "aborted"
+    except PermissionError:
+        pass
+    return "copying"
+
+
+def clear(job_path):
+    try:
+        os.remove(state_file(job_path))
+    except FileNotFoundError:
+        pass
+    except OSError:
+        logging.exception("Error removing job state: %s", state_file(job_path))
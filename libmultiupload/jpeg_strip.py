@@ -0,0 +1,298 @@
+#!/usr/bin/env python3
+"""
+Lossless removal of metadata from JPEG files (config strip_metadata of a target):
+the marker segments before the image data are rewritten, the compressed image data
+is copied unchanged (no decoding, no re-encoding, no quality loss).
+
+Categories:
+    "gps":       GPS IFD of the EXIF data (position), the rest of EXIF is kept
+    "makernote": maker notes of the EXIF data (often serial numbers, lens, position)
+    "exif":      the whole EXIF segment (also orientation and date, images may show rotated)
+    "xmp":       XMP segments (may contain a position as well)
+    "iptc":      IPTC/Photoshop segment (APP13)
+    "comment":   JPEG comments
+GPS and maker notes are removed inside the EXIF segment: the entry is removed from its
+IFD and its data overwritten with zeros, offsets and the segment length stay valid.
+A segment which can not be parsed is removed completely. Other files are not changed.
+The originals keep their metadata: the stripped content goes into the archive
+(read_stripped) or into a copy of the folder (strip_tree), which is uploaded instead.
+A JPEG file whose marker segments are broken is never passed on with its metadata:
+it is left out of the archive and of the copy.
+"""
+import concurrent.futures
+import logging
+import os
+import shutil
+import struct
+
+from libmultiupload import fileops
+
+CATEGORIES = ("gps", "makernote", "exif", "xmp", "iptc", "comment")
+
+EXIF_HEADER = b"Exif\x00\x00"
+XMP_HEADERS = (b"http://ns.adobe.com/xap/1.0/\x00", b"http://ns.adobe.com/xmp/extension/\x00")
+IPTC_HEADER = b"Photoshop 3.0\x00"
+
+# TIFF tags
+TAG_EXIF_IFD = 0x8769
+TAG_GPS_IFD = 0x8825
+TAG_MAKERNOTE = 0x927C
+
+# bytes per value of the TIFF field types
+TYPE_SIZES = {1: 1, 2: 1, 3: 2, 4: 4, 5: 8, 6: 1, 7: 1, 8: 2, 9: 4, 10: 8, 11: 4, 12: 8}
+
+
+class _Tiff:
+    """
+    TIFF structure of an EXIF segment, edited in place (the size never changes)
+    """
+
+    def __init__(self, buf):
+        self.buf = buf
+        if buf[:2] == b"II":
+            self.endian = "<"
+        elif buf[:2] == b"MM":
+            self.endian = ">"
+        else:
+            raise ValueError("exif: invalid byte order")
+        if self.read("H", 2) != 42:
+            raise ValueError("exif: invalid tiff header")
+
+    def read(self, fmt, offset):
+        if offset < 0 or offset + struct.calcsize(fmt) > len(self.buf):
+            raise ValueError("exif: offset out of range")
+        return struct.unpack_from(self.endian + fmt, self.buf, offset)[0]
+
+    def find(self, ifd, tag):
+        """
+        Return the offset of the entry of tag in the IFD at offset ifd, None if missing
+        """
+        for index in range(self.read("H", ifd)):
+            entry = ifd + 2 + 12 * index
+            if self.read("H", entry) == tag:
+                return entry
+        return None
+
+    def clear_value(self, entry):
+        """
+        Overwrite the data of an entry stored outside the IFD (more than 4 bytes) with zeros
+        """
+        size = TYPE_SIZES.get(self.read("H", entry + 2), 1) * self.read("I", entry + 4)
+        if size > 4:
+            start = self.read("I", entry + 8)
+            if start + size > len(self.buf):
+                raise ValueError("exif: value out of range")
+            self.buf[start:start + size] = bytes(size)
+
+    def remove(self, ifd, entry):
+        """
+        Remove an entry from its IFD (the following entries and the next IFD offset move up)
+        """
+        count = self.read("H", ifd)
+        end = ifd + 2 + 12 * count + 4
+        if end > len(self.buf):
+            raise ValueError("exif: ifd out of range")
+        self.buf[entry:end] = bytes(self.buf[entry + 12:end]) + bytes(12)
+        struct.pack_into(self.endian + "H", self.buf, ifd, count - 1)
+
+    def remove_ifd(self, ifd, pointer_tag):
+        """
+        Remove a sub IFD (e.g. GPS) referenced by pointer_tag from the IFD at offset ifd
+        """
+        pointer = self.find(ifd, pointer_tag)
+        if pointer is None:
+            return False
+        sub_ifd = self.read("I", pointer + 8)
+        count = self.read("H", sub_ifd)
+        end = sub_ifd + 2 + 12 * count + 4
+        if end > len(self.buf):
+            raise ValueError("exif: ifd out of range")
+        for index in range(count):
+            self.clear_value(sub_ifd + 2 + 12 * index)
+        self.buf[sub_ifd:end] = bytes(end - sub_ifd)
+        self.remove(ifd, pointer)
+        return True
+
+    def remove_tag(self, ifd, tag):
+        entry = self.find(ifd, tag)
+        if entry is None:
+            return False
+        self.clear_value(entry)
+        self.remove(ifd, entry)
+        return True
+
+
+def _strip_exif(payload, categories):
+    """
+    Remove GPS and/or maker notes from an EXIF segment payload
+
+    Returns:
+        (new payload, list of removed categories)
+    """
+    tiff = _Tiff(bytearray(payload[len(EXIF_HEADER):]))
+    ifd0 = tiff.read("I", 4)
+    removed = []
+    if "gps" in categories and tiff.remove_ifd(ifd0, TAG_GPS_IFD):
+        removed.append("gps")
+    if "makernote" in categories:
+        exif_entry = tiff.find(ifd0, TAG_EXIF_IFD)
+        if exif_entry is not None and tiff.remove_tag(tiff.read("I", exif_entry + 8), TAG_MAKERNOTE):
+            removed.append("makernote")
+    return EXIF_HEADER + bytes(tiff.buf), removed
+
+
+def strip_bytes(data, categories):
+    """
+    Remove the metadata categories from a JPEG file
+
+    Args:
+        data: content of the file
+        categories: categories to remove (see CATEGORIES)
+
+    Returns:
+        (new content, list of removed categories), None if data is not a JPEG file
+    Raises:
+        ValueError if the marker segments are broken
+    """
+    if data[:2] != b"\xff\xd8":
+        return None
+    parts = [data[:2]]
+    removed = []
+    pos = 2
+    while True:
+        if pos + 4 > len(data) or data[pos] != 0xFF:
+            raise ValueError("jpeg: invalid marker at offset {}".format(pos))
+        marker = data[pos + 1]
+        if marker == 0xFF:
+            # fill byte
+            pos += 1
+            continue
+        if marker in (0xDA, 0xD9):
+            # start of scan/end of image: the rest is image data, copied unchanged
+            parts.append(data[pos:])
+            break
+        if marker == 0x01 or 0xD0 <= marker <= 0xD7:
+            parts.append(data[pos:pos + 2])
+            pos += 2
+            continue
+        length = struct.unpack_from(">H", data, pos + 2)[0]
+        end = pos + 2 + length
+        if length < 2 or end > len(data):
+            raise ValueError("jpeg: segment out of range at offset {}".format(pos))
+        payload = data[pos + 4:end]
+        drop = None
+        if marker == 0xE1 and payload.startswith(EXIF_HEADER):
+            if "exif" in categories:
+                drop = "exif"
+            elif "gps" in categories or "makernote" in categories:
+                try:
+                    payload, exif_removed = _strip_exif(payload, categories)
+                    removed += exif_removed
+                except (ValueError, struct.error) as exceptmsg:
+                    # never pass on metadata which should have been removed
+                    logging.warning("removing unreadable exif segment: %s", exceptmsg)
+                    drop = "exif"
+        elif marker == 0xE1 and payload.startswith(XMP_HEADERS) and "xmp" in categories:
+            drop = "xmp"
+        elif marker == 0xED and payload.startswith(IPTC_HEADER) and "iptc" in categories:
+            drop = "iptc"
+        elif marker == 0xFE and "comment" in categories:
+            drop = "comment"
+
+        if drop is None:
+            parts.append(data[pos:pos + 4])
+            parts.append(payload)
+        elif drop not in removed:
+            removed.append(drop)
+        pos = end
+    return b"".join(parts), removed
+
+
+def read_stripped(path, categories):
+    """
+    Return the content of a file without the metadata categories, None if it is no JPEG,
+    False if it is a broken JPEG (zip_volumes transform: left out of the archive)
+    """
+    with open(path, "rb") as fh:
+        data = fh.read()
+    try:
+        result = strip_bytes(data, categories)
+    except (ValueError, struct.error) as exceptmsg:
+        logging.error("metadata can not be removed, left out of the archive: %s: %s", path, exceptmsg)
+        return False
+    return None if result is None else result[0]
+
+
+def strip_file(path, dest, categories):
+    """
+    Write a copy of a file without the metadata categories to dest
+    (unchanged files are linked or copied, see fileops.copy_file)
+
+    Returns:
+        list of removed categories
+    Raises:
+        ValueError if it is a broken JPEG file (dest is not written)
+    """
+    with open(path, "rb") as fh:
+        result = strip_bytes(fh.read(), categories)
+    if not os.path.exists(os.path.dirname(dest)):
+        os.makedirs(os.path.dirname(dest), exist_ok=True)
+    if result is None or not result[1]:
+        # shares the inode with the original at most, neither is modified later
+        fileops.copy_file(path, dest, allow_hardlink=True)
+        return []
+    with open(dest, "wb") as fh:
+        fh.write(result[0])
+    return result[1]
+
+
+def strip_tree(path, dest_path, categories, workers, prog=None):
+    """
+    Copy all files below path to dest_path without the metadata categories (in parallel),
+    the originals are not changed
+
+    Args:
+        path: folder with the original files
+        dest_path: folder for the copies (replaced)
+        categories: categories to remove (see CATEGORIES)
+        workers: number of files processed at the same time
+        prog: progress.Progress object (optional)
+
+    Returns:
+        list of broken JPEG files (relative to path, not copied: never uploaded),
+        -1 in the event of an error
+    """
+    files = fileops.list_files(path)
+    if prog is not None:
+        prog.add_total(len(files), sum(os.path.getsize(os.path.join(path, name)) for name in files))
+
+    def strip(name):
+        """
+        Return the removed categories of a file, None if it is broken
+        """
+        try:
+            removed = strip_file(os.path.join(path, name), os.path.join(dest_path, name), categories)
+        except (ValueError, struct.error) as exceptmsg:
+            logging.error("metadata can not be removed, file not uploaded: %s: %s", os.path.join(path, name),
+                          exceptmsg)
+            removed = None
+        if prog is not None:
+            prog.update(1, os.path.getsize(os.path.join(path, name)))
+        return removed
+
+    try:
+        # left by an interrupted run (files may be links of the originals: never written into)
+        if os.path.exists(dest_path):
+            shutil.rmtree(dest_path)
+        with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(strip, files))
+    except Exception:
+        logging.exception("Fatal error in strip_tree()")
+        return -1
+
+    if prog is not None:
+        prog.finish()
+    broken = [name for name, removed in zip(files, results) if removed is None]
+    logging.info("metadata (%s) removed from %d of %d files in %s (%d broken)", ", ".join(categories),
+                 sum(bool(removed) for removed in results), len(files), dest_path, len(broken))
+    return broken
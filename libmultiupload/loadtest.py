@@ -0,0 +1,340 @@
+#!/usr/bin/env python3
+"""
+End-to-end load test of the daemon against stand-in servers (config "loadtest"):
+    1. start stand-in FTPS and SMTP servers with simulated network faults
+       (loadtest.faults, see standin_servers.NO_FAULTS)
+    2. start ffp_fotoupload.py --daemon with a copy of the config pointed at them: own
+       temp/archive/log/history below the work folder, targets with other backends
+       write into a local folder (as in replay)
+    3. create synthetic cards and submit them over the http interface like the webui
+       (POST upload=<path>, a full analyze queue (503) is retried)
+    4. wait until every card is processed (job history) and report throughput,
+       latency percentiles of cards and stages and the recovery from the faults
+Nothing is sent to the real servers, the report is written to <workdir>/report.json.
+"""
+import copy
+import json
+import logging
+import math
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+
+from libmultiupload import job_history, standin_servers
+
+TERMINAL_STATUS = ("done", "failed")
+
+
+def percentiles(values):
+    """
+    Return count, p50, p90, p99 and max of a list of durations (nearest rank)
+    """
+    ordered = sorted(values)
+    result = {"count": len(ordered)}
+    if not ordered:
+        return result
+    for pct in (50, 90, 99):
+        result["p{}".format(pct)] = round(ordered[max(math.ceil(pct / 100 * len(ordered)) - 1, 0)], 3)
+    result["max"] = round(ordered[-1], 3)
+    return result
+
+
+def free_port(host="127.0.0.1"):
+    with socket.socket() as sock:
+        sock.bind((host, 0))
+        return sock.getsockname()[1]
+
+
+def make_cards(cards_path, loadtest):
+    """
+    Create the synthetic cards: <cards_path>/card_<n>/DCIM/<folder>/IMG_<n>.jpg
+    (copies of loadtest.sample or random noise images of loadtest.image_px)
+
+    Returns:
+        list of card paths
+    """
+    cards = []
+    for card in range(loadtest["cards"]):
+        card_path = os.path.join(cards_path, "card_{:03d}".format(card))
+        for folder in range(loadtest["folders_per_card"]):
+            folder_path = os.path.join(card_path, "DCIM", "{}TEST".format(100 + folder))
+            os.makedirs(folder_path)
+            for image in range(loadtest["images_per_card"]):
+                path = os.path.join(folder_path, "IMG_{:04d}.jpg".format(image))
+                if loadtest["sample"]:
+                    shutil.copyfile(loadtest["sample"], path)
+                else:
+                    from PIL import Image
+
+                    # noise does not compress: realistic file sizes and thumbnail work
+                    Image.effect_noise(tuple(loadtest["image_px"]), 64).convert("RGB").save(path, quality=90)
+        cards.append(card_path)
+    logging.info("load test: %d cards with %d folders of %d images created in %s", len(cards),
+                 loadtest["folders_per_card"], loadtest["images_per_card"], cards_path)
+    return cards
+
+
+def daemon_config(config, workdir, ftp_server, smtp_server, http_port):
+    """
+    Return a copy of config for the daemon under test (nothing points at real servers)
+    """
+    test_config = copy.deepcopy(config)
+    test_config["temp_path"] = os.path.join(workdir, "temp")
+    test_config["archive_path"] = os.path.join(workdir, "archive")
+    test_config["delete_source"] = False
+    test_config["log"]["path"] = os.path.join(workdir, "log")
+    test_config["history"]["enable"] = True
+    test_config["history"]["path"] = os.path.join(workdir, "history.sqlite")
+    test_config["profile"]["path"] = os.path.join(workdir, "profile")
+    test_config["spool"]["path"] = os.path.join(workdir, "spool")
+    test_config["watch"]["enable"] = False
+    test_config["http_server"]["host"] = "127.0.0.1"
+    test_config["http_server"]["port"] = http_port
+
+    for target, target_config in test_config.items():
+        if not isinstance(target_config, dict) or "backend" not in target_config:
+            continue
+        target_config["enable"] = True
+        if target_config["backend"] != "ftps":
+            target_config["backend"] = "local"
+            target_config["target_dir"] = os.path.join(workdir, target)
+            os.makedirs(target_config["target_dir"], exist_ok=True)
+            continue
+        target_config["ftp"], target_config["port"] = ftp_server.server_address
+        os.makedirs(os.path.join(ftp_server.root, target_config["target_dir"].lstrip("/")), exist_ok=True)
+
+    test_config["smtp"]["host"], test_config["smtp"]["port"] = smtp_server.server_address
+    for section in ("email", "err_email"):
+        test_config[section]["enable"] = True
+        test_config[section]["sender"] = "loadtest@localhost"
+        test_config[section]["recipient"] = ["loadtest@localhost"]
+    test_config["email"]["recipient_cc"] = []
+    test_config["email"]["recipient_bcc"] = []
+    return test_config
+
+
+def wait_for_port(host, port, process, timeout_s):
+    """
+    Wait until the daemon accepts connections, False if it exited or timed out
+    """
+    deadline = time.time() + timeout_s
+    while time.time() < deadline:
+        if process.poll() is not None:
+            return False
+        try:
+            with socket.create_connection((host, port), 1):
+                return True
+        except OSError:
+            time.sleep(0.2)
+    return False
+
+
+def submit_card(url, card_path, timeout_s):
+    """
+    Queue a card like the webui, retried while the analyze queue is full
+
+    Returns:
+        number of rejections (503) before the card was accepted, -1 if it was never accepted
+    """
+    data = urllib.parse.urlencode({"upload": card_path}).encode()
+    rejected = 0
+    deadline = time.time() + timeout_s
+    while time.time() < deadline:
+        try:
+            with urllib.request.urlopen(url, data, timeout=60):
+                return rejected
+        except urllib.error.HTTPError as exceptmsg:
+            if exceptmsg.code != 503:
+                logging.error("load test: submitting %s failed: %s", card_path, exceptmsg)
+                return -1
+            rejected += 1
+            time.sleep(1)
+    logging.error("load test: %s not accepted within %ss", card_path, timeout_s)
+    return -1
+
+
+def card_jobs(config, cards):
+    """
+    Return card path -> list of its jobs in the history (with stages and targets)
+    """
+    jobs = []
+    page = 1
+    while True:
+        result = job_history.list_jobs(config, page, 500)
+        jobs += result["jobs"]
+        if page * result["per_page"] >= result["total"]:
+            break
+        page += 1
+    by_card = {card: [] for card in cards}
+    for job in jobs:
+        for card in cards:
+            if job["source"] and (job["source"] + os.sep).startswith(card + os.sep):
+                by_card[card].append(job)
+    return by_card
+
+
+def wait_for_cards(config, cards, jobs_per_card, process, timeout_s):
+    """
+    Wait until every card has all its jobs finished (done or failed)
+
+    Returns:
+        card path -> list of jobs (complete with stages and targets)
+    """
+    deadline = time.time() + timeout_s
+    while True:
+        by_card = card_jobs(config, cards)
+        pending = [card for card, jobs in by_card.items()
+                   if len(jobs) < jobs_per_card or any(job["status"] not in TERMINAL_STATUS for job in jobs)]
+        if not pending:
+            break
+        if time.time() > deadline or process.poll() is not None:
+            logging.error("load test: %d cards not finished (%s)", len(pending),
+                          "timeout" if process.poll() is None else "daemon exited")
+            break
+        time.sleep(1)
+    return {card: [job_history.get_job(config, job["job"]) for job in jobs] for card, jobs in by_card.items()}
+
+
+def count_log_lines(log_path, texts):
+    """
+    Return text -> number of log lines containing it (all logfiles of log_path)
+    """
+    counts = dict.fromkeys(texts, 0)
+    for name in os.listdir(log_path):
+        with open(os.path.join(log_path, name), errors="replace") as fh:
+            for line in fh:
+                for text in texts:
+                    counts[text] += text in line
+    return counts
+
+
+def make_report(test_config, results, submitted, rejected, wall_s, ftp_server, smtp_server):
+    jobs = [job for card_results in results.values() for job in card_results]
+    finished_cards = [card for card, card_results in results.items()
+                      if card_results and all(job["status"] == "done" for job in card_results)]
+    stages = {}
+    for job in jobs:
+        for stage in job["stages"]:
+            stages.setdefault(stage["stage"], []).append(stage["duration"])
+    failed_uploads = [job for job in jobs if any(not target["ok"] for target in job["targets"])]
+    total_bytes = sum(job["bytes"] or 0 for job in jobs)
+    logs = count_log_lines(test_config["log"]["path"], ("supervisor: worker", "supervisor: requeue",
+                                                        "supervisor: giving up"))
+    return {
+        "cards": len(results),
+        "cards_done": len(finished_cards),
+        "jobs": len(jobs),
+        "jobs_failed": sum(job["status"] == "failed" for job in jobs),
+        "wall_s": round(wall_s, 1),
+        "cards_per_min": round(len(finished_cards) / wall_s * 60, 2),
+        "mb_per_s": round(total_bytes / wall_s / 1e6, 2),
+        # submission of a card until its last job finished
+        "card_latency_s": percentiles([max(job["finished"] for job in card_results) - submitted[card]
+                                       for card, card_results in results.items()
+                                       if card in finished_cards]),
+        "queue_wait_s": percentiles([job["queue_wait"] for job in jobs if job["queue_wait"] is not None]),
+        "stages_s": {stage: percentiles(durations) for stage, durations in sorted(stages.items())},
+        "recovery": {
+            "submit_rejected": rejected,
+            "upload_errors": sum(not target["ok"] for job in jobs for target in job["targets"]),
+            "jobs_with_upload_errors": len(failed_uploads),
+            "jobs_recovered": sum(job["status"] == "done" for job in failed_uploads),
+            "worker_restarts": logs["supervisor: worker"],
+            "requeued": logs["supervisor: requeue"],
+            "abandoned": logs["supervisor: giving up"],
+        },
+        "faults": ftp_server.faults,
+        "ftp": dict(ftp_server.stats, files_stored=len(ftp_server.stored)),
+        "smtp": dict(smtp_server.stats, mails=len(smtp_server.messages)),
+    }
+
+
+def run_loadtest(config, config_path, workdir=None):
+    """
+    Run the load test (see module docstring)
+
+    Args:
+        config: parsed json config file (not modified)
+        config_path: path of the config file (the daemon is started next to it)
+        workdir: scratch folder (default: new temporary folder, kept for inspection)
+
+    Returns:
+        report dict, None if loadtest.faults is invalid or the daemon could not be started
+    """
+    loadtest = config["loadtest"]
+    unknown = sorted(set(loadtest["faults"]) - set(standin_servers.NO_FAULTS))
+    if unknown:
+        logging.error("load test: unknown loadtest.faults: %s", ", ".join(unknown))
+        return None
+    if workdir is None:
+        workdir = tempfile.mkdtemp(prefix="ffp_loadtest_")
+    logging.info("load test in %s", workdir)
+
+    cards = make_cards(os.path.join(workdir, "cards"), loadtest)
+
+    certfile, keyfile = standin_servers.make_selfsigned_cert(os.path.join(workdir, "tls"))
+    ftp_server = standin_servers.StandinFTPServer(os.path.join(workdir, "ftp"), certfile=certfile,
+                                                  keyfile=keyfile, faults=loadtest["faults"])
+    smtp_server = standin_servers.StandinSMTPServer(os.path.join(workdir, "mail"), faults=loadtest["faults"])
+    ftp_server.start()
+    smtp_server.start()
+
+    http_port = free_port()
+    test_config = daemon_config(config, workdir, ftp_server, smtp_server, http_port)
+    test_config_path = os.path.join(workdir, "config.json")
+    with open(test_config_path, "w") as fh:
+        json.dump(test_config, fh, indent=4)
+
+    # started next to the config file: templates and audio files are found as usual
+    script = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "ffp_fotoupload.py")
+    process = subprocess.Popen([sys.executable, script, "--daemon", "--config", test_config_path],
+                               cwd=os.path.dirname(os.path.abspath(config_path)))
+    try:
+        if not wait_for_port("127.0.0.1", http_port, process, 60):
+            logging.error("load test: daemon did not start (exit code %s)", process.poll())
+            return None
+
+        url = "http://127.0.0.1:{}/".format(http_port)
+        jobs_per_card = 1 if config["ingest"]["merge_folders"] else loadtest["folders_per_card"]
+        submitted = {}
+        rejected = 0
+        start = time.time()
+        for card in cards:
+            submitted[card] = time.time()
+            ret = submit_card(url, card, loadtest["timeout_s"])
+            if ret == -1:
+                del submitted[card]
+                continue
+            rejected += ret
+            time.sleep(loadtest["submit_interval_s"])
+
+        results = wait_for_cards(test_config, list(submitted), jobs_per_card, process, loadtest["timeout_s"])
+        wall_s = max(time.time() - start, 0.001)
+    finally:
+        # the daemon kills its workers on SIGTERM, wait until they are gone
+        process.terminate()
+        try:
+            process.wait(60)
+        except subprocess.TimeoutExpired:
+            logging.error("load test: daemon did not stop, killed (its workers may be left running)")
+            process.kill()
+            process.wait()
+        ftp_server.stop()
+        smtp_server.stop()
+
+    report = make_report(test_config, results, submitted, rejected, wall_s, ftp_server, smtp_server)
+    report["cards"] = len(cards)
+    with open(os.path.join(workdir, "report.json"), "w") as fh:
+        json.dump(report, fh, indent=1)
+    logging.info("load test: %d of %d cards done in %ss, %s cards/min, %s MB/s, card latency %s, "
+                 "recovery %s, report: %s", report["cards_done"], report["cards"], report["wall_s"],
+                 report["cards_per_min"], report["mb_per_s"], report["card_latency_s"], report["recovery"],
+                 os.path.join(workdir, "report.json"))
+    return report
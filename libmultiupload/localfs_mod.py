@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+"""
+Local filesystem upload backend (local disk or mounted NFS/SMB share)
+Copies the files (of matching type if enabled) of a folder into target_dir/<job>,
+reflinked where possible (see fileops), without encryption overhead.
+"""
+import logging
+import os
+
+from libmultiupload import fileops, transfer
+
+
+def upload(target_config, localpath, filetype, remotefoldername, enable_recursive, prog=None):
+    """
+    Transfer backend "local" (see transfer.py)
+
+    Args:
+        target_config: target section of the config (uses target_dir, must exist)
+        localpath: path which holds elements to upload
+        filetype: tuple of lowercase file endings to upload (leave empty to disable)
+        remotefoldername: job folder name
+        enable_recursive: enable or disable recursive upload
+        prog: progress.Progress object of this upload (optional)
+
+    Returns:
+        (0, "success") or (-1, error message)
+    """
+    logging.debug("Entered localfs upload(): %s", localpath)
+    try:
+        # target_dir must already exist (e.g. mounted share), same as for ftps
+        if not os.path.isdir(target_config["target_dir"]):
+            return -1, "error in localfs upload():\ntarget_dir does not exist: " + target_config["target_dir"]
+
+        def copy_dir(path, dest):
+            if not os.path.exists(dest):
+                os.makedirs(dest)
+            for entry in os.scandir(path):
+                if entry.is_file():
+                    if transfer.matches(entry.name, filetype):
+                        fileops.copy_file(entry.path, os.path.join(dest, entry.name))
+                        logging.info("copied: %s", entry.name)
+                        if prog is not None:
+                            prog.update(1, entry.stat().st_size)
+                elif entry.is_dir() and enable_recursive:
+                    copy_dir(entry.path, os.path.join(dest, entry.name))
+
+        if prog is not None:
+            prog.add_total(*fileops.tree_size(localpath, filetype, enable_recursive))
+        copy_dir(localpath, os.path.join(target_config["target_dir"], remotefoldername))
+        if prog is not None:
+            prog.finish()
+        return 0, "success"
+
+    except Exception as exceptmsg:
+        return -1, "error in localfs upload():\n" + str(exceptmsg)
+
+
+class Session:
+    """
+    Transfer backend "local" session (see transfer.Session): copies single files into the job folder
+    """
+
+    def __init__(self, target_config, remotefoldername):
+        if not os.path.isdir(target_config["target_dir"]):
+            raise IOError("target_dir does not exist: " + target_config["target_dir"])
+        self.dest_path = os.path.join(target_config["target_dir"], remotefoldername)
+
+    def put(self, local_path, rel_path, prog=None):
+        """
+        Copy one file to <job folder>/<rel_path> (folders are created)
+        """
+        dest = os.path.join(self.dest_path, rel_path)
+        os.makedirs(os.path.dirname(dest), exist_ok=True)
+        fileops.copy_file(local_path, dest)
+        logging.info("copied: %s", rel_path)
+        if prog is not None:
+            prog.update(0, os.path.getsize(local_path))
+
+    def close(self):
+        pass
@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+"""
+Process safe logging: all processes put their log records into one queue,
+a listener thread in the main process writes them into a size rotated logfile.
+"""
+import logging
+import logging.handlers
+import multiprocessing
+import os
+
+LOG_FORMAT = '%(asctime)s %(processName)s %(levelname)s: %(message)s'
+
+
+def get_level(config):
+    """
+    Return the numeric log level from config["log"]["level"] (e.g. "DEBUG")
+    """
+    level = logging.getLevelName(str(config["log"]["level"]).upper())
+    if not isinstance(level, int):
+        return logging.DEBUG
+    return level
+
+
+def setup_worker(log_queue, level):
+    """
+    Route all log records of the current process into the log queue.
+    Call once at the start of every process (including the main process).
+
+    Args:
+        log_queue: queue returned by start_listener()
+        level: numeric log level
+    """
+    root = logging.getLogger()
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+    root.addHandler(logging.handlers.QueueHandler(log_queue))
+    root.setLevel(level)
+
+
+def start_listener(config, logfile):
+    """
+    Start the listener thread which writes the records of all processes to the logfile
+
+    Args:
+        config: parsed json config file
+        logfile: path of the logfile
+
+    Returns:
+        (log_queue, listener), call listener.stop() before exiting to flush the queue
+    """
+    if os.path.dirname(logfile) and not os.path.exists(os.path.dirname(logfile)):
+        os.makedirs(os.path.dirname(logfile))
+
+    file_handler = logging.handlers.RotatingFileHandler(logfile,
+                                                        maxBytes=config["log"]["max_bytes"],
+                                                        backupCount=config["log"]["backup_count"])
+    file_handler.setFormatter(logging.Formatter(LOG_FORMAT))
+
+    log_queue = multiprocessing.Queue()
+    listener = logging.handlers.QueueListener(log_queue, file_handler)
+    listener.start()
+
+    setup_worker(log_queue, get_level(config))
+    logging.captureWarnings(True)
+    return log_queue, listener
@@ -4,18 +4,26 @@ Copy files of specific type, delete if successfull if enabled
 """
 import logging
 import os
-import shutil
+import time
 
+from libmultiupload import fileops
 
-def move_files(sourcepath, destpath, filetype, del_src):
+# files are copied to <name>.part first if they are handed over one by one (on_file)
+PARTIAL_SUFFIX = ".part"
+
+
+def move_files(sourcepath, destpath, filetype, del_src, prog=None, on_file=None):
     """
     Copy files of matching type from sourcepath to destpath, delete files from source
 
     Args:
         sourcepath: original path to the sd card, where files will be deleted
         destpath: local path where the copied files reside
-        filetype: target file types/endings
-        del_src: delete files from source after copying (uses move())
+        filetype: target file endings (tuple of lowercase endings, config "type")
+        del_src: delete files from source after copying (rename if on the same filesystem)
+        prog: progress.Progress object of the copy stage (optional)
+        on_file: called with the path of every copied file (optional), every file is copied
+                 to <name>.part, checked against the source size and renamed before
 
     Returns:
         number of files which were copied if successfull
@@ -23,7 +31,7 @@ def move_files(sourcepath, destpath, filetype, del_src):
     """
 
     logging.debug("Entered move_files()")
-    logging.debug("parameter: " + str(sourcepath) + " " + str(destpath) + " " + str(filetype) + " ")
+    logging.debug("parameter: %s %s %s", sourcepath, destpath, filetype)
 
     try:
         if not os.path.exists(sourcepath):
@@ -31,35 +39,63 @@ def move_files(sourcepath, destpath, filetype, del_src):
             return -1
         else:
             src_lst = os.listdir(sourcepath)
-            logging.debug("Source dir contains: " + str(src_lst))
+            logging.debug("Source dir contains: %s", src_lst)
 
-            copied_files = []
+            # check also against lowercase version
+            to_copy = []
             for file_to_copy in src_lst:
-                logging.debug("analyzing: " + file_to_copy)
-                # check also against lowercase version
-                if os.path.isfile(os.path.join(sourcepath, file_to_copy)) and file_to_copy.lower().endswith(tuple(filetype)):
-                    logging.debug("is file of matching type: " + file_to_copy)
-                    # makedirs (jobfolder and image/video folder) if at least
-                    # one file of matching type exists
-                    if not os.path.exists(destpath):
-                        os.makedirs(destpath)
-                        logging.debug("makedirs destpath: %s", destpath)
-
-                    shutil.copy2(os.path.join(sourcepath, file_to_copy), destpath)
-                    copied_files.append(os.path.join(sourcepath, file_to_copy))
-                    logging.debug("copied: %s -> %s", os.path.join(sourcepath, file_to_copy), destpath)
+                if os.path.isfile(os.path.join(sourcepath, file_to_copy)) and file_to_copy.lower().endswith(filetype):
+                    logging.debug("is file of matching type: %s", file_to_copy)
+                    to_copy.append((file_to_copy, os.path.getsize(os.path.join(sourcepath, file_to_copy))))
                 else:
-                    logging.debug("file does not match: " + str(os.path.join(sourcepath, file_to_copy)))
+                    logging.debug("file does not match: %s", os.path.join(sourcepath, file_to_copy))
+
+            if prog is not None:
+                prog.add_total(len(to_copy), sum(size for _, size in to_copy))
+
+            # makedirs (jobfolder and image/video folder) if at least
+            # one file of matching type exists
+            if to_copy and not os.path.exists(destpath):
+                os.makedirs(destpath)
+                logging.debug("makedirs destpath: %s", destpath)
+
+            copied_files = []
+            moved_count = 0
+            strategies = {}
+            start = time.monotonic()
+            for file_to_copy, size in to_copy:
+                src_file = os.path.join(sourcepath, file_to_copy)
+                dest_file = os.path.join(destpath, file_to_copy)
+                # a file handed over at once must never be seen incomplete
+                copy_dest = dest_file + PARTIAL_SUFFIX if on_file is not None else dest_file
+                # moving within one filesystem is a rename, nothing left to delete
+                if del_src and fileops.same_filesystem(src_file, destpath):
+                    strategy = fileops.move_file(src_file, copy_dest)
+                    moved_count += 1
+                else:
+                    strategy = fileops.copy_file(src_file, copy_dest)
+                    copied_files.append(src_file)
+                strategies[strategy] = strategies.get(strategy, 0) + 1
+                logging.debug("%s: %s -> %s", strategy, src_file, destpath)
+
+                if on_file is not None:
+                    if os.path.getsize(copy_dest) != size:
+                        raise OSError("size of copy differs from source: {}".format(src_file))
+                    os.rename(copy_dest, dest_file)
+                    on_file(dest_file)
+
+                if prog is not None:
+                    prog.update(1, size)
 
             # delete files from source if no exception occoured while copying
             if del_src:
                 for file_to_del in copied_files:
                     os.remove(file_to_del)
 
+            logging.info("move_files %s -> %s: %s in %.3fs", sourcepath, destpath,
+                         strategies, time.monotonic() - start)
+
     except Exception as exceptmsg:
-        logging.exception("Fatal Error in move_files(): " + str(exceptmsg))
+        logging.exception("Fatal Error in move_files(): %s", exceptmsg)
         return -1
-    if len(copied_files) > 0:
-        return len(copied_files)
-    else:
-        return 0
+    return len(copied_files) + moved_count
@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+"""
+Per stage timing and optional profiling.
+Every stage is timed, logged, recorded in the job history and reported to the
+supervisor (daemon mode, deadline per stage). If profiling is enabled (config["profile"]["enable"]
+or --profile) cProfile data of the stage is written to config["profile"]["path"],
+one file per job and stage (<job>_<stage>.prof, open with pstats or snakeviz).
+cProfile only measures the thread which entered the stage: work of thread pools
+(zip volumes, video proxies, metadata stripping) shows up as waiting in the calling
+thread, the stage duration includes it.
+"""
+import contextlib
+import cProfile
+import logging
+import os
+import time
+
+from libmultiupload import job_history, supervisor
+
+_profiling = False  # a stage of this process is being profiled
+
+
+@contextlib.contextmanager
+def stage(config, job, name):
+    """
+    Context manager around one stage of a job
+
+    Args:
+        config: parsed json config file
+        job: job name (folder name)
+        name: name of the stage (e.g. "thumbnail", "zip", "ftps_remote")
+    """
+    global _profiling
+    supervisor.stage_enter(config, job, name)
+    profiler = None
+    # nested stages (e.g. uploads during "zip") are only timed, their calls are
+    # part of the profile of the outer stage if they run in the same thread
+    if config["profile"]["enable"] and not _profiling:
+        profiler = cProfile.Profile()
+        profiler.enable()
+        _profiling = True
+
+    start = time.monotonic()
+    try:
+        yield
+    finally:
+        duration = time.monotonic() - start
+        supervisor.stage_exit(job, name)
+        job_history.record_stage(config, job, name, duration)
+        if profiler is not None:
+            profiler.disable()
+            _profiling = False
+            try:
+                if not os.path.exists(config["profile"]["path"]):
+                    os.makedirs(config["profile"]["path"])
+                prof_file = os.path.join(config["profile"]["path"], "{}_{}.prof".format(job, name))
+                profiler.dump_stats(prof_file)
+                logging.info("stage %s of %s took %.3fs, profile: %s", name, job, duration, prof_file)
+            except OSError:
+                logging.exception("Error writing profile of stage %s", name)
+        else:
+            logging.info("stage %s of %s took %.3fs", name, job, duration)
@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+"""
+Throttled progress reporting for the webui.
+Every stage (copy, thumbnail, zip, ftps) counts files and bytes and puts a progress
+event (dict) into the status queue, at most once per interval (and once when finished).
+"""
+import threading
+import time
+
+
+class Progress:
+    """
+    Progress of one stage of a job
+
+    Args:
+        status_queue: queue to the webui (None disables reporting)
+        job: job name (folder name)
+        stage: name of the stage ("copy", "thumbnail", "zip", "ftps:<target>")
+        files_total: number of files to process (if known)
+        bytes_total: number of bytes to process (if known)
+        interval: minimum time in seconds between two events
+    """
+
+    def __init__(self, status_queue, job, stage, files_total=0, bytes_total=0, interval=1.0):
+        self.status_queue = status_queue
+        self.job = job
+        self.stage = stage
+        self.files_total = files_total
+        self.bytes_total = bytes_total
+        self.files_done = 0
+        self.bytes_done = 0
+        self.interval = interval
+        self.start = time.monotonic()
+        self.last_emit = 0.0
+        self.lock = threading.Lock()  # stages with worker threads (transcode) share one object
+
+    def add_total(self, files=0, nbytes=0):
+        """
+        Increase the expected amount of work (e.g. after listing a folder)
+        """
+        self.files_total += files
+        self.bytes_total += nbytes
+
+    def update(self, files=0, nbytes=0):
+        """
+        Count finished work, emit an event if the interval has passed
+        """
+        with self.lock:
+            self.files_done += files
+            self.bytes_done += nbytes
+            if time.monotonic() - self.last_emit >= self.interval:
+                self._emit(False)
+
+    def finish(self):
+        """
+        Emit the final event of this stage (not throttled)
+        """
+        self._emit(True)
+
+    def event(self, done=False):
+        """
+        Return the current state as dict (rate in bytes/s, eta in s or None)
+        """
+        elapsed = time.monotonic() - self.start
+        rate = self.bytes_done / elapsed if elapsed > 0 else 0.0
+        eta = None
+        if done:
+            eta = 0.0
+        elif rate > 0 and self.bytes_total > self.bytes_done:
+            eta = (self.bytes_total - self.bytes_done) / rate
+        elif self.files_done > 0 and self.files_total > self.files_done:
+            eta = elapsed / self.files_done * (self.files_total - self.files_done)
+
+        return {"type": "progress",
+                "job": self.job,
+                "stage": self.stage,
+                "files_done": self.files_done,
+                "files_total": self.files_total,
+                "bytes_done": self.bytes_done,
+                "bytes_total": self.bytes_total,
+                "rate": rate,
+                "eta": eta,
+                "done": done}
+
+    def _emit(self, done):
+        self.last_emit = time.monotonic()
+        if self.status_queue is not None:
+            self.status_queue.put(self.event(done))
+
+
+def from_config(status_queue, job, stage, config, files_total=0, bytes_total=0):
+    """
+    Create a Progress object with the interval from the config file
+    """
+    return Progress(status_queue, job, stage, files_total, bytes_total,
+                    config["progress"]["interval_s"])
@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+"""
+Replay an archived job offline:
+    1. copy the original media (image/video) of the job into a scratch folder
+    2. start stand-in FTPS and SMTP servers on localhost
+    3. run upload_routine() with all enabled ftps targets pointed at the stand-ins
+       (targets with other backends write into a local folder instead)
+Nothing is sent to the real servers, combine with --profile to find slow stages.
+"""
+import copy
+import logging
+import os
+import shutil
+import tempfile
+
+from libmultiupload import standin_servers, upload_routine
+
+
+def replay_job(archived_job, config, workdir=None):
+    """
+    Re-run an archived (or failed, still in temp_path) job against stand-in servers
+
+    Args:
+        archived_job: path to the job folder (must contain image/ and/or video/)
+        config: parsed json config file (not modified)
+        workdir: scratch folder (default: new temporary folder, kept for inspection)
+
+    Returns:
+        return value of upload_routine(), -1 if the job folder is invalid
+    """
+    job_dir = os.path.basename(os.path.normpath(archived_job))
+    if not os.path.isdir(os.path.join(archived_job, "image")):
+        logging.error("replay: no image folder in %s", archived_job)
+        return -1
+
+    if workdir is None:
+        workdir = tempfile.mkdtemp(prefix="ffp_replay_")
+    logging.info("replay of %s in %s", archived_job, workdir)
+
+    replay_config = copy.deepcopy(config)
+    replay_config["temp_path"] = os.path.join(workdir, "temp")
+    replay_config["archive_path"] = os.path.join(workdir, "archive")
+    replay_config["history"]["path"] = os.path.join(workdir, "history.sqlite")
+
+    # only the original media, everything else is recreated by upload_routine()
+    job_path = os.path.join(replay_config["temp_path"], job_dir)
+    for media in ("image", "video"):
+        if os.path.isdir(os.path.join(archived_job, media)):
+            shutil.copytree(os.path.join(archived_job, media), os.path.join(job_path, media))
+
+    certfile, keyfile = standin_servers.make_selfsigned_cert(os.path.join(workdir, "tls"))
+    ftp_server = standin_servers.StandinFTPServer(os.path.join(workdir, "ftp"),
+                                                  certfile=certfile, keyfile=keyfile)
+    smtp_server = standin_servers.StandinSMTPServer(os.path.join(workdir, "mail"))
+    ftp_host, ftp_port = ftp_server.start()
+    smtp_host, smtp_port = smtp_server.start()
+
+    for target, target_config in replay_config.targets.items():
+        if target_config["backend"] != "ftps":
+            # no stand-in for sftp/http, never touch the real target: write to a local folder
+            logging.info("replay: %s (%s) replaced by local folder", target, target_config["backend"])
+            target_config["backend"] = "local"
+            target_config["target_dir"] = os.path.join(workdir, target)
+            os.makedirs(target_config["target_dir"], exist_ok=True)
+            continue
+        target_config["ftp"] = ftp_host
+        target_config["port"] = ftp_port
+        # the remote base dir has to exist on the server
+        os.makedirs(os.path.join(ftp_server.root, target_config["target_dir"].lstrip("/")),
+                    exist_ok=True)
+    replay_config["smtp"]["host"] = smtp_host
+    replay_config["smtp"]["port"] = smtp_port
+
+    try:
+        ret = upload_routine.upload_routine(job_path, replay_config)
+    finally:
+        ftp_server.stop()
+        smtp_server.stop()
+
+    logging.info("replay of %s returned %s, %d files stored, %d mails sent, results in %s",
+                 job_dir, ret, len(ftp_server.stored), len(smtp_server.messages), workdir)
+    return ret
@@ -0,0 +1,283 @@
+#!/usr/bin/env python3
+"""
+Config file loading: the json config is validated once and compiled into a Config object
+    - Config is a dict (config["section"]["key"] as before) with precompiled parts:
+      every "type" list is a tuple of lowercase extensions (ready for str.endswith),
+      config.targets holds the upload targets (sections with a "backend") by name
+    - refresh() reloads the file if it changed or SIGHUP was received, workers call it
+      before every job: the next job runs with the new settings, running jobs and the
+      worker pools are not touched. An invalid file is logged and the old config kept.
+"""
+import json
+import logging
+import os
+import signal
+
+from libmultiupload import jpeg_strip, transfer
+
+NUMBER = (int, float)
+
+TARGET = {"enable": bool, "backend": str, "target_dir": str, "timeout_s": NUMBER, "strip_metadata": list}
+
+# additional keys of a target per backend (see transfer.BACKENDS)
+BACKEND_KEYS = {
+    "ftps": {"ftp": str, "port": int, "username": str, "password": str, "verify": str, "blocksize": int,
+             "sndbuf": int},
+    "sftp": {"ftp": str, "port": int, "username": str, "password": str},
+    "http": {"url": str, "username": str, "password": str, "mkcol": bool, "blocksize": int},
+    "local": {},
+}
+
+FTPS_VERIFY = ("none", "size", "hash")
+
+# keys of a thumbnail profile per format (img_thumbnail.FORMAT_EXTENSIONS, "": format of the source)
+PROFILE_KEYS = {
+    "": {},
+    "JPEG": {"quality": int, "max_bytes": int, "progressive": bool, "optimize": bool, "min_quality": int,
+             "search_steps": int},
+    "WEBP": {"quality": int, "max_bytes": int, "method": int, "min_quality": int, "search_steps": int},
+    "PNG": {"quality": int, "max_bytes": int, "optimize": bool},
+}
+
+# expected type of every key (nested dicts: sections), more keys are allowed
+SCHEMA = {
+    "default_source_path": str,
+    "temp_path": str,
+    "archive_path": str,
+    "timestamp": str,
+    "delete_source": bool,
+    "log": {"path": str, "level": str, "max_bytes": int, "backup_count": int},
+    "image": {"enable": bool, "type": list},
+    "image_thumbnail": {"enable": bool, "size_px": list, "profile": str, "profiles": dict},
+    "image_groups": {"enable": bool, "max_distance": int},
+    "video": {"enable": bool, "type": list},
+    "video_thumbnail": {"enable": bool, "ffmpeg": str, "ffprobe": str, "ffmpeg_args": list,
+                        "extension": str, "workers": int, "timeout_s": NUMBER},
+    "zip": {"volume_mb": NUMBER, "workers": int},
+    "metadata_strip": {"workers": int},
+    "email": {"enable": bool, "sender": str, "recipient": list, "recipient_cc": list,
+              "recipient_bcc": list, "header_html": str, "footer_html": str, "header_alt": str,
+              "footer_alt": str, "weblink": str, "media_columns": int},
+    "err_email": {"enable": bool, "sender": str, "recipient": list},
+    "smtp": {"host": str, "port": int, "timeout_s": NUMBER},
+    "remote_ftp": TARGET,
+    "local_ftp": dict(TARGET, type=list),
+    "audio": {"path": str, "wait": str, "started": str, "finished": str, "error": str},
+    "multiprocess": {"process_count": int},
+    "queue": {"analyze_max": int, "jobs_in_temp_max": int, "submit_timeout_s": NUMBER},
+    "supervisor": {"check_interval_s": NUMBER, "max_attempts": int, "stage_deadline_s": dict},
+    "ingest": {"merge_folders": bool},
+    "stream": {"enable": bool, "poll_s": NUMBER},
+    "spool": {"enable": bool, "path": str, "workers": int, "lease_s": NUMBER, "heartbeat_s": NUMBER,
+              "poll_s": NUMBER},
+    "history": {"enable": bool, "path": str},
+    "profile": {"enable": bool, "path": str},
+    "watch": {"enable": bool, "staging_path": str, "settle_s": NUMBER, "batch_quiet_s": NUMBER},
+    "devices": {"enable": bool, "match": list, "removable_only": bool, "node_wait_s": NUMBER},
+    "progress": {"interval_s": NUMBER},
+    "http_server": {"host": str, "port": int},
+    "loadtest": {"cards": int, "folders_per_card": int, "images_per_card": int, "image_px": list,
+                 "sample": str, "submit_interval_s": NUMBER, "timeout_s": NUMBER, "faults": dict},
+}
+
+# sections only read at startup, a change needs a restart of the daemon
+RESTART_SECTIONS = ("log", "queue", "multiprocess", "http_server", "watch", "devices", "spool")
+
+_reload_requested = False
+
+
+class ConfigError(ValueError):
+    """
+    Invalid config file (message lists all problems)
+    """
+
+
+class Config(dict):
+    """
+    Validated config (see module docstring)
+
+    Attributes:
+        path: path of the config file
+        mtime: modification time of the loaded file
+        overrides: {(section, key): value} applied after every load (command line options)
+        targets: upload target name -> target section
+    """
+
+    def __init__(self, data, path=None, mtime=None, overrides=None):
+        super().__init__(data)
+        self.path = path
+        self.mtime = mtime
+        self.overrides = dict(overrides or {})
+        for (section, key), value in self.overrides.items():
+            self[section][key] = value
+        for section in self.values():
+            if isinstance(section, dict) and isinstance(section.get("type"), list):
+                section["type"] = tuple(ext.lower() for ext in section["type"])
+        self.targets = {name: section for name, section in self.items()
+                        if isinstance(section, dict) and "backend" in section}
+
+
+def _check_types(data, schema, prefix, errors):
+    for key, expected in schema.items():
+        name = prefix + key
+        if key not in data:
+            errors.append("missing: " + name)
+        elif isinstance(expected, dict):
+            if isinstance(data[key], dict):
+                _check_types(data[key], expected, name + ".", errors)
+            else:
+                errors.append("{}: expected a section".format(name))
+        # bool is an int, but not a valid count/port
+        elif not isinstance(data[key], expected) or (isinstance(data[key], bool) and expected is not bool):
+            errors.append("{}: expected {}, got {!r}".format(
+                name, "number" if expected is NUMBER else expected.__name__, data[key]))
+
+
+def _check_target(name, section, errors):
+    """
+    Check the keys the backend of an upload target needs
+    """
+    backend = section["backend"]
+    if backend not in transfer.BACKENDS:
+        errors.append("{}.backend: unknown backend {!r}".format(name, backend))
+        return
+    _check_types(section, BACKEND_KEYS[backend], name + ".", errors)
+    if backend == "ftps" and section.get("verify") not in FTPS_VERIFY:
+        errors.append("{}.verify: expected one of {}".format(name, ", ".join(FTPS_VERIFY)))
+    if backend == "http" and not str(section.get("url")).startswith(("http://", "https://")):
+        errors.append("{}.url: expected a http:// or https:// url".format(name))
+    if backend == "sftp" and section["enable"] and not (section.get("password") or section.get("key_file")):
+        errors.append("{}: password or key_file required".format(name))
+
+
+def _check_profile(name, profile, errors):
+    """
+    Check a thumbnail profile: known format and the keys of that format
+    """
+    if not isinstance(profile, dict):
+        errors.append("{}: expected a section".format(name))
+        return
+    _check_types(profile, {"format": str}, name + ".", errors)
+    if profile.get("format") not in PROFILE_KEYS:
+        if "format" in profile:
+            errors.append("{}.format: expected one of {}".format(name, ", ".join(
+                repr(fmt) for fmt in PROFILE_KEYS)))
+        return
+    before = len(errors)
+    _check_types(profile, PROFILE_KEYS[profile["format"]], name + ".", errors)
+    if len(errors) > before:
+        return
+    for key in ("quality", "min_quality"):
+        if key in profile and not 1 <= profile[key] <= 100:
+            errors.append("{}.{}: expected 1 to 100".format(name, key))
+
+
+def validate(data):
+    """
+    Check a parsed config file
+
+    Returns:
+        list of error messages (empty: valid)
+    """
+    if not isinstance(data, dict):
+        return ["config is not a json object"]
+    errors = []
+    _check_types(data, SCHEMA, "", errors)
+    if errors:
+        return errors
+
+    for name, section in data.items():
+        if isinstance(section, dict) and "backend" in section:
+            _check_target(name, section, errors)
+        if isinstance(section, dict) and isinstance(section.get("type"), list) and \
+                not all(isinstance(ext, str) for ext in section["type"]):
+            errors.append("{}.type: expected a list of file extensions".format(name))
+        if isinstance(section, dict) and isinstance(section.get("strip_metadata"), list):
+            for category in section["strip_metadata"]:
+                if category not in jpeg_strip.CATEGORIES:
+                    errors.append("{}.strip_metadata: unknown category {!r}".format(name, category))
+    if not isinstance(logging.getLevelName(data["log"]["level"].upper()), int):
+        errors.append("log.level: unknown level {!r}".format(data["log"]["level"]))
+    thumbnail = data["image_thumbnail"]
+    if thumbnail["profile"] and thumbnail["profile"] not in thumbnail["profiles"]:
+        errors.append("image_thumbnail.profile: no profile {!r}".format(thumbnail["profile"]))
+    for name, profile in thumbnail["profiles"].items():
+        _check_profile("image_thumbnail.profiles." + name, profile, errors)
+    if "default" not in data["supervisor"]["stage_deadline_s"]:
+        errors.append("missing: supervisor.stage_deadline_s.default")
+    if data["spool"]["heartbeat_s"] >= data["spool"]["lease_s"]:
+        errors.append("spool.heartbeat_s: has to be shorter than spool.lease_s")
+    for name in ("image_thumbnail.size_px", "loadtest.image_px"):
+        section, key = name.split(".")
+        size = data[section][key]
+        if len(size) != 2 or not all(isinstance(px, int) and not isinstance(px, bool) and px > 0 for px in size):
+            errors.append("{}: expected [width, height] in pixels".format(name))
+    return errors
+
+
+def load(path, overrides=None):
+    """
+    Read, validate and compile a config file
+
+    Args:
+        path: path to the json config file
+        overrides: {(section, key): value} set after loading (also after every reload)
+
+    Returns:
+        Config
+    Raises:
+        ConfigError if the file can not be read or is invalid
+    """
+    try:
+        mtime = os.stat(path).st_mtime
+        with open(path) as config_fh:
+            data = json.load(config_fh)
+    except (OSError, ValueError) as exceptmsg:
+        raise ConfigError("can not read config file {}: {}".format(path, exceptmsg))
+    errors = validate(data)
+    if errors:
+        raise ConfigError("invalid config file {}:\n    {}".format(path, "\n    ".join(errors)))
+    return Config(data, path, mtime, overrides)
+
+
+def request_reload(signum=None, frame=None):
+    """
+    Reload the config before the next job (signal handler)
+    """
+    global _reload_requested
+    _reload_requested = True
+
+
+def install_sighup(handler=request_reload):
+    signal.signal(signal.SIGHUP, handler)
+
+
+def refresh(config):
+    """
+    Reload the config if the file changed or a reload was requested
+
+    Returns:
+        the new Config, the given config if unchanged or if the new file is invalid
+    """
+    global _reload_requested
+    try:
+        changed = os.stat(config.path).st_mtime != config.mtime
+    except OSError:
+        changed = False
+    if not (changed or _reload_requested):
+        return config
+    _reload_requested = False
+    try:
+        new_config = load(config.path, config.overrides)
+    except ConfigError as exceptmsg:
+        logging.error("config not reloaded, keeping the running config: %s", exceptmsg)
+        # do not try the same file again
+        config.mtime = os.stat(config.path).st_mtime if os.path.exists(config.path) else config.mtime
+        return config
+
+    sections = sorted(name for name in set(config) | set(new_config) if config.get(name) != new_config.get(name))
+    logging.info("config reloaded from %s, changed: %s", config.path, ", ".join(sections) or "nothing")
+    restart = [name for name in sections if name in RESTART_SECTIONS]
+    if restart:
+        logging.warning("config sections changed which need a restart of the daemon: %s", ", ".join(restart))
+    return new_config
@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+"""
+SFTP upload backend (requires paramiko)
+All files of a job are uploaded over one SSH connection (one SFTP channel, pipelined writes).
+"""
+import logging
+import os
+import posixpath
+
+import paramiko
+
+from libmultiupload import fileops, transfer
+
+
+def connect(target_config):
+    """
+    Connect and login (known host keys only), open the SFTP channel
+
+    Returns:
+        (paramiko.SSHClient, paramiko.SFTPClient)
+    """
+    ssh = paramiko.SSHClient()
+    ssh.load_system_host_keys()
+    ssh.set_missing_host_key_policy(paramiko.RejectPolicy())
+    ssh.connect(target_config["ftp"], port=target_config["port"],
+                username=target_config["username"],
+                password=target_config["password"] or None,
+                key_filename=target_config.get("key_file") or None,
+                timeout=target_config["timeout_s"], banner_timeout=target_config["timeout_s"],
+                auth_timeout=target_config["timeout_s"])
+    logging.info("Logged into SFTP Server: %s, username: %s", target_config["ftp"], target_config["username"])
+    try:
+        sftp = ssh.open_sftp()
+        # read/write timeout, a stalled transfer raises instead of blocking the worker
+        sftp.get_channel().settimeout(target_config["timeout_s"])
+    except Exception:
+        ssh.close()
+        raise
+    return ssh, sftp
+
+
+def _callback(prog):
+    """
+    Return a put() callback reporting the sent bytes to a Progress object (None without)
+    """
+    if prog is None:
+        return None
+    sent = [0]
+
+    def callback(done, total):
+        prog.update(0, done - sent[0])
+        sent[0] = done
+    return callback
+
+
+def upload(target_config, localpath, filetype, remotefoldername, enable_recursive, prog=None):
+    """
+    Transfer backend "sftp" (see transfer.py)
+
+    Args:
+        target_config: target section of the config (ftp (host), port, username,
+                       password and/or key_file, target_dir, timeout_s)
+        localpath: path which holds elements to upload
+        filetype: tuple of lowercase file endings to upload (leave empty to disable)
+        remotefoldername: job folder name
+        enable_recursive: enable or disable recursive upload
+        prog: progress.Progress object of this upload (optional)
+
+    Returns:
+        (0, "success") or (-1, error message)
+    """
+    logging.debug("Entered sftp upload(): %s", localpath)
+    try:
+        ssh, sftp = connect(target_config)
+        try:
+            def mkdir(remote_path):
+                try:
+                    sftp.stat(remote_path)
+                    logging.debug("folder did exist: %s", remote_path)
+                except IOError:
+                    sftp.mkdir(remote_path)
+                    logging.debug("mkdir: %s", remote_path)
+
+            def put_dir(path, remote_path):
+                mkdir(remote_path)
+                for entry in os.scandir(path):
+                    if entry.is_file():
+                        if transfer.matches(entry.name, filetype):
+                            # put() confirms the remote size after the transfer
+                            sftp.put(entry.path, posixpath.join(remote_path, entry.name),
+                                     callback=_callback(prog))
+                            logging.info("put: %s", entry.name)
+                            if prog is not None:
+                                prog.update(1)
+                    elif entry.is_dir() and enable_recursive:
+                        put_dir(entry.path, posixpath.join(remote_path, entry.name))
+
+            if prog is not None:
+                prog.add_total(*fileops.tree_size(localpath, filetype, enable_recursive))
+            put_dir(localpath, posixpath.join(target_config["target_dir"], remotefoldername))
+            if prog is not None:
+                prog.finish()
+        finally:
+            ssh.close()
+        logging.info("SFTP logout")
+        return 0, "success"
+
+    except Exception as exceptmsg:
+        return -1, "error in sftp upload():\n" + str(exceptmsg)
+
+
+class Session:
+    """
+    Transfer backend "sftp" session (see transfer.Session): one SSH connection for
+    several uploads of single files into the job folder
+    """
+
+    def __init__(self, target_config, remotefoldername):
+        self.ssh, self.sftp = connect(target_config)
+        self.remote_path = posixpath.join(target_config["target_dir"], remotefoldername)
+        self.folders = set()
+        self.mkdir(self.remote_path)
+
+    def mkdir(self, remote_path):
+        if remote_path in self.folders:
+            return
+        try:
+            self.sftp.stat(remote_path)
+        except IOError:
+            self.sftp.mkdir(remote_path)
+            logging.debug("mkdir: %s", remote_path)
+        self.folders.add(remote_path)
+
+    def put(self, local_path, rel_path, prog=None):
+        """
+        Upload one file to <job folder>/<rel_path> (folders are created)
+        """
+        parts = rel_path.split(os.sep)
+        for depth in range(1, len(parts)):
+            self.mkdir(posixpath.join(self.remote_path, *parts[:depth]))
+        self.sftp.put(local_path, posixpath.join(self.remote_path, *parts), callback=_callback(prog))
+        logging.info("put: %s", rel_path)
+
+    def close(self):
+        self.ssh.close()
+        logging.info("SFTP logout")
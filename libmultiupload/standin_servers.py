@@ -0,0 +1,483 @@
+#!/usr/bin/env python3
+"""
+Local stand-in servers (FTPS and SMTP) to replay and profile jobs offline.
+    - StandinFTPServer: minimal FTP server with explicit TLS (AUTH TLS, PROT P),
+      stores uploaded files below a local root folder
+    - StandinSMTPServer: SMTP sink, keeps received mails in memory (and in a folder)
+Only the commands used by ftplib/smtplib in this project are implemented.
+
+Both servers can simulate bad networks for load tests (faults, see NO_FAULTS): latency of
+every reply, slow logins, a bandwidth cap shared by all data connections and data
+connections dropped during STOR. Injected faults are counted in server.stats.
+"""
+import hashlib
+import logging
+import os
+import random
+import socket
+import socketserver
+import ssl
+import subprocess
+import threading
+import time
+import zlib
+
+# fault injection settings of the stand-in servers (all off)
+NO_FAULTS = {
+    "latency_s": 0.0,      # delay of every reply
+    "login_delay_s": 0.0,  # extra delay of PASS (ftp) / greeting (smtp)
+    "bandwidth_bps": 0,    # bytes per second of all data connections together (0: unlimited)
+    "drop_rate": 0.0,      # probability that a STOR data connection is closed mid-transfer
+    "seed": None,          # random seed of the drops (reproducible runs)
+}
+
+
+def make_selfsigned_cert(directory):
+    """
+    Create a self signed certificate for the stand-in FTPS server (requires openssl)
+
+    Args:
+        directory: folder for cert.pem and key.pem
+
+    Returns:
+        (certfile, keyfile)
+    """
+    if not os.path.exists(directory):
+        os.makedirs(directory)
+    certfile = os.path.join(directory, "cert.pem")
+    keyfile = os.path.join(directory, "key.pem")
+    if not os.path.exists(certfile):
+        subprocess.check_output(["openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes",
+                                 "-keyout", keyfile, "-out", certfile, "-days", "1",
+                                 "-subj", "/CN=localhost"], stderr=subprocess.STDOUT)
+    return certfile, keyfile
+
+
+class _ServerThreadMixin:
+    """
+    start()/stop() the server in a background thread, fault injection (see NO_FAULTS)
+    """
+
+    def setup_faults(self, faults):
+        self.faults = dict(NO_FAULTS, **(faults or {}))
+        self.random = random.Random(self.faults["seed"])
+        self.stats = {"connections": 0, "drops": 0, "throttled_s": 0.0}
+        self.stats_lock = threading.Lock()
+        self.bandwidth_next = time.monotonic()
+
+    def count(self, stat, value=1):
+        with self.stats_lock:
+            self.stats[stat] += value
+
+    def throttle(self, nbytes):
+        """
+        Wait until nbytes may pass the shared bandwidth cap
+        """
+        if not self.faults["bandwidth_bps"]:
+            return
+        with self.stats_lock:
+            now = time.monotonic()
+            start = max(now, self.bandwidth_next)
+            self.bandwidth_next = start + nbytes / self.faults["bandwidth_bps"]
+            delay = self.bandwidth_next - now
+            self.stats["throttled_s"] += delay
+        time.sleep(delay)
+
+    def should_drop(self):
+        with self.stats_lock:
+            return self.random.random() < self.faults["drop_rate"]
+
+    def start(self):
+        """
+        Serve in a daemon thread
+
+        Returns:
+            (host, port) the server is listening on
+        """
+        self.thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self.thread.start()
+        return self.server_address[0], self.server_address[1]
+
+    def stop(self):
+        """
+        Stop serving and close the listening socket
+        """
+        self.shutdown()
+        self.server_close()
+
+
+################################################################################
+# FTPS
+################################################################################
+
+class _FTPHandler(socketserver.BaseRequestHandler):
+    """
+    One FTP control connection
+    """
+
+    def setup(self):
+        self.server.count("connections")
+        self.conn = self.request
+        self.conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.reader = self.conn.makefile("rb")
+        self.cwd = "/"
+        self.prot_p = False
+        self.pasv_sock = None
+        self.hash_algo = "SHA-256"
+
+    def reply(self, line):
+        if self.server.faults["latency_s"]:
+            time.sleep(self.server.faults["latency_s"])
+        self.conn.sendall((line + "\r\n").encode())
+
+    def fs_path(self, path):
+        """
+        Map a (relative or absolute) ftp path to a path below the server root
+        """
+        virtual = os.path.normpath(os.path.join(self.cwd, path)).replace("\\", "/")
+        if not virtual.startswith("/"):
+            virtual = "/" + virtual
+        return virtual, os.path.join(self.server.root, virtual.lstrip("/"))
+
+    def handle(self):
+        self.reply("220 stand-in ftp ready")
+        while True:
+            line = self.reader.readline()
+            if not line:
+                break
+            line = line.decode(errors="replace").rstrip("\r\n")
+            cmd, _, arg = line.partition(" ")
+            handler = getattr(self, "ftp_" + cmd.upper(), None)
+            if handler is None:
+                self.reply("502 command not implemented")
+                continue
+            try:
+                if handler(arg) is False:
+                    break
+            except (OSError, ssl.SSLError):
+                logging.exception("stand-in ftp: error handling %s", cmd)
+                break
+
+    def finish(self):
+        if self.pasv_sock is not None:
+            self.pasv_sock.close()
+
+    # --- session ------------------------------------------------------------
+
+    def ftp_USER(self, arg):
+        self.reply("331 password required")
+
+    def ftp_PASS(self, arg):
+        time.sleep(self.server.faults["login_delay_s"])
+        self.reply("230 logged in")
+
+    def ftp_AUTH(self, arg):
+        if self.server.ssl_context is None:
+            self.reply("502 TLS not available")
+            return
+        self.reply("234 AUTH TLS successful")
+        self.conn = self.server.ssl_context.wrap_socket(self.conn, server_side=True)
+        self.reader = self.conn.makefile("rb")
+
+    def ftp_PBSZ(self, arg):
+        self.reply("200 PBSZ=0")
+
+    def ftp_PROT(self, arg):
+        self.prot_p = arg.upper() == "P"
+        self.reply("200 PROT " + arg.upper())
+
+    def ftp_SYST(self, arg):
+        self.reply("215 UNIX Type: L8")
+
+    def ftp_FEAT(self, arg):
+        self.conn.sendall(b"211-Features:\r\n AUTH TLS\r\n PBSZ\r\n PROT\r\n SIZE\r\n MLSD\r\n"
+                          b" HASH SHA-256*;SHA-1;MD5\r\n XMD5\r\n XCRC\r\n211 End\r\n")
+
+    def ftp_OPTS(self, arg):
+        words = arg.upper().split()
+        if len(words) == 2 and words[0] == "HASH" and words[1] in ("SHA-256", "SHA-1", "MD5"):
+            self.hash_algo = words[1]
+            self.reply("200 " + words[1])
+        else:
+            self.reply("501 option not supported")
+
+    def ftp_TYPE(self, arg):
+        self.reply("200 type set")
+
+    def ftp_NOOP(self, arg):
+        self.reply("200 ok")
+
+    def ftp_QUIT(self, arg):
+        self.reply("221 bye")
+        return False
+
+    # --- directories --------------------------------------------------------
+
+    def ftp_PWD(self, arg):
+        self.reply('257 "{}"'.format(self.cwd))
+
+    def ftp_CWD(self, arg):
+        virtual, path = self.fs_path(arg)
+        if os.path.isdir(path):
+            self.cwd = virtual
+            self.reply("250 ok")
+        else:
+            self.reply("550 no such directory")
+
+    def ftp_CDUP(self, arg):
+        self.ftp_CWD("..")
+
+    def ftp_MKD(self, arg):
+        virtual, path = self.fs_path(arg)
+        if os.path.exists(path):
+            self.reply("550 already exists")
+        else:
+            os.makedirs(path)
+            self.reply('257 "{}" created'.format(virtual))
+
+    def ftp_SIZE(self, arg):
+        _, path = self.fs_path(arg)
+        if os.path.isfile(path):
+            self.reply("213 {}".format(os.path.getsize(path)))
+        else:
+            self.reply("550 no such file")
+
+    def file_digest(self, path, algo):
+        if algo == "CRC32":
+            crc = 0
+            with open(path, "rb") as fh:
+                for block in iter(lambda: fh.read(1 << 20), b""):
+                    crc = zlib.crc32(block, crc)
+            return "{:08X}".format(crc)
+        digest = hashlib.new(algo.replace("-", "").lower())
+        with open(path, "rb") as fh:
+            for block in iter(lambda: fh.read(1 << 20), b""):
+                digest.update(block)
+        return digest.hexdigest()
+
+    def ftp_HASH(self, arg):
+        _, path = self.fs_path(arg)
+        if os.path.isfile(path):
+            self.reply("213 {} 0-{} {} {}".format(self.hash_algo, os.path.getsize(path),
+                                                 self.file_digest(path, self.hash_algo), arg))
+        else:
+            self.reply("550 no such file")
+
+    def ftp_XMD5(self, arg):
+        _, path = self.fs_path(arg)
+        if os.path.isfile(path):
+            self.reply("250 " + self.file_digest(path, "MD5").upper())
+        else:
+            self.reply("550 no such file")
+
+    def ftp_XCRC(self, arg):
+        _, path = self.fs_path(arg)
+        if os.path.isfile(path):
+            self.reply("250 " + self.file_digest(path, "CRC32"))
+        else:
+            self.reply("550 no such file")
+
+    # --- data connections ---------------------------------------------------
+
+    def ftp_PASV(self, arg):
+        if self.pasv_sock is not None:
+            self.pasv_sock.close()
+        self.pasv_sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.pasv_sock.bind((self.server.server_address[0], 0))
+        self.pasv_sock.listen(1)
+        host, port = self.pasv_sock.getsockname()
+        self.reply("227 Entering Passive Mode ({},{},{})".format(host.replace(".", ","), port >> 8, port & 0xff))
+
+    def open_data(self):
+        """
+        Accept the data connection (after PASV), TLS if PROT P
+        """
+        if self.pasv_sock is None:
+            self.reply("425 use PASV first")
+            return None
+        self.reply("150 opening data connection")
+        data, _ = self.pasv_sock.accept()
+        self.pasv_sock.close()
+        self.pasv_sock = None
+        if self.prot_p:
+            data = self.server.ssl_context.wrap_socket(data, server_side=True)
+        return data
+
+    def close_data(self, data):
+        if isinstance(data, ssl.SSLSocket):
+            try:
+                data = data.unwrap()
+            except (OSError, ssl.SSLError):
+                pass
+        data.close()
+
+    def send_listing(self, lines):
+        data = self.open_data()
+        if data is None:
+            return
+        data.sendall("".join(line + "\r\n" for line in lines).encode())
+        self.close_data(data)
+        self.reply("226 transfer complete")
+
+    def ftp_LIST(self, arg):
+        _, path = self.fs_path(".")
+        lines = []
+        for entry in sorted(os.scandir(path), key=lambda e: e.name):
+            mode = "drwxr-xr-x" if entry.is_dir() else "-rw-r--r--"
+            size = 0 if entry.is_dir() else entry.stat().st_size
+            lines.append("{} 1 ftp ftp {} Jan 01 00:00 {}".format(mode, size, entry.name))
+        self.send_listing(lines)
+
+    def ftp_NLST(self, arg):
+        _, path = self.fs_path(".")
+        self.send_listing(sorted(os.listdir(path)))
+
+    def ftp_MLSD(self, arg):
+        _, path = self.fs_path(arg or ".")
+        lines = []
+        for entry in sorted(os.scandir(path), key=lambda e: e.name):
+            if entry.is_dir():
+                lines.append("type=dir; " + entry.name)
+            else:
+                lines.append("type=file;size={}; {}".format(entry.stat().st_size, entry.name))
+        self.send_listing(lines)
+
+    def ftp_STOR(self, arg):
+        _, path = self.fs_path(arg)
+        data = self.open_data()
+        if data is None:
+            return
+        # a dropped connection is closed after a random part of the file (at most 1 MB)
+        drop_at = self.server.random.randrange(1 << 20) if self.server.should_drop() else None
+        received = 0
+        with open(path, "wb") as fh:
+            while True:
+                block = data.recv(65536)
+                if not block:
+                    break
+                self.server.throttle(len(block))
+                fh.write(block)
+                received += len(block)
+                if drop_at is not None and received >= drop_at:
+                    break
+        if drop_at is not None and received >= drop_at:
+            self.server.count("drops")
+            logging.info("stand-in ftp: dropping data connection of %s after %d bytes", arg, received)
+            data.close()
+            self.reply("426 connection closed; transfer aborted")
+            return
+        self.close_data(data)
+        self.server.stored.append(path)
+        self.reply("226 transfer complete")
+
+
+class StandinFTPServer(_ServerThreadMixin, socketserver.ThreadingTCPServer):
+    """
+    Stand-in FTPS server, files are stored below root
+
+    Args:
+        root: local folder which is the root ("/") of the ftp server
+        host: address to listen on
+        port: port to listen on (0: any free port)
+        certfile: certificate for AUTH TLS (None: no TLS)
+        keyfile: key of the certificate
+        faults: simulated network faults (see NO_FAULTS, None: none)
+    """
+    allow_reuse_address = True
+    daemon_threads = True
+
+    def __init__(self, root, host="127.0.0.1", port=0, certfile=None, keyfile=None, faults=None):
+        self.root = root
+        self.stored = []
+        self.setup_faults(faults)
+        self.ssl_context = None
+        if certfile is not None:
+            self.ssl_context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+            self.ssl_context.load_cert_chain(certfile, keyfile)
+        if not os.path.exists(root):
+            os.makedirs(root)
+        socketserver.ThreadingTCPServer.__init__(self, (host, port), _FTPHandler)
+
+
+################################################################################
+# SMTP
+################################################################################
+
+class _SMTPHandler(socketserver.StreamRequestHandler):
+    """
+    One SMTP connection, every mail is accepted
+    """
+
+    def reply(self, line):
+        if self.server.faults["latency_s"]:
+            time.sleep(self.server.faults["latency_s"])
+        self.wfile.write((line + "\r\n").encode())
+
+    def handle(self):
+        self.server.count("connections")
+        time.sleep(self.server.faults["login_delay_s"])
+        self.reply("220 stand-in smtp ready")
+        mail_from, rcpt_to = "", []
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                break
+            cmd = line.decode(errors="replace").strip()
+            verb = cmd[:4].upper()
+            if verb in ("HELO", "EHLO"):
+                self.reply("250 stand-in")
+            elif verb == "MAIL":
+                mail_from, rcpt_to = cmd[10:].strip(), []
+                self.reply("250 ok")
+            elif verb == "RCPT":
+                rcpt_to.append(cmd[8:].strip())
+                self.reply("250 ok")
+            elif verb == "DATA":
+                self.reply("354 end data with <CR><LF>.<CR><LF>")
+                lines = []
+                while True:
+                    data_line = self.rfile.readline()
+                    if not data_line or data_line in (b".\r\n", b".\n"):
+                        break
+                    if data_line.startswith(b".."):
+                        data_line = data_line[1:]
+                    lines.append(data_line)
+                self.server.add_message(mail_from, rcpt_to, b"".join(lines))
+                self.reply("250 queued")
+            elif verb in ("RSET", "NOOP"):
+                self.reply("250 ok")
+            elif verb == "QUIT":
+                self.reply("221 bye")
+                break
+            else:
+                self.reply("502 command not implemented")
+
+
+class StandinSMTPServer(_ServerThreadMixin, socketserver.ThreadingTCPServer):
+    """
+    Stand-in SMTP server, received mails are kept in messages (and written to maildir if set)
+
+    Args:
+        maildir: folder to store received mails as .eml files (None: memory only)
+        host: address to listen on
+        port: port to listen on (0: any free port)
+        faults: simulated network faults (see NO_FAULTS, bandwidth and drops are not used)
+    """
+    allow_reuse_address = True
+    daemon_threads = True
+
+    def __init__(self, maildir=None, host="127.0.0.1", port=0, faults=None):
+        self.maildir = maildir
+        self.setup_faults(faults)
+        self.messages = []
+        self.lock = threading.Lock()
+        if maildir is not None and not os.path.exists(maildir):
+            os.makedirs(maildir)
+        socketserver.ThreadingTCPServer.__init__(self, (host, port), _SMTPHandler)
+
+    def add_message(self, mail_from, rcpt_to, message):
+        with self.lock:
+            self.messages.append((mail_from, rcpt_to, message))
+            if self.maildir is not None:
+                with open(os.path.join(self.maildir, "{:04d}.eml".format(len(self.messages))), "wb") as fh:
+                    fh.write(message)
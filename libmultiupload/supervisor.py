@@ -0,0 +1,209 @@
+#!/usr/bin/env python3
+"""
+Supervisor of the daemon worker processes (analyzer, uploader):
+    - every worker reports the queue item it works on and every stage it enters/leaves
+      (profiling.stage) over a control queue
+    - a stage running longer than its deadline (supervisor.stage_deadline_s) counts as hung
+    - hung workers are killed together with their child processes (e.g. ffmpeg, every
+      worker is a process group of its own), crashed or killed workers are restarted and their item
+      is requeued (the uploader continues the job after its last finished stage,
+      see job_state), up to supervisor.max_attempts times per item
+    - stop() (SIGTERM of the main process) kills every worker without restarting it
+"""
+import logging
+import multiprocessing
+import os
+import queue
+import signal
+import threading
+import time
+
+from libmultiupload import emailmod
+
+# worker side: set by setup_worker() in the worker process
+_control_q = None
+_worker_name = None
+
+
+def setup_worker(control_q, name):
+    """
+    Enable reporting to the supervisor (call once in the worker process)
+    """
+    global _control_q, _worker_name
+    _control_q = control_q
+    _worker_name = name
+    # own process group: killing the worker also kills the programs it started
+    os.setpgrp()
+    # not the stop handler of the main process (inherited by fork)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+
+
+def report_item(item):
+    """
+    Report the queue item the worker starts (None: finished)
+    """
+    if _control_q is not None:
+        _control_q.put(("item", _worker_name, os.getpid(), item))
+
+
+def stage_enter(config, job, stage):
+    if _control_q is not None:
+        deadlines = config["supervisor"]["stage_deadline_s"]
+        deadline = time.time() + deadlines.get(stage, deadlines["default"])
+        _control_q.put(("enter", _worker_name, os.getpid(), job, stage, deadline))
+
+
+def stage_exit(job, stage):
+    if _control_q is not None:
+        _control_q.put(("exit", _worker_name, os.getpid(), job, stage))
+
+
+class Worker:
+    """
+    One supervised worker process
+
+    Args:
+        name: unique name, passed to target as last argument
+        target: worker function (loops forever)
+        args: arguments of target
+        requeue: called with (item, stages) of a killed or crashed worker,
+                 stages: names of the stages it was in
+        on_abandon: called with (item, stages) instead of requeue after max_attempts (optional)
+    """
+
+    def __init__(self, name, target, args, requeue, on_abandon=None):
+        self.name = name
+        self.target = target
+        self.args = args
+        self.requeue = requeue
+        self.on_abandon = on_abandon
+        self.process = None
+        self.item = None
+        self.stages = []  # stack of (job, stage, deadline)
+
+    def start(self):
+        self.item = None
+        self.stages = []
+        self.process = multiprocessing.Process(target=self.target, args=self.args + (self.name,),
+                                               name=self.name, daemon=True)
+        self.process.start()
+
+    def kill(self):
+        """
+        Kill the worker and all processes of its group (still running programs of a crashed worker)
+        """
+        try:
+            os.killpg(self.process.pid, signal.SIGKILL)
+        except (ProcessLookupError, PermissionError):
+            # no process left, or the worker died before setup_worker()
+            if self.process.is_alive():
+                self.process.kill()
+        self.process.join(10)
+
+    def overdue(self, now):
+        """
+        Return the stage which passed its deadline, None otherwise
+        """
+        for job, stage, deadline in self.stages:
+            if now > deadline:
+                return job, stage
+        return None
+
+
+class Supervisor:
+    """
+    Start, watch and restart worker processes (run() blocks, run it in a thread)
+
+    Args:
+        config: parsed json config file
+        control_q: multiprocessing.Queue the workers report to
+    """
+
+    def __init__(self, config, control_q):
+        self.config = config
+        self.control_q = control_q
+        self.workers = {}
+        self.attempts = {}  # repr(item) -> number of restarts
+        self.stopped = False
+        # held while workers are checked/restarted (reentrant: stop() may run in a signal
+        # handler of the thread running run())
+        self.lock = threading.RLock()
+
+    def add(self, worker):
+        self.workers[worker.name] = worker
+        worker.start()
+
+    def handle(self, message):
+        worker = self.workers.get(message[1])
+        # reports of a killed process (same name) are ignored
+        if worker is None or message[2] != worker.process.pid:
+            return
+        if message[0] == "item":
+            if message[3] is None and worker.item is not None:
+                self.attempts.pop(repr(worker.item), None)
+            worker.item = message[3]
+        elif message[0] == "enter":
+            worker.stages.append(message[3:])
+        elif message[0] == "exit":
+            # nested stages exit in reverse order
+            for index in range(len(worker.stages) - 1, -1, -1):
+                if worker.stages[index][:2] == message[3:]:
+                    del worker.stages[index]
+                    break
+
+    def check(self, worker, now):
+        reason = None
+        if not worker.process.is_alive():
+            reason = "crashed (exit code {})".format(worker.process.exitcode)
+        else:
+            overdue = worker.overdue(now)
+            if overdue is not None:
+                reason = "hung in stage {} of {}".format(overdue[1], overdue[0])
+        if reason is None:
+            return
+        worker.kill()
+
+        item = worker.item
+        stages = [stage for _, stage, _ in worker.stages]
+        logging.error("supervisor: worker %s %s, item: %s", worker.name, reason, item)
+        # restart first, the queue of the worker may be full
+        worker.start()
+        if item is not None:
+            attempts = self.attempts.get(repr(item), 0) + 1
+            self.attempts[repr(item)] = attempts
+            if attempts < self.config["supervisor"]["max_attempts"]:
+                logging.warning("supervisor: requeue %s (attempt %d)", item, attempts + 1)
+                worker.requeue(item, stages)
+            else:
+                logging.error("supervisor: giving up on %s after %d attempts", item, attempts)
+                self.attempts.pop(repr(item), None)
+                if worker.on_abandon is not None:
+                    worker.on_abandon(item, stages)
+        emailmod.send_err("worker {} {}".format(worker.name, reason),
+                          "item: {}\nthe worker was restarted, see logfile".format(item), self.config)
+
+    def stop(self):
+        """
+        Kill all workers and their child processes, no more restarts (run() returns)
+        """
+        with self.lock:
+            self.stopped = True
+            for worker in self.workers.values():
+                worker.kill()
+        logging.info("supervisor: %d worker(s) stopped", len(self.workers))
+
+    def run(self):
+        while not self.stopped:
+            try:
+                self.handle(self.control_q.get(True, self.config["supervisor"]["check_interval_s"]))
+                # process all pending reports before checking the workers
+                while True:
+                    self.handle(self.control_q.get_nowait())
+            except queue.Empty:
+                pass
+            with self.lock:
+                now = time.time()
+                for worker in list(self.workers.values()):
+                    if self.stopped:
+                        break
+                    self.check(worker, now)
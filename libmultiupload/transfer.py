@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+"""
+Transfer backends: every upload target in the config (e.g. "remote_ftp", "local_ftp")
+selects its backend with the "backend" key:
+    - "ftps":  FTP over TLS (ftps_mod)
+    - "sftp":  SFTP over one SSH connection (sftp_mod, requires paramiko)
+    - "http":  HTTP(S) PUT, optionally WebDAV MKCOL (httpput_mod)
+    - "local": copy to a local/NFS folder (localfs_mod)
+
+Every backend module implements the same function:
+
+    upload(target_config, localpath, filetype, remotefoldername, enable_recursive, prog=None)
+
+    Upload the files (of matching type, filetype: tuple of lowercase endings as in the
+    config, empty: all files) of localpath into
+    the folder remotefoldername below the target directory of the target,
+    recursive if enable_recursive.
+    Returns (0, "success") or (-1, error message)
+
+Several uploads of exactly listed files of one job (streamed batches) share one connection
+with a Session, every backend module implements:
+
+    Session(target_config, remotefoldername)   connect, create the job folder
+    Session.put(local_path, rel_path, prog=None)   upload one file to <job folder>/<rel_path>
+    Session.close()
+
+Backend modules are imported on first use, so optional dependencies are only
+required if a target uses that backend.
+"""
+import importlib
+import logging
+import os
+
+BACKENDS = {
+    "ftps": "libmultiupload.ftps_mod",
+    "sftp": "libmultiupload.sftp_mod",
+    "http": "libmultiupload.httpput_mod",
+    "local": "libmultiupload.localfs_mod",
+}
+
+
+def matches(f_name, filetype):
+    """
+    Check a filename against the accepted types (tuple of lowercase endings, empty: all)
+    """
+    return not filetype or f_name.lower().endswith(filetype)
+
+
+def get_backend(name):
+    """
+    Return the backend module of a backend name
+    """
+    if name not in BACKENDS:
+        raise ValueError("unknown transfer backend: " + str(name))
+    return importlib.import_module(BACKENDS[name])
+
+
+def upload(config, target, localpath, filetype, remotefoldername, enable_recursive, prog=None):
+    """
+    Upload with the backend configured for a target
+
+    Args:
+        config: parsed json config file
+        target: name of the target section in the config (e.g. "remote_ftp")
+        localpath: path which holds elements to upload
+        filetype: tuple of lowercase file endings to upload (leave empty to disable)
+        remotefoldername: job folder name
+        enable_recursive: enable or disable recursive upload
+        prog: progress.Progress object of this upload (optional)
+
+    Returns:
+        (0, "success") or (-1, error message)
+    """
+    target_config = config[target]
+    backend = target_config["backend"]
+    logging.debug("upload %s to %s via %s", localpath, target, backend)
+    try:
+        backend_module = get_backend(backend)
+    except (ValueError, ImportError) as exceptmsg:
+        return -1, "error in transfer.upload() for {}:\n{}".format(target, exceptmsg)
+    return backend_module.upload(target_config, localpath, filetype, remotefoldername,
+                                 enable_recursive, prog)
+
+
+class Session:
+    """
+    Uploads of exactly listed files of one job to one target over one connection
+    (connected on the first upload, again after an error)
+
+    Args:
+        config: parsed json config file
+        target: name of the target section in the config (e.g. "remote_ftp")
+        remotefoldername: job folder name
+    """
+
+    def __init__(self, config, target, remotefoldername):
+        self.target = target
+        self.target_config = config[target]
+        self.remotefoldername = remotefoldername
+        self.backend_session = None
+
+    def upload_files(self, localpath, files, prog=None, remote_names=None):
+        """
+        Upload files (paths relative to localpath, kept below the job folder)
+
+        Args:
+            remote_names: paths below the job folder, one per file (default: files)
+
+        Returns:
+            (0, "success") or (-1, error message)
+        """
+        try:
+            if prog is not None:
+                prog.add_total(len(files), sum(os.path.getsize(os.path.join(localpath, name)) for name in files))
+            if self.backend_session is None:
+                backend_module = get_backend(self.target_config["backend"])
+                self.backend_session = backend_module.Session(self.target_config, self.remotefoldername)
+            for name, remote_name in zip(files, files if remote_names is None else remote_names):
+                self.backend_session.put(os.path.join(localpath, name), remote_name, prog)
+                if prog is not None:
+                    prog.update(1)
+            if prog is not None:
+                prog.finish()
+            return 0, "success"
+        except Exception as exceptmsg:
+            # the connection may be broken, the next upload connects again
+            self.close()
+            return -1, "error in transfer.Session for {}:\n{}".format(self.target, exceptmsg)
+
+    def close(self):
+        if self.backend_session is not None:
+            try:
+                self.backend_session.close()
+            except Exception:
+                logging.exception("Error closing the %s session", self.target)
+            self.backend_session = None
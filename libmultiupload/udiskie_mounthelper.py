@@ -1,12 +1,138 @@
 #!/usr/bin/env python3
 """
 Udiskie helper functions (check if mounted, mount, unmount ...)
+
+Mounted devices are looked up in a MountTable: parsed from /proc/self/mounts only when
+the kernel reports a change of the mount table (poll), devices are compared exactly
+(/dev/sdb1 is not /dev/sdb10), symlinks like /dev/disk/by-uuid/... are resolved.
 """
 import logging
 import os
+import re
+import select
 import stat
 import subprocess
 
+_OCTAL_ESCAPE = re.compile(r"\\([0-7]{3})")
+
+
+def _unescape(field):
+    # /proc/mounts escapes space, tab, newline and backslash as octal (\040 ...)
+    return _OCTAL_ESCAPE.sub(lambda match: chr(int(match.group(1), 8)), field)
+
+
+class MountTable:
+    """
+    Cached mount table: device -> mountpoint
+
+    Args:
+        path: mount table file, /proc/self/mounts (pollable) or a file (tests, checked by mtime)
+    """
+
+    def __init__(self, path="/proc/self/mounts"):
+        self.path = path
+        self.mounts = {}
+        self.poller = None
+        self.mtime = None
+        if path.startswith("/proc/"):
+            # the kernel signals every change of the mount table with POLLPRI
+            self.fh = open(path)
+            self.poller = select.poll()
+            self.poller.register(self.fh, select.POLLPRI | select.POLLERR)
+        self.refresh()
+
+    def refresh(self):
+        """
+        Read the mount table
+
+        Returns:
+            (mounted, unmounted): dicts device -> mountpoint of the changes
+        """
+        if self.poller is not None:
+            self.fh.seek(0)
+            lines = self.fh.read().splitlines()
+        else:
+            self.mtime = os.stat(self.path).st_mtime_ns
+            with open(self.path) as fh:
+                lines = fh.read().splitlines()
+        mounts = {}
+        for line in lines:
+            fields = line.split()
+            if len(fields) < 2 or not fields[0].startswith("/"):
+                continue
+            device = os.path.realpath(_unescape(fields[0]))
+            # the first mount of a device (bind mounts follow)
+            mounts.setdefault(device, _unescape(fields[1]))
+        mounted = {device: point for device, point in mounts.items() if self.mounts.get(device) != point}
+        unmounted = {device: point for device, point in self.mounts.items() if device not in mounts}
+        self.mounts = mounts
+        return mounted, unmounted
+
+    def update(self):
+        """
+        Read the mount table again if it changed (cheap if not)
+
+        Returns:
+            (mounted, unmounted) as refresh(), empty if unchanged
+        """
+        if self.poller is not None:
+            changed = bool(self.poller.poll(0))
+        else:
+            changed = os.stat(self.path).st_mtime_ns != self.mtime
+        if not changed:
+            return {}, {}
+        return self.refresh()
+
+    def mountpoint(self, device):
+        """
+        Return the mountpoint of a device, None if it is not mounted
+        """
+        self.update()
+        return self.mounts.get(os.path.realpath(device))
+
+    def close(self):
+        if self.poller is not None:
+            self.fh.close()
+
+
+# filesystems of network shares (sqlite locking/WAL is not safe on them)
+NETWORK_FILESYSTEMS = ("nfs", "nfs4", "cifs", "smb3", "smbfs", "ceph", "glusterfs", "fuse.sshfs", "9p", "afs")
+
+
+def filesystem_type(path, mounts="/proc/self/mounts"):
+    """
+    Return the filesystem type of the mount holding path (also if path does not exist yet),
+    None if unknown
+    """
+    path = os.path.realpath(path)
+    best, fstype = "", None
+    try:
+        with open(mounts) as fh:
+            for line in fh:
+                fields = line.split()
+                if len(fields) < 3:
+                    continue
+                point = _unescape(fields[1])
+                # the last mount on a mountpoint hides the earlier ones
+                if (path == point or path.startswith(point.rstrip("/") + "/")) and len(point) >= len(best):
+                    best, fstype = point, fields[2]
+    except OSError:
+        return None
+    return fstype
+
+
+_mount_table = None
+
+
+def mount_table():
+    """
+    Return the MountTable of this process (created on first use)
+    """
+    global _mount_table
+    if _mount_table is None:
+        _mount_table = MountTable()
+    return _mount_table
+
 
 def check_if_mounted(device):
     """
@@ -23,21 +149,14 @@ def check_if_mounted(device):
 
     logging.debug("Entered check_if_mounted()")
     try:
+        mountpoint = mount_table().mountpoint(device)
+        if mountpoint is not None:
+            logging.debug("Found partition mounted: %s on %s", device, mountpoint)
+            return mountpoint
 
-        with open("/proc/mounts", "r") as mountfile:  # specific to Linux
-            mounted_partitions = mountfile.read()
-
-            for item in mounted_partitions.split("\n"):
-                if device in item:
-                    logging.debug("Found partition mounted: " + item)
-                    snip = item.split()
-
-                    # return mountpoint if it is mounted
-                    return snip[1]
-
-            # return 0 if not mounted (not present in /proc/mounts)
-            logging.debug("Partition is not mounted: " + device)
-            return 0
+        # return 0 if not mounted (not present in /proc/mounts)
+        logging.debug("Partition is not mounted: %s", device)
+        return 0
 
     except Exception:
         logging.exception("Fatal error in check_if_mounted()")
@@ -63,7 +182,7 @@ def mount_partition(partition):
         if os.path.exists(partition):
             # check if partition is an existing block device
             if not stat.S_ISBLK(os.stat(partition).st_mode):
-                logging.error("partition is not a block device: " + partition)
+                logging.error("partition is not a block device: %s", partition)
                 return -1
             else:
                 logging.debug(
@@ -72,8 +191,13 @@ def mount_partition(partition):
                 # mount at automatic folder (accourding to the label)
                 ret = subprocess.check_output(["udiskie-mount", partition],
                                               stderr=subprocess.STDOUT).decode()
-                snip = ret.split()
-                return snip[3]  # return the mountpoint
+                logging.debug("udiskie-mount returned: %s", ret.strip())
+                # the mountpoint from the mount table (the output is not parsed, labels may contain spaces)
+                mountpoint = mount_table().mountpoint(partition)
+                if mountpoint is None:
+                    logging.error("partition not in the mount table after udiskie-mount: %s", partition)
+                    return -1
+                return mountpoint
         else:
             return -1
 
@@ -98,7 +222,7 @@ def umount(mountpoint):
         ret = subprocess.check_output(
             ["udiskie-umount", mountpoint], stderr=subprocess.STDOUT).decode()
         if ret.startswith("unmounted"):
-            logging.debug("udiskie-umount returned: " + ret)
+            logging.debug("udiskie-umount returned: %s", ret)
         else:
             logging.warning(
                 "umount(), udiskie-umount returned without unmounted")
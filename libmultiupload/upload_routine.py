@@ -2,20 +2,26 @@
 """
 Main processing and upload routine:
     1. check source against valid filetypes
-    2. generate thumbnails
-    3. zip original files
+    2. generate thumbnails (one per group of near-duplicates) and video proxies,
+       thumbnails of a streamed job (see analyze_source) while it is still copied
+    3. zip original files (volumes, uploaded to remote as soon as built),
+       without the metadata listed in remote_ftp.strip_metadata
     4. generate html file/table and send via email
-    5. ftps upload to remote and local server
+    5. upload to remote and local server (ftps, sftp, http or local backend),
+       the originals lose the metadata listed in local_ftp.strip_metadata before
     6. move to archive folder
 """
 
+import functools
 import logging
 import os
 import shutil
+import time
 from datetime import datetime
 
 # import local modules
-from libmultiupload import emailmod, ftps_mod, html_email, img_thumbnail
+from libmultiupload import (burst_groups, emailmod, fileops, html_email, job_history, job_state, jpeg_strip,
+                            move_files, profiling, progress, transfer, zip_volumes)
 
 
 # TODO
@@ -25,11 +31,12 @@ from libmultiupload import emailmod, ftps_mod, html_email, img_thumbnail
 # rework check if images have been uploaded (server remaining space check)
 
 
-def upload_routine(job_path, config):
+def upload_routine(job_path, config, status_queue=None):
     """
     Args:
         media_source: source folder or partition
         config: parsed config file
+        status_queue: queue for progress events to the webui (optional)
     returns:
         non zero on failure
     """
@@ -48,17 +55,79 @@ def upload_routine(job_path, config):
     job_dir = os.path.basename(os.path.normpath(job_path))
     image_path = os.path.join(job_path, "image")
 
-    # check if valid files are present
-    data_valid = False
-    filelist = os.listdir(image_path)
-    for entry in filelist:
-        if entry.lower().endswith(tuple(config["image"]["type"])):
-            data_valid = True
-            break
+    job_history.record_job(config, job_dir, status="processing", created=time.time(), started=time.time())
+
+    def job_error(subject, text):
+        """
+        Send an error email and record the error in the job history
+        """
+        emailmod.send_err(subject, text, config)
+        job_history.record_error(config, job_dir, subject + ": " + text)
+
+    # stages finished before a restart of the worker (see supervisor) are skipped
+    done_stages = job_state.done_stages(job_path)
+    if done_stages:
+        logging.info("continuing job %s, finished stages: %s", job_dir, sorted(done_stages))
+
+    def upload_target(target, localpath, filetype, enable_recursive, stage, record_done=True, session=None,
+                      remote_names=None):
+        """
+        Upload with the backend of a target (see transfer.py), timed and with progress,
+        the stage is recorded as finished (job_state) if record_done.
+        With a transfer.Session filetype is the list of files (relative to localpath) to upload,
+        uploaded as remote_names (if given).
+
+        Returns:
+            (0, "success") or (-1, error message)
+        """
+        if stage in done_stages:
+            logging.info("%s already finished, skipped", stage)
+            return 0, "success"
+        with profiling.stage(config, job_dir, stage):
+            prog = progress.from_config(status_queue, job_dir, "upload:" + target, config)
+            if session is not None:
+                ret_code, ret_msg = session.upload_files(localpath, filetype, prog, remote_names)
+            else:
+                ret_code, ret_msg = transfer.upload(config, target, localpath, filetype, job_dir, enable_recursive,
+                                                    prog)
+        job_history.record_target(config, job_dir, target, config[target]["backend"], stage, ret_code, ret_msg)
+        if ret_code == 0 and record_done:
+            job_state.mark_done(job_path, stage)
+        return ret_code, ret_msg
+
+    def wait_copy(ready):
+        """
+        Wait while the job is copied (config stream) until ready() is true, as stage "wait_copy":
+        a copy which does not finish in its deadline ends in the supervisor (error email, requeue)
+
+        Returns:
+            copy state (see job_state.copy_state)
+        """
+        copy_state = job_state.copy_state(job_path)
+        if copy_state != "copying" or ready():
+            return copy_state
+        with profiling.stage(config, job_dir, "wait_copy"):
+            while True:
+                time.sleep(config["stream"]["poll_s"])
+                # read before listing: once "done", the listing holds every file of the job
+                copy_state = job_state.copy_state(job_path)
+                if copy_state != "copying" or ready():
+                    return copy_state
+
+    def images_present():
+        return any(entry.lower().endswith(config["image"]["type"]) for entry in fileops.list_files(image_path))
+
+    # check if valid files are present (a streamed job: wait for the first image)
+    copy_state = wait_copy(images_present)
+    streamed = copy_state == "copying"
+    filelist = fileops.list_files(image_path)
+    data_valid = any(entry.lower().endswith(config["image"]["type"]) for entry in filelist)
 
     if not data_valid:
-        logging.error("No valid files found in: " + str(image_path))
-        logging.debug("content of dir: " + str(filelist))
+        logging.error("No valid files found in: %s", image_path)
+        logging.debug("content of dir: %s", filelist)
+        job_history.record_error(config, job_dir, "No valid files found in: " + image_path)
+        job_history.record_job(config, job_dir, status="failed", finished=time.time())
         return -1
 
     ############################
@@ -67,164 +136,318 @@ def upload_routine(job_path, config):
 
     # thumbnail path
     image_thumb_path = os.path.join(job_path, "image_thumb")
+    thumb_profile = None
+    thumb_types = config["image"]["type"]
 
-    # create thumbnails
     if config["image_thumbnail"]["enable"]:
+        # PIL is only imported if thumbnails are enabled
+        from libmultiupload import img_thumbnail
+
+        if config["image_thumbnail"]["profile"]:
+            thumb_profile = config["image_thumbnail"]["profiles"][config["image_thumbnail"]["profile"]]
+            # thumbnails may have another extension than the originals (screenshot.png -> screenshot.png.jpg)
+            thumb_types = thumb_types + (img_thumbnail.thumbnail_name("", thumb_profile),)
+
+    # create thumbnails
+    if config["image_thumbnail"]["enable"] and "thumbnail" not in done_stages:
         logging.debug("starting image thumb creation")
+        thumb_ok = True
+        source_bytes = 0
+        # a streamed job uploads its thumbnails in batches while copying (not if grouped,
+        # grouping needs all thumbnails), a failed batch is repeated by the regular upload
+        stream_upload = (streamed and config["remote_ftp"]["enable"] and not config["image_groups"]["enable"]
+                         and "upload_remote_thumb" not in done_stages)
+        stream_upload_ok = True
+        # one connection for all batches of the job
+        stream_session = transfer.Session(config, "remote_ftp", job_dir) if stream_upload else None
+        try:
+            with profiling.stage(config, job_dir, "thumbnail"):
+                thumb_progress = progress.from_config(status_queue, job_dir, "thumbnail", config)
+                processed = set()
+                while True:
+                    # read before listing: once "done", the listing holds every file of the job
+                    copy_state = job_state.copy_state(job_path)
+                    # relative paths, a merged job has subfolders (kept in image_thumb)
+                    img_list = [image for image in fileops.list_files(image_path)
+                                if image not in processed and not image.endswith(move_files.PARTIAL_SUFFIX)]
+                    processed.update(img_list)
+                    thumb_progress.add_total(len(img_list))
+                    for image in img_list:
+                        src_path = os.path.join(image_path, image)
+                        dest_path = os.path.join(image_thumb_path, image)
+                        retval = img_thumbnail.make_thumbnail(src_path, dest_path,
+                                                              config["image"]["type"],
+                                                              config["image_thumbnail"]["size_px"],
+                                                              thumb_profile)
+                        source_bytes += os.path.getsize(src_path)
+                        thumb_progress.update(1, os.path.getsize(src_path))
+
+                        if retval != 0:
+                            moveto_archive = False
+                            thumb_ok = False
+                            logging.error("make_thumbnail returned an error")
+                            job_error("make_thumbnail returned error", "see logfile")
+                        else:
+                            logging.debug("processed successfull: %s", dest_path)
+
+                    # exactly the thumbnails of this batch (a failed thumbnail is missing)
+                    batch = []
+                    if stream_upload:
+                        batch = [thumb for thumb in (img_thumbnail.thumbnail_name(image, thumb_profile)
+                                                     for image in img_list)
+                                 if os.path.isfile(os.path.join(image_thumb_path, thumb))]
+                    if batch:
+                        ret_code, ret_msg = upload_target("remote_ftp", image_thumb_path, batch, True,
+                                                          "upload_remote_thumb", record_done=False,
+                                                          session=stream_session)
+                        if ret_code != 0:
+                            logging.warning("streamed thumbnail upload failed, repeated after the copy: %s", ret_msg)
+                            stream_upload_ok = False
+                    if copy_state != "copying":
+                        break
+                    if not img_list:
+                        time.sleep(config["stream"]["poll_s"])
+        finally:
+            if stream_session is not None:
+                stream_session.close()
+        thumb_progress.finish()
+        if stream_upload and stream_upload_ok and thumb_ok:
+            job_state.mark_done(job_path, "upload_remote_thumb")
+            done_stages.add("upload_remote_thumb")
+        if os.path.isdir(image_thumb_path):
+            thumb_bytes = sum(os.path.getsize(os.path.join(image_thumb_path, thumb))
+                              for thumb in fileops.list_files(image_thumb_path))
+            logging.info("thumbnails: %d bytes from %d bytes of originals (profile %s)",
+                         thumb_bytes, source_bytes, config["image_thumbnail"]["profile"] or "source")
+            job_history.record_job(config, job_dir, thumb_bytes=thumb_bytes)
+        if thumb_ok:
+            job_state.mark_done(job_path, "thumbnail")
+
+    # everything below needs all files of the job
+    copy_state = wait_copy(lambda: False)
+    if copy_state == "aborted":
+        logging.error("copy of job %s aborted, job left in temp_path", job_dir)
+        job_error("copy of job {} aborted".format(job_dir), "the source is copied again, see logfile")
+        job_history.record_job(config, job_dir, status="failed", finished=time.time())
+        return -1
 
-        img_list = os.listdir(image_path)
-        for image in img_list:
-            src_path = os.path.join(image_path, image)
-            dest_path = os.path.join(image_thumb_path, image)
-            retval = img_thumbnail.make_thumbnail(src_path, dest_path,
-                                                  config["image"]["type"],
-                                                  config["image_thumbnail"]["size_px"])
+    # collapse bursts/near-duplicates: one thumbnail per group in the email and on remote_ftp
+    image_similar_path = os.path.join(job_path, "image_thumb_similar")
+    similar_counts = {}
 
-            if retval != 0:
-                moveto_archive = False
-                logging.error("make_thumbnail returned an error")
-                emailmod.send_err(
-                    "make_thumbnail returned error", "see logfile", config)
+    if config["image_thumbnail"]["enable"] and config["image_groups"]["enable"]:
+        if "group" in done_stages:
+            similar_counts = burst_groups.load_groups(image_similar_path)
+        else:
+            with profiling.stage(config, job_dir, "group"):
+                similar_counts = burst_groups.collapse_thumbnails(image_thumb_path, image_similar_path,
+                                                                  thumb_types,
+                                                                  config["image_groups"]["max_distance"])
+            if similar_counts == -1:
+                # not fatal, all thumbnails are kept
+                similar_counts = {}
+                job_history.record_error(config, job_dir, "collapse_thumbnails returned error")
             else:
-                logging.debug("processed successfull: " + dest_path)
+                job_state.mark_done(job_path, "group")
+
+    # video proxies (web version of the originals)
+    video_path = os.path.join(job_path, "video")
+    video_thumb_path = os.path.join(job_path, "video_thumb")
+
+    if config["video_thumbnail"]["enable"] and os.path.isdir(video_path) and "transcode" not in done_stages:
+        logging.debug("starting video proxy creation")
+        from libmultiupload import video_transcode
+
+        with profiling.stage(config, job_dir, "transcode"):
+            failed = video_transcode.make_proxies(video_path, video_thumb_path, config["video"]["type"],
+                                                  config["video_thumbnail"],
+                                                  progress.from_config(status_queue, job_dir, "transcode", config))
+        if failed:
+            moveto_archive = False
+            logging.error("make_proxies failed for %d video(s)", failed)
+            job_error("make_proxies returned error", "see logfile")
+        else:
+            job_state.mark_done(job_path, "transcode")
 
     ##########################################################################
     # create archive
     ##########################################################################
 
-    def makezip(sourcepath, destarchive):
-        """
-        Create ZIP archive from original images
+    # create archive (volumes) of the original images, every finished volume
+    # is uploaded to remote_ftp while the remaining volumes are still built
 
-        Args:
-            sourcepath: path to the original files (local, not SD card!)
-            destpath: dest path and name of the ZIP archive
+    archive_names = []
+    zip_upload_errors = []
 
-        Returns:
-            0 if everything is ok
-            -1 in the event of an error
+    def upload_volume(volume_path):
         """
-
-        logging.debug("Entered makezip()")
-        try:
-            if os.path.exists(sourcepath):
-                shutil.make_archive(destarchive, format="zip",
-                                    root_dir=sourcepath, logger=logging)
-                logging.info("Created archive: %s", destarchive)
-            else:
-                logging.error(
-                    "Cannot make compressed archive, path does not exist: %s", sourcepath)
-                return -1
-
-        except Exception:
-            logging.exception("Fatal error in makezip()")
-        return 0
-
-    # create archive of the original images
-    #
-    #
-    # check if zip name already exists
-
-    if config["image"]["enable"]:
-        image_archive_name = job_dir
-        # image_archive_path = os.path.join(
-        #    config["temp_path"], job_dir, image_archive_name)
-        image_archive_path = os.path.join(job_path, image_archive_name)
+        Upload one finished archive volume to remote_ftp
+        """
+        if not config["remote_ftp"]["enable"]:
+            return
+        volume_name = os.path.basename(volume_path)
+        logging.info("Starting upload of archive volume: %s", volume_name)
+        # the full file name as filetype only matches this volume (matched against the lowercase name)
+        ret_code, ret_msg = upload_target("remote_ftp", job_path, (volume_name.lower(),), False,
+                                          "upload_remote_zip_" + os.path.splitext(volume_name)[0])
+        if ret_code != 0:
+            zip_upload_errors.append(ret_msg)
+
+    if config["image"]["enable"] and "zip" in done_stages:
+        # volumes were built before a restart, upload the remaining ones
+        archive_names = sorted(name for name in os.listdir(job_path)
+                               if name == job_dir + ".zip" or
+                               (name.startswith(job_dir + ".part") and name.endswith(".zip")))
+        for volume_name in archive_names:
+            upload_volume(os.path.join(job_path, volume_name))
+
+    elif config["image"]["enable"]:
+        image_archive_path = os.path.join(job_path, job_dir)
         logging.debug("creating archive of original images")
-        makezip(image_path, image_archive_path)
+        # the archive is what remote_ftp gets of the originals: metadata removed while zipping
+        strip_transform = None
+        if config["remote_ftp"]["enable"] and config["remote_ftp"]["strip_metadata"]:
+            strip_transform = functools.partial(jpeg_strip.read_stripped,
+                                                categories=config["remote_ftp"]["strip_metadata"])
+        with profiling.stage(config, job_dir, "zip"):
+            volumes = zip_volumes.make_volumes(image_path, image_archive_path,
+                                               config["zip"]["volume_mb"] * 1024 * 1024,
+                                               config["zip"]["workers"],
+                                               progress.from_config(status_queue, job_dir, "zip", config),
+                                               upload_volume, strip_transform)
+        if volumes == -1:
+            moveto_archive = False
+            job_error("make_volumes returned error", "see logfile")
+        else:
+            archive_names = [os.path.basename(volume) for volume in volumes]
+            job_state.mark_done(job_path, "zip")
 
     ############
     # send email
     ############
 
-    if config["email"]["enable"]:
+    if config["email"]["enable"] and "email" in done_stages:
+        logging.info("email sent before restart, skipped")
+
+    elif config["email"]["enable"]:
         logging.debug("Start sending email")
-        try:
-            # generate and save html text
-            html_text = html_email.email_text_html(config, config["email"]["header_html"],
-                                                   config["email"][
-                                                       "footer_html"],
-                                                   config["email"]["weblink"],
-                                                   image_thumb_path, job_dir)
-            htmlfile = config["temp_path"] + job_dir + "/" + job_dir + "_email.html"
-
-            with open(htmlfile, "w+") as fh:
-                fh.write(html_text)
-
-            email_ret = emailmod.send(config["email"]["sender"],
-                                      config["email"]["recipient"],
-                                      config["email"]["recipient_cc"],
-                                      config["email"]["recipient_bcc"],
-                                      'Fotoupload ' + job_dir, "", html_text)
-            if email_ret != 0:
-                emailmod.send_err("fatal error while sending html email", str(email_ret), config)
-
-        except Exception:
-            logging.exception("Error creating and saving HTML email file")
+        with profiling.stage(config, job_dir, "email"):
+            try:
+                # generate and save html text
+                html_text = html_email.email_text_html(config, config["email"]["header_html"],
+                                                       config["email"][
+                                                           "footer_html"],
+                                                       config["email"]["weblink"],
+                                                       image_thumb_path, job_dir, video_thumb_path,
+                                                       archive_names, similar_counts)
+                htmlfile = os.path.join(job_path, job_dir + "_email.html")
+
+                with open(htmlfile, "w+") as fh:
+                    fh.write(html_text)
+
+                email_ret = emailmod.send(config["email"]["sender"],
+                                          config["email"]["recipient"],
+                                          config["email"]["recipient_cc"],
+                                          config["email"]["recipient_bcc"],
+                                          'Fotoupload ' + job_dir, "", html_text,
+                                          config["smtp"]["host"], config["smtp"]["port"],
+                                          config["smtp"]["timeout_s"])
+                if email_ret != 0:
+                    job_error("fatal error while sending html email", str(email_ret))
+                else:
+                    job_state.mark_done(job_path, "email")
+
+            except Exception:
+                logging.exception("Error creating and saving HTML email file")
 
     else:
         logging.info("Email disabled")
 
     ############
-    # ftps upload
+    # upload
     ############
 
-    # upload thumbnail images and archive of original images to remote ftps server
+    # upload thumbnail images and archive of original images to remote server
     if config["remote_ftp"]["enable"]:
 
         # upload webversion images
         if config["image_thumbnail"]["enable"]:
             logging.info("Starting thumbnails upload")
 
-            ret_code, ret_msg = ftps_mod.ftpsupload(config, image_thumb_path,
-                                                    config["image"]["type"],
-                                                    config["remote_ftp"]["target_dir"],
-                                                    job_dir, False,
-                                                    config["remote_ftp"]["username"],
-                                                    config["remote_ftp"]["password"],
-                                                    config["remote_ftp"]["ftp"])
+            ret_code, ret_msg = upload_target("remote_ftp", image_thumb_path, thumb_types,
+                                              True, "upload_remote_thumb")
 
             # disable moving folder into archive dir if error occoured
             if ret_code != 0:
-                logging.error(
-                    "ftpsupload_recoursive returned with: " + ret_msg)
-                emailmod.send_err("fatal error in ftps_module",
-                                  str(ret_msg), config)
+                logging.error("upload returned with: %s", ret_msg)
+                job_error("fatal error in upload to remote_ftp", str(ret_msg))
                 moveto_archive = False
         else:
             logging.info(
                 "Can not upload thumbnails, thumbnails creation disabled")
 
-        # upload zip archive of original images
-        ret_code, ret_msg = ftps_mod.ftpsupload(config,
-                                                config["temp_path"] + job_dir, ".zip",
-                                                config["remote_ftp"]["target_dir"],
-                                                job_dir, False,
-                                                config["remote_ftp"]["username"],
-                                                config["remote_ftp"]["password"],
-                                                config["remote_ftp"]["ftp"])
+        # upload video proxies
+        if config["video_thumbnail"]["enable"] and os.path.isdir(video_thumb_path):
+            logging.info("Starting video proxy upload")
 
-        # disable moving folder into archive dir if error occoured
-        if ret_code != 0:
-            logging.error("ftpsupload_recoursive returned with: " + ret_msg)
-            emailmod.send_err("fatal error in ftp_module", str(ret_msg), config)
+            ret_code, ret_msg = upload_target("remote_ftp", video_thumb_path,
+                                              (config["video_thumbnail"]["extension"].lower(),),
+                                              True, "upload_remote_video")
+
+            if ret_code != 0:
+                logging.error("upload returned with: %s", ret_msg)
+                job_error("fatal error in upload to remote_ftp", str(ret_msg))
+                moveto_archive = False
+
+        # zip archive volumes were uploaded as soon as they were built
+        for ret_msg in zip_upload_errors:
+            logging.error("upload returned with: %s", ret_msg)
+            job_error("fatal error in upload to remote_ftp", str(ret_msg))
             moveto_archive = False
 
-    # upload complete job folder recursively to local FTP server
-    if config["local_ftp"]["enable"]:
-        ret_code, ret_msg = ftps_mod.ftpsupload(config, config["temp_path"] + job_dir,
-                                                config["local_ftp"]["type"],
-                                                config["local_ftp"]["target_dir"],
-                                                job_dir, True,
-                                                config["local_ftp"]["username"],
-                                                config["local_ftp"]["password"],
-                                                config["local_ftp"]["ftp"])
+    # copy of the originals without metadata for local_ftp (the archived originals keep it)
+    stripped_path = os.path.join(job_path, "image_stripped")
+    strip_ok = True
+    if config["local_ftp"]["enable"] and config["local_ftp"]["strip_metadata"] and "strip" not in done_stages:
+        with profiling.stage(config, job_dir, "strip"):
+            broken = jpeg_strip.strip_tree(image_path, stripped_path, config["local_ftp"]["strip_metadata"],
+                                           config["metadata_strip"]["workers"],
+                                           progress.from_config(status_queue, job_dir, "strip", config))
+        if broken == -1:
+            strip_ok = False
+            moveto_archive = False
+            job_error("strip_tree returned error", "originals not uploaded to local_ftp, see logfile")
+        else:
+            if broken:
+                # missing from the copy: never uploaded with their metadata, the rest of the job is
+                job_history.record_error(config, job_dir, "metadata not removed, not uploaded to local_ftp: " +
+                                         ", ".join(broken))
+            job_state.mark_done(job_path, "strip")
+
+    # upload complete job folder recursively to local archive server
+    if config["local_ftp"]["enable"] and strip_ok:
+        if config["local_ftp"]["strip_metadata"]:
+            # the stripped copies are uploaded in place of the originals
+            others = [name for name in fileops.list_files(job_path, config["local_ftp"]["type"])
+                      if not name.startswith(("image" + os.sep, "image_stripped" + os.sep))]
+            stripped = fileops.list_files(stripped_path, config["local_ftp"]["type"])
+            files = others + [os.path.join("image_stripped", name) for name in stripped]
+            remote_names = others + [os.path.join("image", name) for name in stripped]
+            local_session = transfer.Session(config, "local_ftp", job_dir)
+            try:
+                ret_code, ret_msg = upload_target("local_ftp", job_path, files, True, "upload_local",
+                                                  session=local_session, remote_names=remote_names)
+            finally:
+                local_session.close()
+        else:
+            ret_code, ret_msg = upload_target("local_ftp", job_path, config["local_ftp"]["type"],
+                                              True, "upload_local")
 
         # disable moving folder into archive dir if error occoured
         if ret_code != 0:
-            logging.error(
-                "ftpsupload_recoursive returned with: " + str(ret_msg))
-            logging.error("ftp returned with an ERROR")
+            logging.error("upload returned with: %s", ret_msg)
+            logging.error("upload to local_ftp returned with an ERROR")
+            job_history.record_error(config, job_dir, "upload to local_ftp: " + str(ret_msg))
             moveto_archive = False
 
     #################
@@ -238,11 +461,23 @@ def upload_routine(job_path, config):
     if moveto_archive:
         logging.info("moving to archive")
         try:
-            shutil.move(config["temp_path"] + job_dir, config["archive_path"] + job_dir)
-        except Exception:
+            # the stripped copies are not archived
+            if os.path.exists(stripped_path):
+                shutil.rmtree(stripped_path)
+            # rename if temp_path and archive_path share a filesystem, copy only otherwise
+            with profiling.stage(config, job_dir, "archive"):
+                fileops.move_tree(job_path, os.path.join(config["archive_path"], job_dir))
+            job_state.clear(job_path)
+        except Exception as exceptmsg:
             logging.exception("Fatal Error moving job folder to archive")
+            job_error("Error moving job {} to archive".format(job_dir), str(exceptmsg))
+            job_history.record_job(config, job_dir, status="failed", finished=time.time())
+            return -1
     else:
-        logging.info("Folder was not moved to archive! Clean up folder: " + config["temp_path"] + job_dir)
-        emailmod.send_err("Error while processing job: " + job_dir, str(email_ret), config)
+        logging.info("Folder was not moved to archive! Clean up folder: %s", job_path)
+        emailmod.send_err("Error while processing job: " + job_dir, "see logfile", config)
+        job_history.record_job(config, job_dir, status="failed", finished=time.time())
+        return -1
 
+    job_history.record_job(config, job_dir, status="done", finished=time.time())
     return 0
@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+"""
+Create web proxies of the original videos with ffmpeg:
+    1. skip videos whose proxy is newer than the original (already up to date)
+    2. transcode the others in a bounded pool (video_thumbnail.workers ffmpeg processes)
+    3. parse the ffmpeg progress output, kill ffmpeg after video_thumbnail.timeout_s
+The proxy is written to a hidden temporary name (.<name>.part, not matched by the video
+types) and renamed when finished, so an aborted transcode is never taken for an up to date
+proxy. ffmpeg runs in the process group of the worker, the supervisor kills it together
+with a hung worker.
+"""
+import concurrent.futures
+import logging
+import os
+import subprocess
+import threading
+
+from libmultiupload import fileops
+
+# ffmpeg output formats of the proxy extensions (the temporary name has no extension)
+OUTPUT_FORMATS = {".m4v": "mp4", ".mkv": "matroska", ".ts": "mpegts"}
+
+
+def probe_duration(ffprobe, src_path):
+    """
+    Return the duration of a media file in seconds, None if unknown
+    """
+    try:
+        output = subprocess.run([ffprobe, "-v", "error", "-show_entries", "format=duration",
+                                 "-of", "default=noprint_wrappers=1:nokey=1", src_path],
+                                stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                                universal_newlines=True, timeout=30).stdout
+        return float(output.strip())
+    except (OSError, ValueError, subprocess.TimeoutExpired):
+        return None
+
+
+def proxy_up_to_date(src_path, dest_path):
+    """
+    True if the proxy exists and is not older than the original
+    """
+    try:
+        return os.stat(dest_path).st_mtime >= os.stat(src_path).st_mtime
+    except FileNotFoundError:
+        return False
+
+
+def make_proxy(src_path, dest_path, video_config, prog=None):
+    """
+    Transcode one video with ffmpeg (blocks until finished or timed out)
+
+    Args:
+        src_path: original video
+        dest_path: path of the proxy
+        video_config: video_thumbnail section of the config
+        prog: progress.Progress object, receives the bytes of the original
+              proportional to the transcoded duration (optional)
+
+    Returns:
+        0 if the proxy was created or was up to date
+        -1 in the event of an error
+    """
+    if proxy_up_to_date(src_path, dest_path):
+        logging.info("proxy up to date, skipped: %s", dest_path)
+        if prog is not None:
+            prog.update(1, os.path.getsize(src_path))
+        return 0
+
+    src_size = os.path.getsize(src_path)
+    duration = probe_duration(video_config["ffprobe"], src_path)
+    dest_dir, dest_name = os.path.split(dest_path)
+    tmp_path = os.path.join(dest_dir, "." + dest_name + ".part")
+    extension = os.path.splitext(dest_name)[1].lower()
+    output_format = OUTPUT_FORMATS.get(extension, extension.lstrip("."))
+    cmd = ([video_config["ffmpeg"], "-hide_banner", "-nostdin", "-y", "-i", src_path] +
+           video_config["ffmpeg_args"] + ["-progress", "pipe:1", "-nostats", "-f", output_format, tmp_path])
+    logging.debug("ffmpeg: %s", cmd)
+
+    try:
+        proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                                universal_newlines=True)
+    except OSError:
+        logging.exception("could not start ffmpeg")
+        return -1
+
+    # readline() blocks while ffmpeg hangs, the timer kills it
+    timed_out = threading.Event()
+
+    def kill():
+        timed_out.set()
+        proc.kill()
+    timer = threading.Timer(video_config["timeout_s"], kill)
+    timer.start()
+
+    reported = 0
+    try:
+        for line in proc.stdout:
+            key, _, value = line.strip().partition("=")
+            # out_time_us (out_time_ms in older versions, also microseconds)
+            if key in ("out_time_us", "out_time_ms") and duration and prog is not None:
+                try:
+                    done = min(int(value) / 1e6 / duration, 1.0)
+                except ValueError:
+                    continue
+                nbytes = int(src_size * done)
+                if nbytes > reported:
+                    prog.update(0, nbytes - reported)
+                    reported = nbytes
+        ret = proc.wait()
+    finally:
+        timer.cancel()
+        proc.stdout.close()
+        if proc.poll() is None:
+            # error while reading the progress
+            proc.kill()
+            proc.wait()
+
+    if prog is not None:
+        prog.update(1, src_size - reported)
+
+    if timed_out.is_set() or ret != 0:
+        if timed_out.is_set():
+            logging.error("ffmpeg timed out after %ss: %s", video_config["timeout_s"], src_path)
+        else:
+            logging.error("ffmpeg returned %s: %s", ret, src_path)
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        return -1
+
+    os.replace(tmp_path, dest_path)
+    logging.info("created proxy: %s", dest_path)
+    return 0
+
+
+def make_proxies(video_path, proxy_path, video_types, video_config, prog=None):
+    """
+    Create the proxies of all videos in a folder in parallel
+
+    Args:
+        video_path: folder of the original videos
+        proxy_path: folder for the proxies (created if necessary)
+        video_types: list of video file extensions
+        video_config: video_thumbnail section of the config
+        prog: progress.Progress object of this stage (optional)
+
+    Returns:
+        number of failed videos
+    """
+    # relative paths, the proxies of a merged job keep its subfolders
+    videos = fileops.list_files(video_path, video_types)
+    if not videos:
+        return 0
+    if prog is not None:
+        prog.add_total(len(videos), sum(os.path.getsize(os.path.join(video_path, video)) for video in videos))
+
+    failed = 0
+    with concurrent.futures.ThreadPoolExecutor(max_workers=video_config["workers"]) as pool:
+        futures = []
+        for video in videos:
+            dest_path = os.path.join(proxy_path, os.path.splitext(video)[0] + video_config["extension"])
+            os.makedirs(os.path.dirname(dest_path), exist_ok=True)
+            futures.append(pool.submit(make_proxy, os.path.join(video_path, video), dest_path, video_config,
+                                       prog))
+        for future in futures:
+            if future.result() != 0:
+                failed += 1
+    if prog is not None:
+        prog.finish()
+    return failed
@@ -0,0 +1,267 @@
+#!/usr/bin/env python3
+"""
+Watch a drop folder (config "default_source_path") with inotify and feed completed batches
+to the analyzer:
+    1. watch the folder and all subfolders (new subfolders are added on creation)
+    2. track every new/changed file incrementally from the events (no rescans)
+    3. a file is complete once its writer closed it (IN_CLOSE_WRITE / IN_MOVED_TO)
+       and its size is stable for watch.settle_s seconds
+    4. once the folder is quiet for watch.batch_quiet_s seconds, all complete files are
+       moved into a new batch folder below watch.staging_path, which is submitted to the analyzer
+       (it moves the files on into the job and removes the batch, see analyze_source)
+    5. batches not accepted by the analyzer (queue full) are submitted again with every poll,
+       batches left in staging_path by an earlier run are submitted again at startup
+Linux only (inotify via ctypes, no additional dependency).
+"""
+import ctypes
+import ctypes.util
+import errno
+import logging
+import os
+import select
+import struct
+import time
+from datetime import datetime
+
+from libmultiupload import fileops
+
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+
+WATCH_MASK = (IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO |
+              IN_CREATE | IN_DELETE | IN_DELETE_SELF)
+
+_EVENT_HEADER = struct.Struct("iIII")
+
+
+class Inotify:
+    """
+    Minimal inotify wrapper (ctypes)
+    """
+
+    def __init__(self):
+        self.libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        self.fd = self.libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+
+    def add_watch(self, path, mask=WATCH_MASK):
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(path), mask)
+        if wd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_add_watch failed: " + path)
+        return wd
+
+    def read_events(self, timeout):
+        """
+        Wait up to timeout seconds for events
+
+        Returns:
+            list of (wd, mask, cookie, name)
+        """
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return []
+        try:
+            buf = os.read(self.fd, 64 * 1024)
+        except OSError as exceptmsg:
+            if exceptmsg.errno == errno.EAGAIN:
+                return []
+            raise
+        events = []
+        offset = 0
+        while offset < len(buf):
+            wd, mask, cookie, length = _EVENT_HEADER.unpack_from(buf, offset)
+            offset += _EVENT_HEADER.size
+            name = os.fsdecode(buf[offset:offset + length].rstrip(b"\0"))
+            offset += length
+            events.append((wd, mask, cookie, name))
+        return events
+
+    def close(self):
+        os.close(self.fd)
+
+
+class WatchFolder:
+    """
+    Incremental state of a watched drop folder
+
+    Args:
+        path: drop folder
+        settle_s: a closed file must keep its size for this time to be complete
+        quiet_s: a batch is released if no event occured for this time
+    """
+
+    def __init__(self, path, settle_s, quiet_s):
+        self.path = path
+        self.settle_s = settle_s
+        self.quiet_s = quiet_s
+        self.inotify = Inotify()
+        self.watches = {}       # wd -> folder
+        self.pending = {}       # file path -> [closed, size, last event time]
+        self.last_event = time.monotonic()
+        self.add_tree(path)
+
+    def add_tree(self, folder):
+        """
+        Watch a folder and its subfolders, files already present are pending (closed)
+        """
+        self.watches[self.inotify.add_watch(folder)] = folder
+        for entry in os.scandir(folder):
+            if entry.is_dir(follow_symlinks=False):
+                self.add_tree(entry.path)
+            elif entry.is_file(follow_symlinks=False):
+                self.pending[entry.path] = [True, entry.stat().st_size, time.monotonic()]
+
+    def handle_event(self, wd, mask, name):
+        now = time.monotonic()
+        self.last_event = now
+
+        if mask & IN_Q_OVERFLOW:
+            # events were lost, only now the tree has to be scanned again
+            logging.warning("watch: inotify queue overflow, rescanning %s", self.path)
+            for wd_old in list(self.watches):
+                self.inotify.libc.inotify_rm_watch(self.inotify.fd, wd_old)
+            self.watches = {}
+            self.add_tree(self.path)
+            return
+        if mask & IN_IGNORED:
+            self.watches.pop(wd, None)
+            return
+
+        folder = self.watches.get(wd)
+        if folder is None or not name:
+            return
+        path = os.path.join(folder, name)
+
+        if mask & IN_ISDIR:
+            if mask & (IN_CREATE | IN_MOVED_TO):
+                logging.debug("watch: new folder %s", path)
+                self.add_tree(path)
+            return
+
+        if mask & (IN_DELETE | IN_MOVED_FROM):
+            self.pending.pop(path, None)
+            return
+
+        state = self.pending.setdefault(path, [False, -1, now])
+        state[2] = now
+        if mask & (IN_CLOSE_WRITE | IN_MOVED_TO):
+            state[0] = True
+            try:
+                state[1] = os.stat(path).st_size
+            except FileNotFoundError:
+                del self.pending[path]
+        elif mask & (IN_CREATE | IN_MODIFY):
+            state[0] = False
+
+    def complete_files(self):
+        """
+        Return the pending files which are closed and have a stable size,
+        [] if a closed file is not settled yet (keep the batch together)
+        """
+        now = time.monotonic()
+        complete = []
+        for path, state in list(self.pending.items()):
+            closed, size, last_change = state
+            if not closed:
+                # still open by a writer, stays pending for the next batch
+                continue
+            if now - last_change < self.settle_s:
+                return []
+            try:
+                current_size = os.stat(path).st_size
+            except FileNotFoundError:
+                del self.pending[path]
+                continue
+            if current_size != size:
+                # still growing, check again after settle_s
+                state[1] = current_size
+                state[2] = now
+                return []
+            complete.append(path)
+        return complete
+
+    def poll(self, timeout):
+        """
+        Process events for up to timeout seconds
+
+        Returns:
+            list of complete files if the folder is quiet, otherwise []
+        """
+        for wd, mask, _, name in self.inotify.read_events(timeout):
+            self.handle_event(wd, mask, name)
+        if not self.pending or time.monotonic() - self.last_event < self.quiet_s:
+            return []
+        batch = self.complete_files()
+        for path in batch:
+            del self.pending[path]
+        return batch
+
+    def close(self):
+        self.inotify.close()
+
+
+def stage_batch(drop_path, batch, staging_path, timestamp_format):
+    """
+    Move a batch of files (keeping subfolders) into a new folder below staging_path
+
+    Returns:
+        path to the batch folder
+    """
+    batch_dir = os.path.join(staging_path, datetime.now().strftime(timestamp_format))
+    counter = 1
+    while os.path.exists(batch_dir):
+        batch_dir = os.path.join(staging_path, datetime.now().strftime(timestamp_format) + "_" + str(counter))
+        counter += 1
+    for path in batch:
+        dest = os.path.join(batch_dir, os.path.relpath(path, drop_path))
+        if not os.path.exists(os.path.dirname(dest)):
+            os.makedirs(os.path.dirname(dest))
+        fileops.move_file(path, dest)
+    return batch_dir
+
+
+def watch(submit, config, stop_event=None):
+    """
+    Watch config["default_source_path"] and submit completed batches to the analyzer
+    (blocks, run in a thread, returns when stop_event is set)
+
+    Args:
+        submit: function queueing a source, returns False if the queue is full (retried)
+        config: parsed json config file
+        stop_event: threading.Event to stop watching (optional)
+    """
+    drop_path = config["default_source_path"]
+    staging_path = config["watch"]["staging_path"]
+    if not os.path.exists(staging_path):
+        os.makedirs(staging_path)
+
+    # batches waiting for the analyzer (in order), also those of an earlier run
+    waiting = sorted(entry.path for entry in os.scandir(staging_path) if entry.is_dir())
+    if waiting:
+        logging.info("watch: %d staged batch(es) of an earlier run queued again", len(waiting))
+
+    folder = WatchFolder(drop_path, config["watch"]["settle_s"], config["watch"]["batch_quiet_s"])
+    logging.info("watching drop folder: %s", drop_path)
+    try:
+        while stop_event is None or not stop_event.is_set():
+            batch = folder.poll(0.5)
+            if batch:
+                batch_dir = stage_batch(drop_path, batch, staging_path, config["timestamp"])
+                logging.info("watch: batch of %d files -> %s", len(batch), batch_dir)
+                waiting.append(batch_dir)
+            # queue full: the batches wait in staging_path, retried after the next poll
+            # (the drop folder is watched meanwhile)
+            while waiting and submit(waiting[0]):
+                waiting.pop(0)
+    finally:
+        folder.close()
@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+"""
+ZIP archive of the original files, split into volumes:
+    1. distribute the files (sorted) into volumes of at most zip.volume_mb (0: one volume)
+    2. build the volumes in parallel (zlib releases the GIL, threads are sufficient)
+    3. hand every finished volume to a callback (e.g. upload) while the others are still built
+An optional transform replaces the content of files in the archive (e.g. metadata removed
+by jpeg_strip) or leaves them out, the original files are not changed.
+Every volume is a complete zip file on its own (<job>.part01.zip, ...), a single volume
+is named <job>.zip as before.
+"""
+import concurrent.futures
+import logging
+import os
+import zipfile
+
+
+def plan_volumes(files, limit_bytes):
+    """
+    Split a list of (path, size) into volumes, keeping the order
+
+    Args:
+        files: list of (path, size)
+        limit_bytes: maximum size of a volume (0: no limit), bigger files get their own volume
+
+    Returns:
+        list of lists of (path, size)
+    """
+    volumes = []
+    current = []
+    current_size = 0
+    for path, size in files:
+        if current and limit_bytes and current_size + size > limit_bytes:
+            volumes.append(current)
+            current = []
+            current_size = 0
+        current.append((path, size))
+        current_size += size
+    if current:
+        volumes.append(current)
+    return volumes
+
+
+def volume_names(archive_base, count):
+    """
+    Return the file names of count volumes of archive_base (path without .zip)
+    """
+    if count == 1:
+        return [archive_base + ".zip"]
+    return ["{}.part{:02d}.zip".format(archive_base, nr) for nr in range(1, count + 1)]
+
+
+def build_volume(sourcepath, files, volume_path, prog=None, transform=None):
+    """
+    Write one volume (paths inside the archive are relative to sourcepath),
+    transform(path) returns the content to archive instead of the file (None: the file,
+    False: leave the file out)
+
+    Returns:
+        volume_path
+    """
+    # temporary name: an aborted volume is never uploaded or archived as complete
+    tmp_path = volume_path + ".part"
+    with zipfile.ZipFile(tmp_path, "w", zipfile.ZIP_DEFLATED) as archive:
+        for path, size in files:
+            data = transform(path) if transform is not None else None
+            if data is None:
+                archive.write(path, os.path.relpath(path, sourcepath))
+            elif data is not False:
+                info = zipfile.ZipInfo.from_file(path, os.path.relpath(path, sourcepath))
+                info.compress_type = zipfile.ZIP_DEFLATED
+                archive.writestr(info, data)
+            if prog is not None:
+                prog.update(1, size)
+    os.replace(tmp_path, volume_path)
+    logging.info("Created archive volume: %s", volume_path)
+    return volume_path
+
+
+def make_volumes(sourcepath, archive_base, limit_bytes, workers, prog=None, on_done=None, transform=None):
+    """
+    Create the archive volumes of a folder in parallel
+
+    Args:
+        sourcepath: path to the original files (local, not SD card!)
+        archive_base: dest path and name of the archive (without .zip)
+        limit_bytes: maximum size of the original files per volume (0: one volume)
+        workers: number of volumes built at the same time
+        prog: progress.Progress object (optional)
+        on_done: called with the path of every finished volume, in order of completion,
+                 while the remaining volumes are still built (optional)
+        transform: content of a file in the archive, see build_volume() (optional)
+
+    Returns:
+        list of volume paths (in order), -1 in the event of an error
+    """
+    logging.debug("Entered make_volumes()")
+    if not os.path.exists(sourcepath):
+        logging.error("Cannot make compressed archive, path does not exist: %s", sourcepath)
+        return -1
+
+    files = []
+    for dirpath, _, filenames in os.walk(sourcepath):
+        for filename in sorted(filenames):
+            path = os.path.join(dirpath, filename)
+            files.append((path, os.path.getsize(path)))
+    volumes = plan_volumes(files, limit_bytes)
+    names = volume_names(archive_base, len(volumes))
+    if prog is not None:
+        prog.add_total(len(files), sum(size for _, size in files))
+
+    try:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as pool:
+            futures = [pool.submit(build_volume, sourcepath, volume, name, prog, transform)
+                       for volume, name in zip(volumes, names)]
+            for future in concurrent.futures.as_completed(futures):
+                volume_path = future.result()
+                if on_done is not None:
+                    on_done(volume_path)
+    except Exception:
+        logging.exception("Fatal error in make_volumes()")
+        return -1
+
+    if prog is not None:
+        prog.finish()
+    logging.info("Created archive: %s (%d volume(s))", archive_base, len(names))
+    return names
@@ -0,0 +1,55 @@
+"""
+Shared fixtures: stand-in servers (standin_servers) and small job folders
+"""
+import os
+import shutil
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from libmultiupload import standin_servers  # noqa: E402
+
+
+@pytest.fixture(scope="session")
+def tls_cert(tmp_path_factory):
+    if shutil.which("openssl") is None:
+        pytest.skip("openssl required for the stand-in FTPS server")
+    return standin_servers.make_selfsigned_cert(str(tmp_path_factory.mktemp("tls")))
+
+
+@pytest.fixture
+def ftp_server(tmp_path, tls_cert):
+    server = standin_servers.StandinFTPServer(str(tmp_path / "ftp"), certfile=tls_cert[0], keyfile=tls_cert[1])
+    server.start()
+    os.makedirs(os.path.join(server.root, "upload"))
+    yield server
+    server.stop()
+
+
+@pytest.fixture
+def job_folder(tmp_path):
+    """
+    A job folder with images (one in a subfolder, one with an uppercase extension) and a text file
+    """
+    path = tmp_path / "job"
+    (path / "sub").mkdir(parents=True)
+    (path / "a.jpg").write_bytes(os.urandom(200000))
+    (path / "B.JPG").write_bytes(os.urandom(1000))
+    (path / "sub" / "c.jpg").write_bytes(os.urandom(70000))
+    (path / "notes.txt").write_text("not uploaded")
+    return str(path)
+
+
+def uploaded_files(root):
+    """
+    Return relative path -> content of all files below root
+    """
+    files = {}
+    for dirpath, _, filenames in os.walk(root):
+        for name in filenames:
+            path = os.path.join(dirpath, name)
+            with open(path, "rb") as fh:
+                files[os.path.relpath(path, root)] = fh.read()
+    return files
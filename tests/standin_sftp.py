@@ -0,0 +1,108 @@
+"""
+Stand-in SFTP server for the sftp backend tests (paramiko), password "secret"
+"""
+import os
+import socket
+import threading
+
+import paramiko
+
+
+class _Server(paramiko.ServerInterface):
+
+    def get_allowed_auths(self, username):
+        return "password"
+
+    def check_auth_password(self, username, password):
+        return paramiko.AUTH_SUCCESSFUL if password == "secret" else paramiko.AUTH_FAILED
+
+    def check_channel_request(self, kind, chanid):
+        if kind == "session":
+            return paramiko.OPEN_SUCCEEDED
+        return paramiko.OPEN_FAILED_ADMINISTRATIVELY_PROHIBITED
+
+
+class _Handle(paramiko.SFTPHandle):
+
+    def stat(self):
+        return paramiko.SFTPAttributes.from_stat(os.fstat(self.readfile.fileno()))
+
+
+class _SFTPInterface(paramiko.SFTPServerInterface):
+    """
+    Files below root, the client sees root as /
+    """
+
+    def __init__(self, server, root, *args, **kwargs):
+        super().__init__(server, *args, **kwargs)
+        self.root = root
+
+    def local_path(self, path):
+        return os.path.join(self.root, os.path.normpath("/" + path).lstrip("/"))
+
+    def stat(self, path):
+        try:
+            return paramiko.SFTPAttributes.from_stat(os.stat(self.local_path(path)))
+        except OSError as exceptmsg:
+            return paramiko.SFTPServer.convert_errno(exceptmsg.errno)
+
+    lstat = stat
+
+    def mkdir(self, path, attr):
+        try:
+            os.mkdir(self.local_path(path))
+        except OSError as exceptmsg:
+            return paramiko.SFTPServer.convert_errno(exceptmsg.errno)
+        return paramiko.SFTP_OK
+
+    def open(self, path, flags, attr):
+        try:
+            fd = os.open(self.local_path(path), flags, 0o644)
+        except OSError as exceptmsg:
+            return paramiko.SFTPServer.convert_errno(exceptmsg.errno)
+        fh = os.fdopen(fd, "r+b" if flags & os.O_RDWR else "wb" if flags & os.O_WRONLY else "rb")
+        handle = _Handle(flags)
+        handle.filename = self.local_path(path)
+        handle.readfile = fh
+        handle.writefile = fh
+        return handle
+
+
+class StandinSFTPServer:
+    """
+    SFTP server on localhost in background threads (one paramiko Transport per connection)
+    """
+
+    host_key = None
+
+    def __init__(self, root):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+        if StandinSFTPServer.host_key is None:
+            StandinSFTPServer.host_key = paramiko.RSAKey.generate(2048)
+        self.sock = socket.socket()
+        self.sock.bind(("127.0.0.1", 0))
+        self.port = self.sock.getsockname()[1]
+        self.transports = []
+
+    def start(self):
+        self.sock.listen(5)
+        threading.Thread(target=self.accept, daemon=True).start()
+        return self.port
+
+    def accept(self):
+        while True:
+            try:
+                conn, _ = self.sock.accept()
+            except OSError:
+                return
+            transport = paramiko.Transport(conn)
+            transport.add_server_key(self.host_key)
+            transport.set_subsystem_handler("sftp", paramiko.SFTPServer, _SFTPInterface, self.root)
+            transport.start_server(server=_Server())
+            self.transports.append(transport)
+
+    def stop(self):
+        self.sock.close()
+        for transport in self.transports:
+            transport.close()
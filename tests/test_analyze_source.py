@@ -0,0 +1,174 @@
+"""
+Analyzer: sources, job names and streamed jobs
+"""
+import json
+import os
+import queue
+import sqlite3
+import subprocess
+import sys
+import threading
+import time
+
+from libmultiupload import analyze_source, job_history, job_scheduler, job_state, settings
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CONFIG_PATH = os.path.join(REPO, "ffp_fotoupload_config.json")
+
+
+def make_config(tmp_path):
+    return {"temp_path": str(tmp_path / "temp"), "archive_path": str(tmp_path / "archive"),
+            "timestamp": "job", "history": {"enable": True, "path": str(tmp_path / "history.db")}}
+
+
+def load_config(tmp_path):
+    """
+    The shipped config with all paths in tmp_path and no error emails
+    """
+    with open(CONFIG_PATH) as fh:
+        data = json.load(fh)
+    data.update(temp_path=str(tmp_path / "temp"), archive_path=str(tmp_path / "archive"))
+    data["history"]["path"] = str(tmp_path / "history.db")
+    data["log"]["path"] = str(tmp_path / "log")
+    data["err_email"]["enable"] = False
+    return data
+
+
+def test_missing_source_is_a_source_error(tmp_path):
+    data = load_config(tmp_path)
+    status_queue = queue.Queue()
+    assert analyze_source.analyze_move_userfeedback(str(tmp_path / "missing"), status_queue,
+                                                    settings.Config(data)) == -1
+    assert status_queue.get_nowait() == "error_source"
+
+    config_path = str(tmp_path / "config.json")
+    with open(config_path, "w") as fh:
+        json.dump(data, fh)
+    result = subprocess.run([sys.executable, os.path.join(REPO, "ffp_fotoupload.py"), "--source",
+                             str(tmp_path / "missing"), "--config", config_path], cwd=REPO, capture_output=True)
+    assert result.returncode == 2, result.stderr
+
+
+def test_new_job_dir_never_reuses_a_name(tmp_path):
+    config = make_config(tmp_path)
+    assert analyze_source.new_job_dir(config) == "job"
+    assert analyze_source.new_job_dir(config) == "job_1"
+    assert os.path.isdir(os.path.join(config["temp_path"], "job_1"))
+
+    # archived and recorded jobs keep their names
+    os.makedirs(os.path.join(config["archive_path"], "job_2"))
+    job_history.record_job(config, "job_3", status="success")
+    assert analyze_source.new_job_dir(config) == "job_4"
+
+
+def test_streamed_jobs_do_not_wait_for_the_whole_source(tmp_path):
+    # more folders than job slots: every streamed job has to be closed after its own copy,
+    # the uploader (here: a thread per job) frees the slot only then
+    data = load_config(tmp_path)
+    data["stream"].update(enable=True, poll_s=0.01)
+    config = settings.Config(data)
+    source = tmp_path / "card"
+    for folder in ("100CANON", "101CANON", "102CANON"):
+        (source / "DCIM" / folder).mkdir(parents=True)
+        (source / "DCIM" / folder / "IMG_0001.JPG").write_bytes(b"jpeg")
+
+    job_slots = job_scheduler.JobSlots(1)
+    uploaders = []
+
+    def upload(job_path):
+        while job_state.copy_state(job_path) == "copying":
+            time.sleep(0.01)
+        job_slots.release_job()
+
+    def job_ready(job_path):
+        job_slots.hand_over()
+        uploaders.append(threading.Thread(target=upload, args=(job_path,), daemon=True))
+        uploaders[-1].start()
+
+    analyzer = threading.Thread(target=analyze_source.analyze_move_userfeedback,
+                                args=(str(source), queue.Queue(), config, job_slots, job_ready), daemon=True)
+    analyzer.start()
+    analyzer.join(10)
+    assert not analyzer.is_alive()
+    assert len(uploaders) == 3
+
+
+def test_staged_batches_are_moved_and_removed(tmp_path):
+    data = load_config(tmp_path)
+    data["watch"].update(enable=True, staging_path=str(tmp_path / "staging"))
+    config = settings.Config(data)
+    batch = tmp_path / "staging" / "batch"
+    (batch / "sub").mkdir(parents=True)
+    (batch / "IMG_0001.JPG").write_bytes(b"jpeg")
+    (batch / "sub" / "IMG_0002.JPG").write_bytes(b"jpeg")
+    other = tmp_path / "staging" / "other"
+    other.mkdir()
+    (other / "IMG_0003.JPG").write_bytes(b"jpeg")
+    (other / "notes.txt").write_text("not an image")
+
+    assert config["delete_source"] is False
+    assert len(analyze_source.analyze_move_userfeedback(str(batch), queue.Queue(), config)) == 2
+    assert not batch.exists()
+    assert len(analyze_source.analyze_move_userfeedback(str(other), queue.Queue(), config)) == 1
+    assert os.listdir(str(other)) == ["notes.txt"]
+
+    # other folders are only copied
+    folder = tmp_path / "card"
+    folder.mkdir()
+    (folder / "IMG_0004.JPG").write_bytes(b"jpeg")
+    assert len(analyze_source.analyze_move_userfeedback(str(folder), queue.Queue(), config)) == 1
+    assert os.listdir(str(folder)) == ["IMG_0004.JPG"]
+
+
+def test_folders_without_media_get_no_job(tmp_path):
+    data = load_config(tmp_path)
+    data["timestamp"] = "job"
+    source = tmp_path / "card"
+    (source / "DCIM" / "100CANON").mkdir(parents=True)
+    (source / "DCIM" / "100CANON" / "IMG_0001.JPG").write_bytes(b"jpeg")
+    (source / "MISC").mkdir()
+    (source / "MISC" / "notes.txt").write_text("not an image")
+
+    # a single slot, held by the job of 100CANON: a slot for MISC would never become free
+    joblist = analyze_source.analyze_move_userfeedback(str(source), queue.Queue(), settings.Config(data),
+                                                       job_scheduler.JobSlots(1))
+    assert joblist == [os.path.join(data["temp_path"], "job")]
+
+    # merged: no job at all if the source has no media
+    data["ingest"]["merge_folders"] = True
+    status_queue = queue.Queue()
+    assert analyze_source.analyze_move_userfeedback(str(source / "MISC"), status_queue, settings.Config(data),
+                                                    job_scheduler.JobSlots(1)) == []
+    assert status_queue.get_nowait().startswith("start#")
+    assert status_queue.get_nowait().startswith("end#")
+    assert status_queue.empty()
+
+    # no stages (and no job names) used by the folders without media
+    with sqlite3.connect(data["history"]["path"]) as connection:
+        assert connection.execute("SELECT DISTINCT job FROM stages").fetchall() == [("job",)]
+    assert os.listdir(data["temp_path"]) == ["job"]
+
+
+def test_merged_folders_are_one_job(tmp_path):
+    data = load_config(tmp_path)
+    data["timestamp"] = "job"
+    data["ingest"]["merge_folders"] = True
+    source = tmp_path / "card"
+    for folder in ("100CANON", "101CANON"):
+        (source / "DCIM" / folder).mkdir(parents=True)
+        (source / "DCIM" / folder / "IMG_0001.JPG").write_bytes(folder.encode())
+    (source / "DCIM" / "101CANON" / "MVI_0002.MP4").write_bytes(b"mp4")
+    (source / "IMG_0003.JPG").write_bytes(b"jpeg")
+
+    config = settings.Config(data)
+    job_path = os.path.join(data["temp_path"], "job")
+    assert analyze_source.analyze_move_userfeedback(str(source), queue.Queue(), config) == [job_path]
+    # the folder structure of the source is kept inside the job
+    assert sorted(os.path.relpath(os.path.join(dirpath, name), job_path)
+                  for dirpath, _, names in os.walk(job_path) for name in names) == [
+        os.path.join("image", "DCIM", "100CANON", "IMG_0001.JPG"),
+        os.path.join("image", "DCIM", "101CANON", "IMG_0001.JPG"),
+        os.path.join("image", "IMG_0003.JPG"),
+        os.path.join("video", "DCIM", "101CANON", "MVI_0002.MP4")]
+    job = job_history.get_job(config, "job")
+    assert (job["source"], job["image_files"], job["video_files"]) == (str(source), 3, 1)
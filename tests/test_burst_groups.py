@@ -0,0 +1,59 @@
+"""
+Burst groups: near-duplicate hashes are grouped (multi-index, transitively), thumbnails collapsed
+"""
+import itertools
+import json
+import os
+import random
+
+import pytest
+
+from libmultiupload import burst_groups
+
+
+def test_groups_within_distance_transitively():
+    hashes = {"b.jpg": 0b0011, "a.jpg": 0b0001, "c.jpg": 0b0111, "d.jpg": 0xFFFF << 48}
+    # a-b and b-c differ in one bit, a-c in two: one group over b
+    assert burst_groups.group_hashes(hashes, 1) == [["a.jpg", "b.jpg", "c.jpg"], ["d.jpg"]]
+    assert burst_groups.group_hashes(hashes, 0) == [["a.jpg"], ["b.jpg"], ["c.jpg"], ["d.jpg"]]
+
+
+def test_multi_index_finds_every_pair():
+    # the same pairs as a comparison of all hashes
+    rng = random.Random(1)
+    base = [rng.getrandbits(64) for _ in range(20)]
+    hashes = {}
+    for number, value in enumerate(base):
+        for copy in range(3):
+            for _ in range(rng.randint(0, 6)):
+                value ^= 1 << rng.randrange(64)
+            hashes["{:02d}_{}".format(number, copy)] = value
+    for max_distance in (0, 3, 6):
+        groups = burst_groups.group_hashes(hashes, max_distance)
+        group_of = {name: number for number, group in enumerate(groups) for name in group}
+        for first, second in itertools.combinations(hashes, 2):
+            if bin(hashes[first] ^ hashes[second]).count("1") <= max_distance:
+                assert group_of[first] == group_of[second]
+        assert sorted(name for group in groups for name in group) == sorted(hashes)
+        assert all(group == sorted(group) for group in groups)
+
+
+def test_collapse_thumbnails(tmp_path):
+    Image = pytest.importorskip("PIL.Image")
+    thumb_path = tmp_path / "image_thumb"
+    (thumb_path / "sub").mkdir(parents=True)
+    rising = Image.linear_gradient("L").rotate(90).resize((64, 48))
+    falling = rising.transpose(Image.FLIP_LEFT_RIGHT)
+    rising.save(str(thumb_path / "a.jpg"))
+    rising.point(lambda value: min(value + 3, 255)).save(str(thumb_path / "sub" / "b.jpg"))
+    falling.save(str(thumb_path / "c.jpg"))
+    assert burst_groups.dhash(str(thumb_path / "a.jpg")) != burst_groups.dhash(str(thumb_path / "c.jpg"))
+
+    similar_path = tmp_path / "image_thumb_similar"
+    assert burst_groups.collapse_thumbnails(str(thumb_path), str(similar_path), (".jpg",), 4) == {"a.jpg": 1}
+    assert sorted(os.listdir(str(thumb_path))) == ["a.jpg", "c.jpg", "sub"]
+    assert os.path.isfile(str(similar_path / "sub" / "b.jpg"))
+    with open(str(similar_path / "groups.json")) as fh:
+        assert json.load(fh) == {"a.jpg": [os.path.join("sub", "b.jpg")]}
+    assert burst_groups.load_groups(str(similar_path)) == {"a.jpg": 1}
+    assert burst_groups.load_groups(str(tmp_path / "missing")) == {}
@@ -0,0 +1,159 @@
+"""
+Inserted cards: uevents to queued device nodes
+"""
+import logging
+import os
+import time
+
+import pytest
+
+from libmultiupload import device_manager, udiskie_mounthelper
+
+DEVICES = {"match": ["sd*", "mmcblk*"], "removable_only": True, "node_wait_s": 0.2}
+
+
+@pytest.fixture
+def manager(tmp_path):
+    """
+    DeviceManager on a stand-in /dev, /sys/class/block and mount table, submit() records
+    the nodes (manager.queued) and accepts them while manager.accept is true
+    """
+    dev_path = tmp_path / "dev"
+    dev_path.mkdir()
+    sys_block = tmp_path / "sys_block"
+    sys_block.mkdir()
+    # disks: removable card reader, fixed disk, sd slot (reports its card as not removable),
+    # card reader with a card without partitions, card reader without card
+    for disk, partitions, removable, size in (("sdb", ("sdb1", "sdb2"), "1", "1000"), ("sdc", ("sdc1",), "0", "1000"),
+                                              ("mmcblk0", ("mmcblk0p1",), "0", "1000"), ("sdd", (), "1", "1000"),
+                                              ("sde", (), "1", "0")):
+        disk_path = tmp_path / "devices" / disk
+        disk_path.mkdir(parents=True)
+        (disk_path / "removable").write_text(removable + "\n")
+        (disk_path / "size").write_text(size + "\n")
+        (sys_block / disk).symlink_to(disk_path)
+        for name in partitions:
+            (disk_path / name).mkdir()
+            (disk_path / name / "partition").write_text("1\n")
+            (sys_block / name).symlink_to(disk_path / name)
+    mounts = tmp_path / "mounts"
+    mounts.write_text("{} /media/card vfat rw 0 0\n".format(dev_path / "sdb2"))
+
+    def submit(node):
+        if not manager.accept:
+            return False
+        manager.queued.append(os.path.basename(node))
+        return True
+
+    source = device_manager.StandinUeventSource()
+    manager = device_manager.DeviceManager(submit, DEVICES, source, udiskie_mounthelper.MountTable(str(mounts)),
+                                           str(dev_path), str(sys_block))
+    manager.accept = True
+    manager.queued = []
+    return manager
+
+
+def add_node(manager, name):
+    open(os.path.join(manager.dev_path, name), "w").close()
+
+
+def test_matching_removable_partitions_are_queued(manager):
+    for name in ("sdb1", "sdc1", "mmcblk0p1", "loop0"):
+        add_node(manager, name)
+        manager.source.inject("add", name)
+    manager.source.inject("add", "sdb", devtype="disk")
+    manager.poll(0.01)
+    assert manager.queued == ["sdb1", "mmcblk0p1"]
+
+    # repeated add event of a present device
+    manager.source.inject("add", "sdb1")
+    manager.poll(0.01)
+    assert manager.queued == ["sdb1", "mmcblk0p1"]
+
+
+def test_queued_when_the_node_exists(manager):
+    manager.source.inject("add", "sdb1")
+    manager.source.inject("add", "sdb2")
+    manager.poll(0.01)
+    assert manager.queued == []
+
+    add_node(manager, "sdb1")
+    manager.poll(0.01)
+    assert manager.queued == ["sdb1"]
+
+    # no node within node_wait_s: given up
+    time.sleep(DEVICES["node_wait_s"])
+    manager.poll(0.01)
+    assert manager.pending == []
+    add_node(manager, "sdb2")
+    manager.poll(0.01)
+    assert manager.queued == ["sdb1"]
+
+
+def test_full_queue_is_retried_in_order(manager):
+    for name in ("sdb1", "mmcblk0p1"):
+        add_node(manager, name)
+        manager.source.inject("add", name)
+    manager.accept = False
+    manager.poll(0.01)
+    assert manager.queued == [] and manager.pending == ["sdb1", "mmcblk0p1"]
+
+    manager.accept = True
+    manager.poll(0.01)
+    assert manager.queued == ["sdb1", "mmcblk0p1"]
+
+
+def test_removed_devices(manager, caplog):
+    manager.source.inject("add", "sdb1")
+    add_node(manager, "sdb2")
+    manager.source.inject("add", "sdb2")
+    manager.poll(0.01)
+    assert manager.queued == ["sdb2"]
+
+    caplog.set_level(logging.INFO)
+    manager.source.inject("remove", "sdb1")
+    manager.source.inject("remove", "sdb2")
+    manager.poll(0.01)
+    assert manager.present == {} and manager.pending == []
+    assert "sdb2 removed while mounted on /media/card" in caplog.text
+
+    # inserted again
+    add_node(manager, "sdb1")
+    manager.source.inject("add", "sdb1")
+    manager.poll(0.01)
+    assert manager.queued == ["sdb2", "sdb1"]
+
+
+def test_disks_without_partitions_are_queued(manager):
+    for name in ("sdb", "sdd", "sde", "mmcblk0"):
+        add_node(manager, name)
+        manager.source.inject("add", name, devtype="disk")
+    manager.poll(0.01)
+    assert manager.queued == ["sdd"]
+
+    # udev found no filesystem
+    manager.source.inject("remove", "sdd", devtype="disk")
+    manager.source.inject("add", "sdd", devtype="disk", ID_FS_TYPE="")
+    manager.poll(0.01)
+    assert manager.queued == ["sdd"] and manager.present == {}
+
+
+def test_card_inserted_into_a_reader(manager):
+    # the reader sde is connected without card, the card is reported as change
+    add_node(manager, "sde")
+    manager.source.inject("add", "sde", devtype="disk")
+    manager.poll(0.01)
+    assert manager.queued == []
+
+    size_path = os.path.join(manager.sys_block, "sde", "size")
+    with open(size_path, "w") as fh:
+        fh.write("1000\n")
+    manager.source.inject("change", "sde", devtype="disk")
+    manager.poll(0.01)
+    assert manager.queued == ["sde"]
+
+    with open(size_path, "w") as fh:
+        fh.write("0\n")
+    manager.source.inject("change", "sde", devtype="disk")
+    manager.poll(0.01)
+    assert manager.present == {}
@@ -0,0 +1,73 @@
+"""
+Thumbnails: names, output profiles and the quality search within the byte budget
+"""
+import os
+
+import pytest
+
+pytest.importorskip("PIL")
+
+from PIL import Image  # noqa: E402
+
+from libmultiupload import img_thumbnail  # noqa: E402
+
+JPEG_WEB = {"format": "JPEG", "quality": 80, "max_bytes": 0, "progressive": True, "optimize": True,
+            "min_quality": 40, "search_steps": 6}
+WEBP = {"format": "WEBP", "quality": 80, "max_bytes": 0, "method": 4, "min_quality": 40, "search_steps": 6}
+
+
+def test_thumbnail_names_do_not_collide():
+    for profile in (JPEG_WEB, WEBP):
+        names = [img_thumbnail.thumbnail_name(name, profile) for name in ("IMG_1.jpg", "IMG_1.png", "IMG_1.webp")]
+        assert len(set(names)) == 3
+    assert img_thumbnail.thumbnail_name("IMG_1.JPG", JPEG_WEB) == "IMG_1.JPG"
+    assert img_thumbnail.thumbnail_name("IMG_1.png", JPEG_WEB) == "IMG_1.png.jpg"
+    assert img_thumbnail.thumbnail_name("a.jpg", WEBP) == "a.jpg.webp"
+    assert img_thumbnail.thumbnail_name("a.png", None) == "a.png"
+
+
+def test_same_stem_gets_two_thumbnails(tmp_path):
+    src = tmp_path / "image"
+    src.mkdir()
+    Image.new("RGB", (64, 48), "red").save(str(src / "IMG_1.jpg"))
+    Image.new("RGB", (64, 48), "blue").save(str(src / "IMG_1.png"))
+    thumbs = tmp_path / "image_thumb"
+    for name in ("IMG_1.jpg", "IMG_1.png"):
+        assert img_thumbnail.make_thumbnail(str(src / name), str(thumbs / name), (".jpg", ".png"), [32, 32],
+                                            JPEG_WEB) == 0
+
+    assert sorted(os.listdir(str(thumbs))) == ["IMG_1.jpg", "IMG_1.png.jpg"]
+    with Image.open(str(thumbs / "IMG_1.png.jpg")) as img:
+        assert img.format == "JPEG"
+        assert img.getpixel((0, 0))[2] > 200
+
+
+def noise(size=(128, 96)):
+    # random pixels: the encoded size falls with every quality step
+    return Image.frombytes("RGB", size, os.urandom(size[0] * size[1] * 3))
+
+
+def test_quality_search_finds_the_highest_quality_within_budget(monkeypatch):
+    img = noise()
+    budget = len(img_thumbnail.encode(img, JPEG_WEB, 60))
+    profile = dict(JPEG_WEB, max_bytes=budget)
+    encodings = []
+    encode = img_thumbnail.encode
+    monkeypatch.setattr(img_thumbnail, "encode",
+                        lambda img, profile, quality: encodings.append(quality) or encode(img, profile, quality))
+
+    data, quality = img_thumbnail.encode_within_budget(img, profile)
+    # the profile quality, then at most search_steps
+    assert len(encodings) <= 1 + profile["search_steps"]
+    assert len(data) <= budget
+    assert quality >= 60
+    assert len(encode(img, profile, quality + 1)) > budget
+
+
+def test_quality_search_limits():
+    img = noise()
+    # within the budget at the profile quality: encoded once
+    assert img_thumbnail.encode_within_budget(img, dict(JPEG_WEB, max_bytes=10 ** 7))[1] == 80
+    # not reachable: min_quality
+    assert img_thumbnail.encode_within_budget(img, dict(JPEG_WEB, max_bytes=100))[1] == 40
+    assert img_thumbnail.encode_within_budget(img, dict(WEBP, max_bytes=100))[1] == 40
@@ -0,0 +1,37 @@
+"""
+Job history store
+"""
+import sqlite3
+
+from libmultiupload import job_history, udiskie_mounthelper
+
+
+def make_config(tmp_path):
+    return {"history": {"enable": True, "path": str(tmp_path / "history.db")}}
+
+
+def journal_mode(config):
+    conn = sqlite3.connect(config["history"]["path"])
+    try:
+        return conn.execute("PRAGMA journal_mode").fetchone()[0]
+    finally:
+        conn.close()
+
+
+def test_record_and_get(tmp_path):
+    config = make_config(tmp_path)
+    job_history.record_job(config, "job", source="/dev/sdb1", status="queued", created=1.0)
+    job_history.record_job(config, "job", status="success", created=2.0)
+    job_history.record_stage(config, "job", "copy", 1.5)
+    job = job_history.get_job(config, "job")
+    assert (job["status"], job["source"], job["created"]) == ("success", "/dev/sdb1", 1.0)
+    assert job["stages"][0]["stage"] == "copy"
+    assert job_history.job_exists(config, "job")
+    assert journal_mode(config) == "wal"
+
+
+def test_no_wal_on_network_filesystems(tmp_path, monkeypatch):
+    monkeypatch.setattr(udiskie_mounthelper, "filesystem_type", lambda path: "nfs4")
+    config = make_config(tmp_path)
+    job_history.record_job(config, "job", status="queued")
+    assert journal_mode(config) == "delete"
@@ -0,0 +1,62 @@
+"""
+Job slots and the fair order of the job dispatcher
+"""
+import multiprocessing
+import queue
+import threading
+import time
+
+import pytest
+
+from libmultiupload import job_scheduler
+
+
+def analyzer(job_slots):
+    # two jobs copied, the first handed to the uploader, then the analyzer dies
+    job_slots.acquire()
+    job_slots.hand_over()
+    job_slots.acquire()
+
+
+def test_slots_of_a_dead_analyzer_are_released_once():
+    job_slots = job_scheduler.JobSlots(2)
+    process = multiprocessing.Process(target=analyzer, args=(job_slots,))
+    process.start()
+    process.join(10)
+
+    assert not job_slots.acquire(False)
+    # only the slot which was not handed over, the other one belongs to the job
+    assert job_slots.release_orphaned(0) == 1
+    assert job_slots.release_orphaned(0) == 0
+    job_slots.release_job()
+    with pytest.raises(ValueError):
+        job_slots.release_job()
+
+
+def test_slots_of_the_running_analyzer_are_kept():
+    job_slots = job_scheduler.JobSlots(1)
+    assert job_slots.acquire(False)
+    assert job_slots.release_orphaned(multiprocessing.current_process().pid) == 0
+    job_slots.release_own()
+    assert job_slots.acquire(False)
+
+
+def test_fair_scheduler_round_robin():
+    scheduler = job_scheduler.FairScheduler()
+    for job in ("a1", "a2", "a3"):
+        scheduler.add("card_a", job, 0)
+    scheduler.add("card_b", "b1", 0)
+    assert [scheduler.pop()[1] for _ in range(len(scheduler))] == ["a1", "b1", "a2", "a3"]
+
+
+def test_dispatcher_chooses_when_the_uploader_has_room():
+    ready_q = queue.Queue()
+    job_q = queue.Queue(1)
+    for job in ("a1", "a2", "a3"):
+        ready_q.put(("card_a", job, 0))
+    threading.Thread(target=job_scheduler.dispatch_jobs, args=(ready_q, job_q, 0.01), daemon=True).start()
+    # a1 waits in job_q for the uploader: the next job is not chosen before card_b arrives
+    time.sleep(0.1)
+    ready_q.put(("card_b", "b1", 0))
+    time.sleep(0.1)
+    assert [job_q.get(timeout=5)[1] for _ in range(4)] == ["a1", "a2", "b1", "a3"]
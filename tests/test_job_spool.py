@@ -0,0 +1,111 @@
+"""
+Leases of the shared job spool: claim, renewal, expiry and steal
+"""
+import os
+import time
+
+import pytest
+
+from libmultiupload import job_history, job_spool, job_state
+
+
+@pytest.fixture
+def config(tmp_path):
+    return {"spool": {"path": str(tmp_path / "spool"), "lease_s": 30, "heartbeat_s": 5},
+            "history": {"enable": True, "path": str(tmp_path / "history.db")}}
+
+
+def add_job(config, tmp_path, name):
+    job_path = tmp_path / "temp" / name
+    (job_path / "image").mkdir(parents=True)
+    (job_path / "image" / "a.jpg").write_bytes(b"jpeg")
+    return job_spool.publish(config, str(job_path))
+
+
+def expire(lease_path, config):
+    old = time.time() - config["spool"]["lease_s"] - 1
+    os.utime(lease_path, (old, old))
+
+
+def test_publish_keeps_names_unique(config, tmp_path):
+    first = add_job(config, tmp_path, "job")
+    second = add_job(config, tmp_path, "job")
+    assert os.path.basename(first) == "job"
+    assert os.path.basename(second) == "job_1"
+    assert os.path.isfile(os.path.join(second, "image", "a.jpg"))
+    assert not os.path.exists(str(tmp_path / "temp" / "job"))
+
+
+def test_publish_renames_the_history(config, tmp_path):
+    # a job of the same name from another host (with a history of its own) is in the spool
+    add_job(dict(config, history={"enable": False}), tmp_path / "other", "job")
+    job_history.record_job(config, "job", source="/media/card", status="queued")
+    job_history.record_stage(config, "job", "copy", 1.0)
+    add_job(config, tmp_path, "job")
+    assert job_history.get_job(config, "job") is None
+    renamed = job_history.get_job(config, "job_1")
+    assert renamed["source"] == "/media/card"
+    assert [stage["stage"] for stage in renamed["stages"]] == ["copy"]
+
+
+def test_claim_is_exclusive(config, tmp_path):
+    job_path = add_job(config, tmp_path, "job")
+    job_path, lease = job_spool.claim_next(config, "host_a")
+    assert lease.holder() == "host_a"
+    assert job_spool.claim_next(config, "host_b") is None
+    assert lease.renew()
+
+
+def test_expired_lease_is_stolen(config, tmp_path):
+    job_path = add_job(config, tmp_path, "job")
+    job_state.mark_done(job_path, "thumbnail")
+    _, lease_a = job_spool.claim_next(config, "host_a")
+    expire(lease_a.path, config)
+
+    claimed = job_spool.claim_next(config, "host_b")
+    assert claimed is not None
+    assert claimed[0] == job_path
+    lease_b = claimed[1]
+    assert lease_b.holder() == "host_b"
+    # the previous holder notices the loss and never removes the new lease
+    assert not lease_a.renew()
+    lease_a.release()
+    assert lease_b.holder() == "host_b"
+    # the new holder continues after the finished stages
+    assert "thumbnail" in job_state.done_stages(job_path)
+    assert [name for name in os.listdir(os.path.dirname(lease_b.path)) if ".stolen." in name] == []
+
+
+def test_renewed_lease_is_kept(config, tmp_path):
+    add_job(config, tmp_path, "job")
+    _, lease = job_spool.claim_next(config, "host_a")
+    expire(lease.path, config)
+    assert lease.renew()
+    assert job_spool.claim_next(config, "host_b") is None
+
+
+def test_steal_of_a_renewed_lease_is_undone(config, tmp_path):
+    job_path = add_job(config, tmp_path, "job")
+    _, lease = job_spool.claim_next(config, "host_a")
+    # renewed between the expiry check and the rename of the other uploader
+    assert job_spool._steal(lease.path, "host_b", config["spool"]["lease_s"]) is None
+    assert lease.holder() == "host_a"
+    assert job_spool.lease_path(config, job_path) == lease.path
+
+
+def test_finish_moves_failed_jobs(config, tmp_path):
+    job_path = add_job(config, tmp_path, "job")
+    _, lease = job_spool.claim_next(config, "host_a")
+    job_spool.finish(config, job_path, lease)
+    assert os.path.isdir(os.path.join(config["spool"]["path"], "failed", "job"))
+    assert not os.path.exists(lease.path)
+    assert job_spool.claim_next(config, "host_b") is None
+
+
+def test_worker_lease(config, tmp_path):
+    job_path = add_job(config, tmp_path, "job")
+    job_spool.claim_next(config, job_spool.make_owner("spool_uploader_0"))
+    assert job_spool.worker_lease(config, job_path, "spool_uploader_1") is None
+    lease = job_spool.worker_lease(config, job_path, "spool_uploader_0")
+    lease.release()
+    assert job_spool.claim_next(config, "host_b") is not None
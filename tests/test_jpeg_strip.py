@@ -0,0 +1,70 @@
+"""
+Metadata removal: the originals are kept, broken JPEG files are never passed on with their metadata
+"""
+import os
+import struct
+import zipfile
+
+from libmultiupload import jpeg_strip, zip_volumes
+
+COMMENT = b"secret position"
+
+
+def jpeg(comment=COMMENT):
+    # SOI, COM segment, SOS with a few bytes of "image data", EOI
+    return (b"\xff\xd8" + b"\xff\xfe" + struct.pack(">H", len(comment) + 2) + comment +
+            b"\xff\xda\x00\x02image\xff\xd9")
+
+
+# COM segment claims more bytes than the file has
+BROKEN = b"\xff\xd8\xff\xfe\x10\x00" + COMMENT
+
+
+def make_images(path):
+    os.makedirs(os.path.join(path, "sub"))
+    for name, data in (("good.jpg", jpeg()), ("sub/broken.jpg", BROKEN), ("notes.txt", COMMENT)):
+        with open(os.path.join(path, name), "wb") as fh:
+            fh.write(data)
+
+
+def test_strip_bytes_removes_comment():
+    data, removed = jpeg_strip.strip_bytes(jpeg(), ["comment"])
+    assert removed == ["comment"]
+    assert COMMENT not in data and data.endswith(b"image\xff\xd9")
+
+
+def read(path):
+    with open(path, "rb") as fh:
+        return fh.read()
+
+
+def test_strip_tree_copies_without_metadata(tmp_path):
+    path = str(tmp_path / "image")
+    dest_path = str(tmp_path / "image_stripped")
+    make_images(path)
+
+    # a second run (restart) replaces the copy of the first one
+    for _ in range(2):
+        assert jpeg_strip.strip_tree(path, dest_path, ["comment"], 2) == [os.path.join("sub", "broken.jpg")]
+        assert COMMENT not in read(os.path.join(dest_path, "good.jpg"))
+        assert read(os.path.join(dest_path, "notes.txt")) == COMMENT
+        # not copied, the caller does not upload it
+        assert not os.path.exists(os.path.join(dest_path, "sub", "broken.jpg"))
+        # the originals (archived) are unchanged
+        assert read(os.path.join(path, "good.jpg")) == jpeg()
+        assert read(os.path.join(path, "sub", "broken.jpg")) == BROKEN
+        assert read(os.path.join(path, "notes.txt")) == COMMENT
+
+
+def test_broken_files_are_left_out_of_the_archive(tmp_path):
+    path = str(tmp_path / "image")
+    make_images(path)
+
+    def transform(name):
+        return jpeg_strip.read_stripped(name, ["comment"])
+
+    volumes = zip_volumes.make_volumes(path, str(tmp_path / "job"), 0, 1, transform=transform)
+    with zipfile.ZipFile(volumes[0]) as archive:
+        assert sorted(archive.namelist()) == ["good.jpg", "notes.txt"]
+        assert COMMENT not in archive.read("good.jpg")
+
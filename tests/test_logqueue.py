@@ -0,0 +1,72 @@
+"""
+Process safe logging: records of all processes end up in one rotated logfile
+"""
+import logging
+import multiprocessing
+import os
+
+import pytest
+
+from libmultiupload import logqueue
+
+
+def worker(log_queue):
+    logqueue.setup_worker(log_queue, logging.INFO)
+    logging.debug("not logged")
+    logging.info("from the worker")
+
+
+@pytest.fixture
+def root_logger():
+    # start_listener() replaces the handlers of the root logger (also those of pytest)
+    root = logging.getLogger()
+    handlers, level = root.handlers[:], root.level
+    yield root
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+    for handler in handlers:
+        root.addHandler(handler)
+    root.setLevel(level)
+    logging.captureWarnings(False)
+
+
+def read_logs(path):
+    text = ""
+    for name in sorted(os.listdir(path)):
+        with open(os.path.join(path, name)) as fh:
+            text += fh.read()
+    return text
+
+
+def test_records_of_all_processes(tmp_path, root_logger):
+    config = {"log": {"level": "info", "max_bytes": 1000000, "backup_count": 1}}
+    log_queue, listener = logqueue.start_listener(config, str(tmp_path / "log" / "upload.log"))
+    try:
+        logging.info("from the main process")
+        process = multiprocessing.Process(target=worker, args=(log_queue,), name="worker-1")
+        process.start()
+        process.join(10)
+    finally:
+        listener.stop()
+
+    text = read_logs(str(tmp_path / "log"))
+    assert "MainProcess INFO: from the main process" in text
+    assert "worker-1 INFO: from the worker" in text
+    assert "not logged" not in text
+
+
+def test_logfile_is_rotated(tmp_path, root_logger):
+    config = {"log": {"level": "DEBUG", "max_bytes": 1000, "backup_count": 2}}
+    _, listener = logqueue.start_listener(config, str(tmp_path / "upload.log"))
+    try:
+        for number in range(100):
+            logging.debug("line %d %s", number, "x" * 50)
+    finally:
+        listener.stop()
+    assert sorted(os.listdir(str(tmp_path))) == ["upload.log", "upload.log.1", "upload.log.2"]
+    assert os.path.getsize(str(tmp_path / "upload.log")) <= 1000
+
+
+def test_unknown_level_logs_everything():
+    assert logqueue.get_level({"log": {"level": "warning"}}) == logging.WARNING
+    assert logqueue.get_level({"log": {"level": "chatty"}}) == logging.DEBUG
@@ -0,0 +1,47 @@
+"""
+Progress events: throttled to one per interval, the final event always sent
+"""
+import queue
+
+from libmultiupload import progress
+
+
+def events(status_queue):
+    result = []
+    while not status_queue.empty():
+        result.append(status_queue.get_nowait())
+    return result
+
+
+def test_updates_are_throttled(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(progress.time, "monotonic", lambda: now[0])
+    status_queue = queue.Queue()
+    prog = progress.Progress(status_queue, "job", "copy", files_total=4, bytes_total=400, interval=1.0)
+
+    # the first update is sent at once, the next ones only after the interval
+    prog.update(1, 100)
+    now[0] += 0.5
+    prog.update(1, 100)
+    assert [event["files_done"] for event in events(status_queue)] == [1]
+
+    now[0] += 0.5
+    prog.update(1, 100)
+    event, = events(status_queue)
+    assert (event["files_done"], event["bytes_done"], event["done"]) == (3, 300, False)
+    # 300 bytes in 1 s, 100 bytes left
+    assert event["rate"] == 300.0 and event["eta"] == 100 / 300
+
+    # finish() is not throttled
+    prog.update(1, 100)
+    prog.finish()
+    event, = events(status_queue)
+    assert (event["files_done"], event["done"], event["eta"]) == (4, True, 0.0)
+
+
+def test_no_queue_no_events():
+    prog = progress.from_config(None, "job", "zip", {"progress": {"interval_s": 0}})
+    prog.add_total(2, 20)
+    prog.update(1, 10)
+    prog.finish()
+    assert (prog.files_done, prog.files_total, prog.bytes_total) == (1, 2, 20)
@@ -0,0 +1,66 @@
+"""
+Validation of the config file
+"""
+import copy
+import json
+import os
+
+import pytest
+
+from libmultiupload import settings
+
+CONFIG_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "ffp_fotoupload_config.json")
+
+
+@pytest.fixture
+def data():
+    with open(CONFIG_PATH) as fh:
+        return json.load(fh)
+
+
+def test_shipped_config_is_valid(data):
+    assert settings.validate(data) == []
+    config = settings.Config(copy.deepcopy(data))
+    assert config["image"]["type"] == (".jpg", ".png")
+    assert set(config.targets) == {"remote_ftp", "local_ftp"}
+
+
+@pytest.mark.parametrize("backend, section, error", [
+    ("ftps", {"verify": "md5"}, "remote_ftp.verify: expected one of none, size, hash"),
+    ("ftps", {"port": "21"}, "remote_ftp.port: expected int, got '21'"),
+    ("sftp", {"enable": True, "password": ""}, "remote_ftp: password or key_file required"),
+    ("http", {"url": "ftp://host", "mkcol": True}, "remote_ftp.url: expected a http:// or https:// url"),
+    ("http", {"url": "https://host"}, "missing: remote_ftp.mkcol"),
+    ("webdav", {}, "remote_ftp.backend: unknown backend 'webdav'"),
+])
+def test_backend_keys(data, backend, section, error):
+    data["remote_ftp"]["backend"] = backend
+    data["remote_ftp"].update(section)
+    assert error in settings.validate(data)
+
+
+def test_sftp_with_key_file(data):
+    data["remote_ftp"].update(backend="sftp", enable=True, password="", key_file="/etc/fotoupload/id_ed25519")
+    assert settings.validate(data) == []
+
+
+@pytest.mark.parametrize("profile, error", [
+    ({"format": "GIF"}, "image_thumbnail.profiles.jpeg_web.format: expected one of '', 'JPEG', 'WEBP', 'PNG'"),
+    ({"format": "WEBP"}, "missing: image_thumbnail.profiles.jpeg_web.method"),
+    ({"quality": 0}, "image_thumbnail.profiles.jpeg_web.quality: expected 1 to 100"),
+    ({"max_bytes": 2.5}, "image_thumbnail.profiles.jpeg_web.max_bytes: expected int, got 2.5"),
+])
+def test_thumbnail_profiles(data, profile, error):
+    data["image_thumbnail"]["profiles"]["jpeg_web"].update(profile)
+    assert error in settings.validate(data)
+
+
+def test_source_format_profile(data):
+    data["image_thumbnail"]["profiles"]["source"] = {"format": ""}
+    data["image_thumbnail"]["profile"] = "source"
+    assert settings.validate(data) == []
+
+
+def test_thumbnail_size(data):
+    data["image_thumbnail"]["size_px"] = [1000, "1000"]
+    assert "image_thumbnail.size_px: expected [width, height] in pixels" in settings.validate(data)
@@ -0,0 +1,60 @@
+"""
+Supervised workers: stop() leaves no worker or program of a worker running
+"""
+import multiprocessing
+import os
+import subprocess
+import threading
+import time
+
+from libmultiupload import supervisor
+
+CONFIG = {"supervisor": {"check_interval_s": 0.1, "max_attempts": 3, "stage_deadline_s": {"default": 60}},
+          "err_email": {"enable": False}}
+
+
+def sleeper(pid_path, control_q, name):
+    supervisor.setup_worker(control_q, name)
+    program = subprocess.Popen(["sleep", "60"])
+    with open(pid_path, "w") as fh:
+        fh.write(str(program.pid))
+    program.wait()
+
+
+def alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    # a killed child of a killed worker may stay a zombie until init reaps it
+    with open("/proc/{}/stat".format(pid)) as fh:
+        return fh.read().split(")")[-1].split()[0] != "Z"
+
+
+def test_stop_kills_workers_and_their_programs(tmp_path):
+    pid_path = str(tmp_path / "program.pid")
+    control_q = multiprocessing.Queue()
+    workers = supervisor.Supervisor(CONFIG, control_q)
+    workers.add(supervisor.Worker("sleeper", sleeper, (pid_path, control_q), lambda item, stages: None))
+    run_thread = threading.Thread(target=workers.run, daemon=True)
+    run_thread.start()
+    for _ in range(100):
+        if os.path.exists(pid_path) and os.path.getsize(pid_path):
+            break
+        time.sleep(0.05)
+    with open(pid_path) as fh:
+        program_pid = int(fh.read())
+    worker_process = workers.workers["sleeper"].process
+
+    workers.stop()
+    run_thread.join(5)
+
+    assert not run_thread.is_alive()
+    # not restarted
+    assert workers.workers["sleeper"].process is worker_process
+    assert not worker_process.is_alive()
+    for _ in range(50):
+        if not alive(program_pid):
+            break
+        time.sleep(0.05)
+    assert not alive(program_pid)
@@ -0,0 +1,266 @@
+"""
+Upload round trips of every transfer backend against local stand-ins
+"""
+import base64
+import http.server
+import os
+import threading
+
+import pytest
+
+from conftest import uploaded_files
+from libmultiupload import ftps_mod, transfer
+
+IMAGES = {"a.jpg", "B.JPG", os.path.join("sub", "c.jpg")}
+
+
+def expected(job_folder, names):
+    return {name: open(os.path.join(job_folder, name), "rb").read() for name in names}
+
+
+def ftps_target(server, **options):
+    target = {"enable": True, "backend": "ftps", "ftp": server.server_address[0], "port": server.server_address[1],
+              "username": "user", "password": "secret", "target_dir": "/upload", "verify": "hash",
+              "blocksize": 65536, "sndbuf": 0, "timeout_s": 10, "strip_metadata": []}
+    target.update(options)
+    return target
+
+
+@pytest.mark.parametrize("verify", ["none", "size", "hash"])
+def test_ftps_round_trip(ftp_server, job_folder, verify):
+    config = {"remote_ftp": ftps_target(ftp_server, verify=verify)}
+    assert transfer.upload(config, "remote_ftp", job_folder, (".jpg",), "job1", True) == (0, "success")
+    assert uploaded_files(os.path.join(ftp_server.root, "upload", "job1")) == expected(job_folder, IMAGES)
+
+
+def test_ftps_not_recursive(ftp_server, job_folder):
+    config = {"remote_ftp": ftps_target(ftp_server)}
+    assert transfer.upload(config, "remote_ftp", job_folder, (), "job1", False)[0] == 0
+    assert set(uploaded_files(os.path.join(ftp_server.root, "upload", "job1"))) == {"a.jpg", "B.JPG", "notes.txt"}
+
+
+def test_ftps_relative_target_dir_retry(ftp_server, job_folder, monkeypatch):
+    # every file fails its first verification: verified and uploaded again on the upload
+    # connection, which is in the job folder by then
+    verify_file = ftps_mod.verify_file
+    checked = set()
+
+    def fail_once(ftps, local_path, remote_path, hash_feature):
+        if remote_path not in checked:
+            checked.add(remote_path)
+            return False
+        return verify_file(ftps, local_path, remote_path, hash_feature)
+
+    monkeypatch.setattr(ftps_mod, "verify_file", fail_once)
+    config = {"remote_ftp": ftps_target(ftp_server, target_dir="upload")}
+    assert transfer.upload(config, "remote_ftp", job_folder, (".jpg",), "job1", True) == (0, "success")
+    assert checked == {"/upload/job1/a.jpg", "/upload/job1/B.JPG", "/upload/job1/sub/c.jpg"}
+    assert uploaded_files(os.path.join(ftp_server.root, "upload", "job1")) == expected(job_folder, IMAGES)
+
+
+def test_ftps_verify_detects_changed_file(ftp_server, job_folder):
+    config = {"remote_ftp": ftps_target(ftp_server)}
+    assert transfer.upload(config, "remote_ftp", job_folder, (".jpg",), "job1", False)[0] == 0
+    remote = os.path.join(ftp_server.root, "upload", "job1", "a.jpg")
+    ftps = ftps_mod.ftps_connect(*ftp_server.server_address, "user", "secret")
+    try:
+        ftps.voidcmd("TYPE I")
+        feature = ftps_mod.remote_hash_feature(ftps)
+        assert feature is not None
+        assert ftps_mod.verify_file(ftps, os.path.join(job_folder, "a.jpg"), "/upload/job1/a.jpg", feature)
+        # same size, other content: only the hash notices
+        with open(remote, "r+b") as fh:
+            fh.write(b"\0" * 16)
+        assert ftps_mod.verify_file(ftps, os.path.join(job_folder, "a.jpg"), "/upload/job1/a.jpg", None)
+        assert not ftps_mod.verify_file(ftps, os.path.join(job_folder, "a.jpg"), "/upload/job1/a.jpg", feature)
+    finally:
+        ftps.quit()
+
+
+def test_ftps_dropped_connection_fails(ftp_server, job_folder):
+    # the stand-in drops within the first MB of a file
+    with open(os.path.join(job_folder, "big.jpg"), "wb") as fh:
+        fh.write(os.urandom(1100000))
+    ftp_server.setup_faults({"drop_rate": 1.0})
+    config = {"remote_ftp": ftps_target(ftp_server)}
+    ret_code, ret_msg = transfer.upload(config, "remote_ftp", job_folder, (".jpg",), "job1", True)
+    assert ret_code == -1
+    assert ftp_server.stats["drops"] >= 1
+
+
+def test_local_round_trip(tmp_path, job_folder):
+    config = {"local_ftp": {"enable": True, "backend": "local", "target_dir": str(tmp_path / "share"),
+                            "timeout_s": 10, "strip_metadata": []}}
+    assert transfer.upload(config, "local_ftp", job_folder, (".jpg",), "job1", True)[0] == -1
+    os.makedirs(config["local_ftp"]["target_dir"])
+    assert transfer.upload(config, "local_ftp", job_folder, (".jpg",), "job1", True) == (0, "success")
+    assert uploaded_files(str(tmp_path / "share" / "job1")) == expected(job_folder, IMAGES)
+
+
+class _PutHandler(http.server.BaseHTTPRequestHandler):
+    """
+    WebDAV-like PUT/MKCOL sink below server.root with basic auth
+    """
+    protocol_version = "HTTP/1.1"
+
+    def authorized(self):
+        if self.headers.get("Authorization") == "Basic " + base64.b64encode(b"user:secret").decode():
+            return True
+        self.reply(401)
+        return False
+
+    def reply(self, status):
+        self.send_response(status)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def local_path(self):
+        return os.path.join(self.server.root, self.path.lstrip("/"))
+
+    def do_MKCOL(self):
+        if self.authorized():
+            try:
+                os.mkdir(self.local_path().rstrip("/"))
+                self.reply(201)
+            except FileExistsError:
+                self.reply(405)
+
+    def do_PUT(self):
+        data = self.rfile.read(int(self.headers["Content-Length"]))
+        if not self.authorized():
+            return
+        if not os.path.isdir(os.path.dirname(self.local_path())):
+            self.reply(409)
+            return
+        with open(self.local_path(), "wb") as fh:
+            fh.write(data)
+        self.reply(201)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def http_server(tmp_path):
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), _PutHandler)
+    server.root = str(tmp_path / "dav")
+    os.makedirs(os.path.join(server.root, "upload"))
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def http_target(server):
+    return {"enable": True, "backend": "http", "target_dir": "",
+            "url": "http://127.0.0.1:{}/upload".format(server.server_address[1]),
+            "username": "user", "password": "secret", "mkcol": True, "blocksize": 65536,
+            "timeout_s": 10, "strip_metadata": []}
+
+
+def test_http_round_trip(http_server, job_folder):
+    config = {"http": http_target(http_server)}
+    assert transfer.upload(config, "http", job_folder, (".jpg",), "job1", True) == (0, "success")
+    assert uploaded_files(os.path.join(http_server.root, "upload", "job1")) == expected(job_folder, IMAGES)
+
+    config["http"]["password"] = "wrong"
+    assert transfer.upload(config, "http", job_folder, (".jpg",), "job2", True)[0] == -1
+
+
+@pytest.fixture
+def sftp_server(tmp_path, monkeypatch):
+    paramiko = pytest.importorskip("paramiko")
+    from standin_sftp import StandinSFTPServer
+
+    server = StandinSFTPServer(str(tmp_path / "sftp"))
+    os.makedirs(os.path.join(server.root, "upload"))
+    port = server.start()
+
+    # trust the host key of the stand-in only
+    def load_system_host_keys(client, filename=None):
+        client.get_host_keys().add("[127.0.0.1]:{}".format(port), server.host_key.get_name(), server.host_key)
+    monkeypatch.setattr(paramiko.SSHClient, "load_system_host_keys", load_system_host_keys)
+    yield server
+    server.stop()
+
+
+def sftp_target(server):
+    return {"enable": True, "backend": "sftp", "ftp": "127.0.0.1", "port": server.port,
+            "username": "user", "password": "secret", "target_dir": "/upload", "timeout_s": 10,
+            "strip_metadata": []}
+
+
+def test_sftp_round_trip(sftp_server, job_folder):
+    config = {"sftp": sftp_target(sftp_server)}
+    assert transfer.upload(config, "sftp", job_folder, (".jpg",), "job1", True) == (0, "success")
+    assert uploaded_files(os.path.join(sftp_server.root, "upload", "job1")) == expected(job_folder, IMAGES)
+
+    config["sftp"]["password"] = "wrong"
+    assert transfer.upload(config, "sftp", job_folder, (".jpg",), "job2", True)[0] == -1
+
+
+def session_round_trip(config, target, job_folder, remote_job_path):
+    """
+    Two batches of exactly listed files over one session, other files are not uploaded
+    """
+    session = transfer.Session(config, target, "job1")
+    try:
+        assert session.upload_files(job_folder, ["a.jpg"]) == (0, "success")
+        connection = session.backend_session
+        assert session.upload_files(job_folder, ["B.JPG", os.path.join("sub", "c.jpg")]) == (0, "success")
+        assert session.backend_session is connection
+    finally:
+        session.close()
+    assert uploaded_files(remote_job_path) == expected(job_folder, IMAGES)
+
+
+def test_ftps_session(ftp_server, job_folder):
+    # the file a.jpg.bak matches ".jpg" of an ending filter, but is not listed
+    open(os.path.join(job_folder, "a.jpg.bak"), "w").close()
+    session_round_trip({"remote_ftp": ftps_target(ftp_server)}, "remote_ftp", job_folder,
+                       os.path.join(ftp_server.root, "upload", "job1"))
+    assert ftp_server.stats["connections"] == 1
+
+
+def test_ftps_session_reconnects_after_error(ftp_server, job_folder):
+    session = transfer.Session({"remote_ftp": ftps_target(ftp_server)}, "remote_ftp", "job1")
+    try:
+        assert session.upload_files(job_folder, ["missing.jpg"])[0] == -1
+        assert session.backend_session is None
+        assert session.upload_files(job_folder, ["a.jpg"]) == (0, "success")
+    finally:
+        session.close()
+
+
+def test_http_session(http_server, job_folder):
+    session_round_trip({"http": http_target(http_server)}, "http", job_folder,
+                       os.path.join(http_server.root, "upload", "job1"))
+
+
+def test_sftp_session(sftp_server, job_folder):
+    session_round_trip({"sftp": sftp_target(sftp_server)}, "sftp", job_folder,
+                       os.path.join(sftp_server.root, "upload", "job1"))
+
+
+def test_local_session(tmp_path, job_folder):
+    os.makedirs(str(tmp_path / "share"))
+    config = {"local_ftp": {"enable": True, "backend": "local", "target_dir": str(tmp_path / "share"),
+                            "timeout_s": 10, "strip_metadata": []}}
+    session_round_trip(config, "local_ftp", job_folder, str(tmp_path / "share" / "job1"))
+
+
+def test_session_remote_names(tmp_path, job_folder):
+    # e.g. stripped copies uploaded in place of the originals
+    os.makedirs(str(tmp_path / "share"))
+    config = {"local_ftp": {"enable": True, "backend": "local", "target_dir": str(tmp_path / "share"),
+                            "timeout_s": 10, "strip_metadata": []}}
+    session = transfer.Session(config, "local_ftp", "job1")
+    try:
+        assert session.upload_files(job_folder, ["a.jpg", os.path.join("sub", "c.jpg")],
+                                    remote_names=["a.jpg", os.path.join("image", "c.jpg")]) == (0, "success")
+    finally:
+        session.close()
+    images = expected(job_folder, IMAGES)
+    assert uploaded_files(str(tmp_path / "share" / "job1")) == {
+        "a.jpg": images["a.jpg"], os.path.join("image", "c.jpg"): images[os.path.join("sub", "c.jpg")]}
@@ -0,0 +1,66 @@
+"""
+Mount table lookups
+"""
+import os
+
+from libmultiupload import udiskie_mounthelper
+
+
+def write_mounts(path, text):
+    path.write_text(text)
+    # a new mtime even on filesystems with coarse timestamps
+    stat = os.stat(str(path))
+    os.utime(str(path), ns=(stat.st_atime_ns, stat.st_mtime_ns + 1000000000))
+
+
+def test_devices_are_compared_exactly(tmp_path):
+    mounts = tmp_path / "mounts"
+    write_mounts(mounts, "/dev/sdb10 /media/other vfat rw 0 0\n"
+                         "proc /proc proc rw 0 0\n")
+    table = udiskie_mounthelper.MountTable(str(mounts))
+    assert table.mountpoint("/dev/sdb1") is None
+    assert table.mountpoint("/dev/sdb10") == "/media/other"
+
+
+def test_escaped_mountpoints_and_symlinks(tmp_path):
+    device = tmp_path / "sdb1"
+    device.write_text("")
+    link = tmp_path / "by-uuid"
+    link.symlink_to(device)
+    mounts = tmp_path / "mounts"
+    write_mounts(mounts, "{} /media/EOS\\040DIGITAL vfat rw 0 0\n"
+                         "{} /mnt/bind vfat rw 0 0\n".format(device, device))
+    table = udiskie_mounthelper.MountTable(str(mounts))
+    # the first mount of a device, not its bind mounts
+    assert table.mountpoint(str(link)) == "/media/EOS DIGITAL"
+
+
+def test_update_reports_changes(tmp_path):
+    mounts = tmp_path / "mounts"
+    write_mounts(mounts, "/dev/sdb1 /media/card1 vfat rw 0 0\n")
+    table = udiskie_mounthelper.MountTable(str(mounts))
+    assert table.update() == ({}, {})
+
+    write_mounts(mounts, "/dev/sdc1 /media/card2 vfat rw 0 0\n")
+    assert table.update() == ({"/dev/sdc1": "/media/card2"}, {"/dev/sdb1": "/media/card1"})
+    assert table.update() == ({}, {})
+    assert table.mountpoint("/dev/sdb1") is None
+
+
+def test_check_if_mounted(tmp_path, monkeypatch):
+    mounts = tmp_path / "mounts"
+    write_mounts(mounts, "/dev/sdb1 /media/card1 vfat rw 0 0\n")
+    monkeypatch.setattr(udiskie_mounthelper, "_mount_table", udiskie_mounthelper.MountTable(str(mounts)))
+    assert udiskie_mounthelper.check_if_mounted("/dev/sdb1") == "/media/card1"
+    assert udiskie_mounthelper.check_if_mounted("/dev/sdb") == 0
+
+
+def test_filesystem_type(tmp_path):
+    mounts = tmp_path / "mounts"
+    mounts.write_text("/dev/sda2 / ext4 rw 0 0\n"
+                      "server:/export /mnt/spool nfs4 rw 0 0\n"
+                      "/dev/sdb1 /mnt/spool\\040card vfat rw 0 0\n")
+    assert udiskie_mounthelper.filesystem_type("/mnt/spool/history.db", str(mounts)) == "nfs4"
+    assert udiskie_mounthelper.filesystem_type("/mnt/spool card/DCIM", str(mounts)) == "vfat"
+    assert udiskie_mounthelper.filesystem_type("/mnt/spoolx/history.db", str(mounts)) == "ext4"
+    assert udiskie_mounthelper.filesystem_type("/mnt", str(tmp_path / "missing")) is None
@@ -0,0 +1,78 @@
+"""
+Video proxies: a stand-in ffmpeg which copies, fails or hangs (killed after timeout_s)
+"""
+import os
+import stat
+import time
+
+import pytest
+
+from libmultiupload import progress, video_transcode
+
+# arguments: -hide_banner -nostdin -y -i <src> ... <tmp_path> (last)
+FFMPEG = """#!/bin/sh
+for arg; do out="$arg"; done
+case "$(basename "$5")" in
+    hang*) exec sleep 60;;
+    fail*) exit 1;;
+esac
+echo out_time_us=500000
+echo progress=continue
+cp "$5" "$out"
+echo progress=end
+"""
+
+
+def script(path, text):
+    with open(path, "w") as fh:
+        fh.write(text)
+    os.chmod(path, os.stat(path).st_mode | stat.S_IXUSR)
+    return path
+
+
+@pytest.fixture
+def video_config(tmp_path):
+    return {"ffmpeg": script(str(tmp_path / "ffmpeg"), FFMPEG),
+            "ffprobe": script(str(tmp_path / "ffprobe"), "#!/bin/sh\necho 1.0\n"),
+            "ffmpeg_args": [], "extension": ".m4v", "workers": 2, "timeout_s": 0.5}
+
+
+@pytest.fixture
+def videos(tmp_path):
+    path = tmp_path / "video"
+    (path / "sub").mkdir(parents=True)
+    for name in ("a.mp4", os.path.join("sub", "b.mp4"), "fail.mp4", "hang.mp4"):
+        (path / name).write_bytes(b"video " + name.encode())
+    return str(path)
+
+
+def test_proxy_is_renamed_when_finished(tmp_path, video_config, videos):
+    dest_path = str(tmp_path / "a.m4v")
+    prog = progress.Progress(None, "job", "video")
+    assert video_transcode.make_proxy(os.path.join(videos, "a.mp4"), dest_path, video_config, prog) == 0
+    with open(dest_path, "rb") as fh:
+        assert fh.read() == b"video a.mp4"
+    assert not os.path.exists(str(tmp_path / ".a.m4v.part"))
+    assert (prog.files_done, prog.bytes_done) == (1, len(b"video a.mp4"))
+
+    # up to date: not transcoded again (the stand-in would fail now)
+    video_config["ffmpeg"] = "/nonexistent/ffmpeg"
+    assert video_transcode.make_proxy(os.path.join(videos, "a.mp4"), dest_path, video_config) == 0
+
+
+def test_hung_ffmpeg_is_killed(tmp_path, video_config, videos):
+    dest_path = str(tmp_path / "hang.m4v")
+    start = time.monotonic()
+    assert video_transcode.make_proxy(os.path.join(videos, "hang.mp4"), dest_path, video_config) == -1
+    assert time.monotonic() - start < 10
+    assert not os.path.exists(dest_path)
+    assert not os.path.exists(str(tmp_path / ".hang.m4v.part"))
+
+
+def test_failed_videos_are_counted(tmp_path, video_config, videos):
+    proxy_path = str(tmp_path / "video_thumb")
+    prog = progress.Progress(None, "job", "video")
+    assert video_transcode.make_proxies(videos, proxy_path, (".mp4",), video_config, prog) == 2
+    assert sorted(os.listdir(proxy_path)) == ["a.m4v", "sub"]
+    assert os.listdir(os.path.join(proxy_path, "sub")) == ["b.m4v"]
+    assert prog.files_done == prog.files_total == 4
@@ -0,0 +1,101 @@
+"""
+Drop folder watch: complete files, batches and their submission
+"""
+import os
+import threading
+import time
+
+from libmultiupload import watch_folder
+
+
+def poll_until(folder, timeout):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        batch = folder.poll(0.05)
+        if batch:
+            return batch
+    return []
+
+
+def test_batch_after_settle_and_quiet(tmp_path):
+    drop = tmp_path / "drop"
+    drop.mkdir()
+    folder = watch_folder.WatchFolder(str(drop), 0.2, 0.4)
+    try:
+        (drop / "a.jpg").write_bytes(b"a")
+        writer = open(str(drop / "open.jpg"), "wb")
+        writer.write(b"still writing")
+        writer.flush()
+        assert folder.poll(0.05) == []
+        (drop / "sub").mkdir()
+        time.sleep(0.05)
+        (drop / "sub" / "b.jpg").write_bytes(b"b")
+        start = time.monotonic()
+        batch = poll_until(folder, 3)
+        # quiet for batch_quiet_s after the last event, the open file is not part of it
+        assert time.monotonic() - start >= 0.3
+        assert sorted(batch) == [str(drop / "a.jpg"), str(drop / "sub" / "b.jpg")]
+
+        writer.close()
+        assert poll_until(folder, 3) == [str(drop / "open.jpg")]
+    finally:
+        folder.close()
+
+
+def test_stage_batch_keeps_subfolders(tmp_path):
+    drop = tmp_path / "drop"
+    (drop / "sub").mkdir(parents=True)
+    (drop / "a.jpg").write_bytes(b"a")
+    (drop / "sub" / "b.jpg").write_bytes(b"b")
+    staging = tmp_path / "staging"
+    batch = [str(drop / "a.jpg"), str(drop / "sub" / "b.jpg")]
+
+    first = watch_folder.stage_batch(str(drop), batch[:1], str(staging), "batch")
+    second = watch_folder.stage_batch(str(drop), batch[1:], str(staging), "batch")
+    assert (os.path.basename(first), os.path.basename(second)) == ("batch", "batch_1")
+    assert (staging / "batch" / "a.jpg").read_bytes() == b"a"
+    assert (staging / "batch_1" / "sub" / "b.jpg").read_bytes() == b"b"
+    assert os.listdir(str(drop)) == ["sub"] and os.listdir(str(drop / "sub")) == []
+
+
+def test_batches_are_kept_until_accepted(tmp_path):
+    drop = tmp_path / "drop"
+    drop.mkdir()
+    staging = tmp_path / "staging"
+    (staging / "earlier").mkdir(parents=True)
+    config = {"default_source_path": str(drop), "timestamp": "batch",
+              "watch": {"staging_path": str(staging), "settle_s": 0.0, "batch_quiet_s": 0.1}}
+    accept = threading.Event()
+    attempts = []
+    submitted = []
+
+    def submit(batch_dir):
+        # analyze queue full until accept is set
+        attempts.append(batch_dir)
+        if not accept.is_set():
+            return False
+        submitted.append(os.path.basename(batch_dir))
+        return True
+
+    stop_event = threading.Event()
+    thread = threading.Thread(target=watch_folder.watch, args=(submit, config, stop_event), daemon=True)
+    thread.start()
+    try:
+        time.sleep(0.2)
+        (drop / "a.jpg").write_bytes(b"a")
+        for _ in range(100):
+            if os.path.isdir(str(staging / "batch")):
+                break
+            time.sleep(0.05)
+        # staged while the queue is full, retried with every poll but not in a busy loop
+        assert (staging / "batch" / "a.jpg").read_bytes() == b"a"
+        assert 2 <= len(attempts) < 100
+        accept.set()
+        for _ in range(100):
+            if len(submitted) == 2:
+                break
+            time.sleep(0.05)
+        assert submitted == ["earlier", "batch"]
+    finally:
+        stop_event.set()
+        thread.join(5)
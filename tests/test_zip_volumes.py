@@ -0,0 +1,47 @@
+"""
+Zip volumes: split by size, named <job>.zip or <job>.partNN.zip, every volume complete
+"""
+import os
+import zipfile
+
+from libmultiupload import zip_volumes
+
+
+def test_plan_volumes_keeps_order_and_limit():
+    files = [("a", 40), ("b", 50), ("c", 20), ("d", 150), ("e", 10)]
+    assert zip_volumes.plan_volumes(files, 100) == [[("a", 40), ("b", 50)], [("c", 20)], [("d", 150)], [("e", 10)]]
+    assert zip_volumes.plan_volumes(files, 0) == [files]
+    assert zip_volumes.plan_volumes([], 100) == []
+
+
+def test_volume_names():
+    assert zip_volumes.volume_names("/tmp/job", 1) == ["/tmp/job.zip"]
+    assert zip_volumes.volume_names("/tmp/job", 3) == ["/tmp/job.part01.zip", "/tmp/job.part02.zip",
+                                                       "/tmp/job.part03.zip"]
+
+
+def test_make_volumes(tmp_path):
+    source = tmp_path / "image"
+    (source / "sub").mkdir(parents=True)
+    contents = {}
+    for name in ("a.jpg", "b.jpg", os.path.join("sub", "c.jpg")):
+        contents[name] = os.urandom(600)
+        (source / name).write_bytes(contents[name])
+
+    done = []
+    volumes = zip_volumes.make_volumes(str(source), str(tmp_path / "job"), 1000, 2, on_done=done.append)
+    assert volumes == [str(tmp_path / "job.part01.zip"), str(tmp_path / "job.part02.zip"),
+                       str(tmp_path / "job.part03.zip")]
+    assert sorted(done) == volumes
+    assert not [name for name in os.listdir(str(tmp_path)) if name.endswith(".part")]
+    archived = {}
+    for volume in volumes:
+        with zipfile.ZipFile(volume) as archive:
+            assert archive.testzip() is None
+            for name in archive.namelist():
+                archived[name] = archive.read(name)
+    assert archived == {name.replace(os.sep, "/"): data for name, data in contents.items()}
+
+    # no limit: a single volume with the old name
+    assert zip_volumes.make_volumes(str(source), str(tmp_path / "single"), 0, 2) == [str(tmp_path / "single.zip")]
+    assert zip_volumes.make_volumes(str(tmp_path / "missing"), str(tmp_path / "job"), 0, 2) == -1